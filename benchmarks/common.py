@@ -0,0 +1,25 @@
+import os
+import subprocess
+
+REPORT_DIR = os.path.join(os.path.dirname(__file__), 'reports')
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def git_rev() -> str:
+    """当前代码版本"""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            text=True,
+            stderr=subprocess.DEVNULL,
+        ).strip()
+    except Exception:
+        return 'unknown'
+
+
+def pct(data: list[float], p: float) -> float:
+    """分位数"""
+    if not data:
+        return 0
+    data = sorted(data)
+    return data[min(len(data) - 1, int(len(data) * p))]
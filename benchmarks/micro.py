@@ -0,0 +1,431 @@
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Callable
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from benchmarks.common import FIXTURE_DIR, REPORT_DIR, git_rev
+from exchanges.binance import Binance
+from exchanges.conn_pool import ConnPool
+from exchanges.exchange import Exchange
+from exchanges.gate import Gate
+from exchanges.order_store import OrderStore
+from exchanges.orderbook import OrderBook
+from exchanges.ws import WS
+from models.models import *
+from strategy.hedge import HedgeStrategy
+from tool import logger
+from tool.mathx import floor, prec
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# 名字 -> 准备函数(返回被测的无参函数)
+BENCHES: dict[str, Callable[[], Callable[[], object]]] = {}
+
+
+def bench(name: str):
+    """注册一个基准"""
+
+    def wrap(setup):
+        BENCHES[name] = setup
+        return setup
+
+    return wrap
+
+
+def drive(coro):
+    """同步执行一个不会挂起的协程，避免把事件循环的开销算进去"""
+    try:
+        coro.send(None)
+    except StopIteration as e:
+        return e.value
+    coro.close()
+    raise RuntimeError('协程挂起了，不能直接驱动')
+
+
+def fixture(name: str) -> list[str]:
+    with open(os.path.join(FIXTURE_DIR, name)) as f:
+        return json.load(f)
+
+
+async def noop(*args):
+    pass
+
+
+class StubConn:
+    """不走网络的ws连接，只用来测ConnPool本身的开销"""
+    closed = False
+
+    async def send(self, data):
+        pass
+
+
+def exchanges() -> tuple[Binance, Gate]:
+    bnb = Binance(Secret())
+    gate = Gate(Secret())
+    for ex in [bnb, gate]:
+        ex.listen_bbo(noop)
+        ex.listen_order(noop)
+        ex.account.swap_balance = 1000
+        ex.account.swap_available = 1000
+        ex.rules['XUSDT'] = ContractRule(
+            symbol='XUSDT',
+            price_prec=4,
+            amount_prec=0,
+            max_amount=1000000,
+            min_amount=1,
+            trade_leverage=10,
+        )
+    return bnb, gate
+
+
+# ---------- 行情解析 ----------
+
+
+@bench('binance.pub_msg')
+def _():
+    ex, _ = exchanges()
+    frames = fixture('binance_book_ticker.json')
+    symbol = 'BTCUSDT'
+    i = [0]
+
+    def op():
+        i[0] += 1
+        return drive(ex.pub_msg(None, symbol, frames[i[0] % len(frames)]))
+
+    return op
+
+
+@bench('gate.pub_msg')
+def _():
+    _, ex = exchanges()
+    frames = fixture('gate_book_ticker.json')
+    symbol = 'BTCUSDT'
+    i = [0]
+
+    def op():
+        i[0] += 1
+        return drive(ex.pub_msg(None, symbol, frames[i[0] % len(frames)]))
+
+    return op
+
+
+@bench('BBO()')
+def _():
+    return lambda: BBO(
+        'BTCUSDT',
+        '67712.5',
+        '5.382',
+        '67712.6',
+        '3.121',
+        1729321200123,
+    )
+
+
+# ---------- 取行情 ----------
+
+
+@bench('get_last_bbo')
+def _():
+    ex, _ = exchanges()
+    ex.bbos['BTCUSDT'] = BBO('BTCUSDT', 1, 1, 1, 1, 0)
+    return lambda: ex.get_last_bbo('BTCUSDT')
+
+
+@bench('get_last_bbo.1000')
+def _():
+    ex, _ = exchanges()
+    ex.bbos['1000PEPEUSDT'] = BBO('1000PEPEUSDT', 0.0098, 1000, 0.0099, 1000, 0)
+    return lambda: ex.get_last_bbo('PEPEUSDT')
+
+
+# ---------- 策略 ----------
+
+
+def strategy(m_bbo: BBO, s_bbo: BBO) -> tuple[HedgeStrategy, list[Exchange]]:
+    bnb, gate = exchanges()
+    bnb.bbos['XUSDT'] = m_bbo
+    gate.bbos['XUSDT'] = s_bbo
+    s = HedgeStrategy()
+    # 基准里不输出日志
+    s.log = logger.get_logger('bench')
+    s.log.disabled = True
+    return s, [bnb, gate]
+
+
+@bench('gen_signal.none')
+def _():
+    now = 1729321200000
+    s, exs = strategy(
+        BBO('XUSDT', 1.0, 1000, 1.0001, 1000, now),
+        BBO('XUSDT', 1.0, 1000, 1.0001, 1000, now),
+    )
+    return lambda: s.gen_signal(now, 'XUSDT', exs)
+
+
+@bench('gen_signal.open')
+def _():
+    now = 1729321200000
+    s, exs = strategy(
+        BBO('XUSDT', 1.01, 1000, 1.0101, 1000, now),
+        BBO('XUSDT', 0.9999, 1000, 1.0, 1000, now),
+    )
+
+    def op():
+        signal = s.gen_signal(now, 'XUSDT', exs)
+        assert signal
+        return signal
+
+    return op
+
+
+@bench('gen_signal.close')
+def _():
+    now = 1729321200000
+    s, (bnb, gate) = strategy(
+        BBO('XUSDT', 1.0, 1000, 1.0001, 1000, now),
+        BBO('XUSDT', 1.0001, 1000, 1.0002, 1000, now),
+    )
+    bnb.pos['XUSDTSELL'] = Position('XUSDT', 'XUSDTSELL', Side.SELL, 1.02, 100)
+    gate.pos['XUSDTBUY'] = Position('XUSDT', 'XUSDTBUY', Side.BUY, 0.98, 100)
+    exs = [bnb, gate]
+
+    def op():
+        signal = s.gen_signal(now, 'XUSDT', exs)
+        assert signal
+        return signal
+
+    return op
+
+
+# ---------- 工具 ----------
+
+
+@bench('mathx.floor')
+def _():
+    return lambda: floor(1234.56789, 3)
+
+
+@bench('mathx.prec')
+def _():
+    return lambda: prec(0.00001)
+
+
+# ---------- 下单 ----------
+
+
+@bench('binance.order_request')
+def _():
+    ex, _ = exchanges()
+    return lambda: ex.order_request(
+        'XUSDT',
+        Side.BUY,
+        TradeSide.OPEN,
+        OrderType.MARKET,
+        12,
+    )
+
+
+@bench('gate.order_request')
+def _():
+    _, ex = exchanges()
+    return lambda: ex.order_request(
+        'XUSDT',
+        Side.BUY,
+        TradeSide.OPEN,
+        OrderType.MARKET,
+        12,
+    )
+
+
+@bench('OrderStore.put')
+def _():
+    store = OrderStore()
+    i = [0]
+
+    def op():
+        # 每个订单先挂单再成交，已结束的订单按LRU淘汰
+        i[0] += 1
+        id = str(i[0])
+        order = Order('Binance', 'XUSDT', id, OrderStatus.NEW, Side.BUY,
+                      TradeSide.OPEN, client_id='c' + id)
+        store.put(order)
+        order.status = OrderStatus.FILLED
+        store.put(order)
+
+    return op
+
+
+@bench('OrderBook.on_diff')
+def _():
+    book = OrderBook('XUSDT', levels=100)
+    book.on_snapshot(1, [(100 - i * 0.1, 1) for i in range(100)],
+                     [(100.1 + i * 0.1, 1) for i in range(100)], 0)
+    i = [0]
+
+    def op():
+        # 一条增量改靠近盘口的几档，每10条删掉再补回一档
+        i[0] += 1
+        n = i[0]
+        amount = 0 if n % 10 == 0 else n % 7 + 1
+        bids = [(100.0, n % 5 + 1), (99.8, amount)]
+        asks = [(100.1, n % 3 + 1), (100.3, amount)]
+        book.on_diff(n, n, n - 1, bids, asks, n)
+
+    return op
+
+
+@bench('OrderBook.depth')
+def _():
+    book = OrderBook('XUSDT', levels=100)
+    book.on_snapshot(0, [(100 - i * 0.1, 1) for i in range(100)],
+                     [(100.1 + i * 0.1, 1) for i in range(100)], 0)
+    return lambda: book.depth(Side.BUY, 101.5) + book.depth(Side.SELL, 98.5)
+
+
+@bench('ConnPool.send')
+def _():
+    ex, _ = exchanges()
+
+    def new_ws() -> WS:
+        ws = WS(uri='', name='bench')
+        ws.ws = StubConn()
+        return ws
+
+    pool = ConnPool(ex.log, new_ws)
+    pool.wss = [new_ws() for _ in range(5)]
+    _, req = ex.order_request(
+        'XUSDT',
+        Side.BUY,
+        TradeSide.OPEN,
+        OrderType.MARKET,
+        12,
+    )
+    return lambda: drive(pool.send(req))
+
+
+def measure(
+    op: Callable[[], object],
+    min_time: float = 0.2,
+    repeat: int = 5,
+) -> dict:
+    """
+    耗时: 自动确定批量次数，重复多轮取最小值(ns/op)
+    内存: tracemalloc统计一轮里的临时内存峰值，以及前后两次快照之间每次调用净增的内存块数和字节数(泄漏)
+    """
+    # 预热并确定批量次数
+    number = 1
+    while 1:
+        t = time.perf_counter()
+        for _ in range(number):
+            op()
+        if time.perf_counter() - t >= min_time / repeat:
+            break
+        number *= 2
+
+    gc.disable()
+    try:
+        best = None
+        for _ in range(repeat):
+            t = time.perf_counter_ns()
+            for _ in range(number):
+                op()
+            ns = (time.perf_counter_ns() - t) / number
+            best = ns if best is None else min(best, ns)
+
+        n = min(number, 1000)
+        tracemalloc.start()
+        # 快照对象本身的分配不算
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        before = tracemalloc.take_snapshot().filter_traces(ignore)
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        for _ in range(n):
+            op()
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot().filter_traces(ignore)
+        tracemalloc.stop()
+        diff = after.compare_to(before, 'filename')
+        blocks = sum(d.count_diff for d in diff) / n
+        size = sum(d.size_diff for d in diff) / n
+    finally:
+        gc.enable()
+
+    return {
+        'ns_op': round(best, 1),
+        'peak_bytes': peak - current,
+        'blocks_op': round(blocks, 2),
+        'bytes_op': round(size, 1),
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """和基线比较，返回变慢超过阈值的基准"""
+    slower = []
+    for name, r in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]['ns_op']
+        r['baseline_ns_op'] = base
+        r['change'] = round(r['ns_op'] / base - 1, 3) if base else 0
+        if r['change'] > threshold:
+            slower.append(name)
+    return slower
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='热路径微基准')
+    parser.add_argument('-k', default='', help='只跑名字里包含该字符串的基准')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save', action='store_true', help='把本次结果存为基线')
+    parser.add_argument('--threshold', type=float, default=0.2, help='允许变慢的比例')
+    parser.add_argument('--out', default='')
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+    results = {}
+    for name, setup in BENCHES.items():
+        if args.k not in name:
+            continue
+        results[name] = measure(setup())
+
+    slower = compare(results, baseline, args.threshold)
+    for name, r in results.items():
+        msg = f"{name:<24}{r['ns_op']:>10.1f} ns/op"
+        msg += f" {r['peak_bytes']:>7} B峰值 {r['blocks_op']:>6} 块/op {r['bytes_op']:>7} B/op"
+        if 'change' in r:
+            msg += f" 基线:{r['baseline_ns_op']:.1f} {r['change'] * 100:+.1f}%"
+        if name in slower:
+            msg += ' 变慢'
+        print(msg)
+
+    report = {
+        'version': git_rev(),
+        'time': int(time.time()),
+        'python': sys.version.split()[0],
+        'results': results,
+    }
+    out = args.out
+    if not out:
+        os.makedirs(REPORT_DIR, exist_ok=True)
+        name = f"micro_{report['version']}_{report['time']}.json"
+        out = os.path.join(REPORT_DIR, name)
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'基线已保存 {args.baseline}')
+    elif slower:
+        print(f'变慢超过{args.threshold * 100:.0f}%: {", ".join(slower)}')
+        sys.exit(1)
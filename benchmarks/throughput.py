@@ -0,0 +1,223 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from benchmarks.common import REPORT_DIR, git_rev, pct
+from sim.feed import FeedConfig, gen_symbols, start_process
+
+
+def rss_kb() -> int:
+    """当前进程的常驻内存(KB)"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') // 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+async def measure(
+    config: FeedConfig,
+    port: int,
+    warmup: float,
+    duration: float,
+    max_late: float,
+    workers: int = 0,
+) -> dict:
+    """
+    起一个行情服务进程，用Trader的真实连接方式(每个交易所每个交易对一条ws)接入
+    统计送达率、行情迟到(本地时间-行情时间)、事件循环延迟、每条连接的内存
+    workers>0时用多进程分片收行情(FeedShards)，两次轮询之间的更新会合并，送达率按合并后算
+    """
+    from exchanges.binance import Binance
+    from exchanges.feed_shards import FeedShards
+    from exchanges.gate import Gate
+    from models.models import ContractRule, Secret
+    from strategy.hedge import HedgeStrategy
+    from tool.ratelimit import TokenBucket
+    from tool.timex import time_ms
+    from trader import Trader
+
+    proc, sent = start_process(config, '127.0.0.1', port)
+    await asyncio.sleep(1)
+
+    symbols = gen_symbols(config.symbols)
+    trader = Trader(HedgeStrategy())
+    trader.add_exchagne(Binance(Secret()))
+    trader.add_exchagne(Gate(Secret()))
+
+    state = {'recording': False, 'recv': 0}
+    late: list[int] = []
+    lag: list[float] = []
+
+    for ex in trader.exchanges.values():
+        ex.rules = {s: ContractRule(s) for s in symbols}
+        # 本地压测服务不限建连速率
+        ex.governor.buckets['conn'] = TokenBucket(1e9, 1e9)
+        on_bbo = ex.emit_bbo
+
+        async def probe(bbo, on_bbo=on_bbo):
+            if state['recording']:
+                state['recv'] += 1
+                late.append(time_ms() - bbo.time)
+            await on_bbo(bbo)
+
+        ex.emit_bbo = probe
+
+    async def loop_lag():
+        while 1:
+            t = time.perf_counter()
+            await asyncio.sleep(0.01)
+            if state['recording']:
+                lag.append((time.perf_counter() - t - 0.01) * 1000)
+
+    rss_start = rss_kb()
+    tasks = [asyncio.create_task(loop_lag())]
+    if workers:
+        feed = FeedShards(list(trader.exchanges.values()), symbols, workers,
+                          conn_limit=False)
+        tasks.append(asyncio.create_task(feed.run()))
+    else:
+        for symbol in symbols:
+            for ex in trader.exchanges.values():
+                tasks.append(asyncio.create_task(ex.listen_public(symbol)))
+
+    await asyncio.sleep(warmup)
+    rss_end = rss_kb()
+    sent_start = sent.value
+    state['recording'] = True
+    await asyncio.sleep(duration)
+    state['recording'] = False
+    sent_count = sent.value - sent_start
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    proc.terminate()
+    proc.join()
+
+    conns = config.symbols * len(trader.exchanges)
+    delivered = state['recv'] / sent_count if sent_count else 0
+    result = {
+        'workers': workers,
+        'symbols': config.symbols,
+        'conns': conns,
+        'rate_per_conn': config.rate,
+        'offered_per_s': sent_count / duration,
+        'recv_per_s': state['recv'] / duration,
+        'delivered': delivered,
+        'late_p50_ms': pct(late, 0.5),
+        'late_p99_ms': pct(late, 0.99),
+        'late_max_ms': max(late) if late else 0,
+        'loop_lag_p99_ms': pct(lag, 0.99),
+        'loop_lag_max_ms': max(lag) if lag else 0,
+        'rss_per_conn_kb': (rss_end - rss_start) / conns if conns else 0,
+    }
+    result['ok'] = delivered >= 0.95 and result['late_p99_ms'] <= max_late
+    return result
+
+
+async def sweep(args) -> dict:
+    # 配置在第一次读取时加载、交易所地址在导入时读取，所有轮次共用一个端口
+    port = args.port
+    os.environ['DYNACONF_BINANCE_WS'] = f'ws://127.0.0.1:{port}'
+    os.environ['DYNACONF_GATE_WS'] = f'ws://127.0.0.1:{port}/v4/ws/usdt'
+    from config import settings
+
+    max_late = args.max_late or settings.max_delay
+    report = {
+        'version': git_rev(),
+        'time': int(time.time()),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'max_late_ms': max_late,
+        'rate_sweep': [],
+        'symbol_sweep': [],
+    }
+
+    def log(r: dict):
+        state = 'OK' if r['ok'] else '超限'
+        print(f"交易对:{r['symbols']} 速率:{r['rate_per_conn']}/s "
+              f"送达:{r['recv_per_s']:.0f}/{r['offered_per_s']:.0f}/s "
+              f"迟到p99:{r['late_p99_ms']}ms 循环延迟p99:{r['loop_lag_p99_ms']:.1f}ms "
+              f"内存/连接:{r['rss_per_conn_kb']:.0f}KB {state}")
+
+    # 固定交易对数量，逐步加大每条连接的速率
+    max_rate = 0
+    rate = args.start_rate
+    while rate <= args.max_rate:
+        config = FeedConfig(
+            args.symbols,
+            rate,
+            args.burst_x,
+            args.burst_every,
+            args.burst_len,
+        )
+        r = await measure(config, port, args.warmup, args.duration, max_late,
+                          args.workers)
+        report['rate_sweep'].append(r)
+        log(r)
+        if not r['ok']:
+            break
+        max_rate = r['recv_per_s']
+        rate *= 2
+    report['max_msgs_per_s'] = max_rate
+
+    # 固定速率，逐步加大交易对数量
+    max_symbols = 0
+    symbols = args.symbols
+    while symbols <= args.max_symbols:
+        config = FeedConfig(
+            symbols,
+            args.start_rate,
+            args.burst_x,
+            args.burst_every,
+            args.burst_len,
+        )
+        r = await measure(config, port, args.warmup, args.duration, max_late,
+                          args.workers)
+        report['symbol_sweep'].append(r)
+        log(r)
+        if not r['ok']:
+            break
+        max_symbols = symbols
+        symbols *= 2
+    report['max_symbols'] = max_symbols
+
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='行情吞吐压测')
+    parser.add_argument('--port', type=int, default=18800)
+    parser.add_argument('--symbols', type=int, default=50)
+    parser.add_argument('--max-symbols', type=int, default=1600)
+    parser.add_argument('--start-rate', type=float, default=10)
+    parser.add_argument('--max-rate', type=float, default=1000)
+    parser.add_argument('--burst-x', type=float, default=1)
+    parser.add_argument('--burst-every', type=float, default=10)
+    parser.add_argument('--burst-len', type=float, default=1)
+    parser.add_argument('--warmup', type=float, default=3)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--max-late', type=float, default=0, help='默认取max_delay')
+    parser.add_argument('--workers', type=int, default=0, help='行情进程数，0为单进程')
+    parser.add_argument('--out', default='')
+    args = parser.parse_args()
+
+    report = asyncio.run(sweep(args))
+
+    out = args.out
+    if not out:
+        os.makedirs(REPORT_DIR, exist_ok=True)
+        name = f"throughput_{report['version']}_{report['time']}.json"
+        out = os.path.join(REPORT_DIR, name)
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'报告已写入 {out}')
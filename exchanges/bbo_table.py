@@ -0,0 +1,201 @@
+import json
+import struct
+from multiprocessing import resource_tracker, shared_memory
+
+from models.models import *
+
+# 表头: 槽位数, 分片数, 目录长度
+HEADER = struct.Struct('<qqq')
+HEADER_SIZE = 64
+# 序号和分片版本号
+SEQ = struct.Struct('<q')
+# 每个分片的版本号独占一个缓存行
+SHARD_SIZE = 64
+# 槽位: 序号, 买一价, 买一量, 卖一价, 卖一量, 时间
+SLOT = struct.Struct('<qddddq')
+SLOT_DATA = struct.Struct('<ddddq')
+SLOT_SIZE = 64
+
+
+class BBOTable:
+    """
+    共享内存里的bbo表，每个(交易所, 交易对)一个定长槽位
+    每个槽位只有一个写进程，用seqlock做版本: 写之前序号+1(奇数)，写完再+1(偶数)
+    读的时候前后两次序号一致并且是偶数才算读到完整的一份，不用加锁也不用进程间拷贝
+    每个分片(一个写进程)有一个版本号，写完任意槽位都会+1，读的一方先看版本号再扫分片
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        self.shm = shm
+        self.owner = owner
+        self.buf = shm.buf
+
+        slots, shards, dir_len = HEADER.unpack_from(self.buf, 0)
+        self.shards = shards
+        self.slot_base = HEADER_SIZE + shards * SHARD_SIZE
+        dir_base = self.slot_base + slots * SLOT_SIZE
+        # 目录: [(交易所, 交易对, 分片)]，槽位号就是下标
+        self.keys: list[tuple[str, str, int]] = [
+            tuple(k)
+            for k in json.loads(bytes(self.buf[dir_base:dir_base + dir_len]))
+        ]
+        # (交易所, 交易对) -> 槽位
+        self.index = {(ex, symbol): i for i, (ex, symbol, _) in enumerate(self.keys)}
+
+        # 写进程本地的序号，省掉写之前的一次读
+        self.seqs = [0] * len(self.keys)
+        self.versions = [0] * shards
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @classmethod
+    def create(
+        cls,
+        keys: list[tuple[str, str, int]],
+        name: str | None = None,
+    ) -> 'BBOTable':
+        """创建表，keys: [(交易所, 交易对, 分片)]"""
+        shards = max([k[2] for k in keys], default=-1) + 1
+        directory = json.dumps(keys).encode()
+        size = (HEADER_SIZE + shards * SHARD_SIZE + len(keys) * SLOT_SIZE +
+                len(directory))
+        shm = shared_memory.SharedMemory(name, create=True, size=size)
+        HEADER.pack_into(shm.buf, 0, len(keys), shards, len(directory))
+        base = size - len(directory)
+        shm.buf[base:size] = directory
+        return cls(shm, True)
+
+    @classmethod
+    def attach(cls, name: str, untrack: bool = True) -> 'BBOTable':
+        """
+        按名字接入已有的表
+        untrack: 接入方不负责回收，不让本进程的resource_tracker在退出时删掉
+        创建方spawn出来的子进程和创建方共用resource_tracker，不需要(也不能)取消
+        """
+        shm = shared_memory.SharedMemory(name)
+        if untrack:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, False)
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def shard_slots(self, shard: int) -> list[int]:
+        return [i for i, k in enumerate(self.keys) if k[2] == shard]
+
+    def own(self, shard: int):
+        """
+        写进程接管分片，从表里的序号接着写(写进程重启后序号不会倒退)
+        上一个写进程写到一半退出的槽位序号是奇数，直接补成偶数
+        """
+        for slot in self.shard_slots(shard):
+            seq = self.seq(slot)
+            if seq & 1:
+                seq += 1
+                SEQ.pack_into(self.buf, self.slot_base + slot * SLOT_SIZE, seq)
+            self.seqs[slot] = seq
+        self.versions[shard] = self.version(shard)
+
+    def write(self, slot: int, bbo: BBO):
+        """写一个槽位，只能由槽位所属的分片调用"""
+        buf = self.buf
+        offset = self.slot_base + slot * SLOT_SIZE
+        seq = self.seqs[slot] + 1
+        SEQ.pack_into(buf, offset, seq)
+        SLOT_DATA.pack_into(buf, offset + 8, bbo.bid, bbo.bid_amount, bbo.ask,
+                            bbo.ask_amount, bbo.time)
+        SEQ.pack_into(buf, offset, seq + 1)
+        self.seqs[slot] = seq + 1
+
+        shard = self.keys[slot][2]
+        version = self.versions[shard] + 1
+        self.versions[shard] = version
+        SEQ.pack_into(buf, HEADER_SIZE + shard * SHARD_SIZE, version)
+
+    def version(self, shard: int) -> int:
+        return SEQ.unpack_from(self.buf, HEADER_SIZE + shard * SHARD_SIZE)[0]
+
+    def seq(self, slot: int) -> int:
+        return SEQ.unpack_from(self.buf, self.slot_base + slot * SLOT_SIZE)[0]
+
+    def read(
+        self,
+        slot: int,
+        spins: int = 1000,
+    ) -> tuple[int, float, float, float, float, int] | None:
+        """
+        读一个槽位的一致快照
+        return: (序号, 买一价, 买一量, 卖一价, 卖一量, 时间)，序号为0表示还没写过
+        一直读不到(写进程写到一半挂了)返回None
+        """
+        buf = self.buf
+        offset = self.slot_base + slot * SLOT_SIZE
+        for _ in range(spins):
+            data = SLOT.unpack_from(buf, offset)
+            seq = data[0]
+            if seq & 1:
+                continue
+            if SEQ.unpack_from(buf, offset)[0] == seq:
+                return data
+        return None
+
+
+class BBOReader:
+    """
+    读共享表，把有变化的槽位写回本进程交易所对象的bbos并触发emit_bbo
+    两次读之间同一个槽位的多次更新只取最新的
+    """
+
+    def __init__(
+        self,
+        table: BBOTable,
+        exchanges: list,
+        symbols: list[str] | None = None,
+    ):
+        self.table = table
+        exchanges = {ex.__class__.__name__: ex for ex in exchanges}
+        wanted = set(symbols) if symbols is not None else None
+
+        # 分片 -> 要读的槽位
+        self.slots: list[list[int]] = [[] for _ in range(table.shards)]
+        # 槽位 -> (交易所, 交易对)
+        self.targets: dict[int, tuple] = {}
+        for slot, (ex_name, symbol, shard) in enumerate(table.keys):
+            ex = exchanges.get(ex_name)
+            if not ex or (wanted is not None and symbol not in wanted):
+                continue
+            self.slots[shard].append(slot)
+            self.targets[slot] = (ex, symbol)
+
+        # 已经读过的分片版本号和槽位序号
+        self.versions = [0] * table.shards
+        self.seqs = [0] * len(table.keys)
+
+    async def poll(self) -> int:
+        """推送有变化的槽位，返回推送的条数"""
+        table = self.table
+        count = 0
+        for shard, slots in enumerate(self.slots):
+            version = table.version(shard)
+            if version == self.versions[shard]:
+                continue
+            self.versions[shard] = version
+
+            for slot in slots:
+                if table.seq(slot) == self.seqs[slot]:
+                    continue
+                data = table.read(slot)
+                if not data:
+                    continue
+                self.seqs[slot] = data[0]
+                ex, symbol = self.targets[slot]
+                bbo = BBO(symbol, data[1], data[2], data[3], data[4], data[5])
+                ex.bbos[symbol] = bbo
+                await ex.emit_bbo(bbo)
+                count += 1
+        return count
@@ -13,15 +13,38 @@ import requests
 from websockets import WebSocketClientProtocol
 from exchanges.conn_pool import ConnPool
 from exchanges.exchange import Exchange
+from exchanges.orderbook import BOOK_LEVELS, OrderBook, fit_levels
+from exchanges.standby import StandbyPair
 from exchanges.ws import WS
 from models.enums import *
 from models.models import *
 from tool import timex
+from tool.ratelimit import Governor, Priority
 from config import settings
 
-BASE_REST = 'https://fapi.binance.com'
-BASE_WS = 'wss://fstream.binance.com'
-BASE_WS_API = 'wss://ws-fapi.binance.com/ws-fapi/v1'
+BASE_REST: str = settings.binance_rest  # rest地址
+BASE_WS: str = settings.binance_ws  # 行情和私有ws地址
+BASE_WS_API: str = settings.binance_ws_api  # ws api地址
+
+# rest接口权重，没列出的按1算
+WEIGHTS = {
+    '/fapi/v1/openOrders': 40,
+    '/fapi/v3/positionRisk': 5,
+    '/fapi/v3/balance': 5,
+    '/fapi/v1/symbolConfig': 5,
+    '/fapi/v1/leverageBracket': 1,
+    '/fapi/v1/exchangeInfo': 1,
+    # 深度快照按档数算权重，100档是5
+    '/fapi/v1/depth': 5,
+}
+# 限频响应头 -> (接口类别, 限制, 窗口秒数)
+RATE_HEADERS = {
+    'x-mbx-used-weight-1m': ('weight', 2400, 60),
+    'x-mbx-order-count-10s': ('order', 300, 10),
+    'x-mbx-order-count-1m': ('order', 1200, 60),
+}
+# ws api返回的限频窗口单位
+INTERVALS = {'SECOND': 1, 'MINUTE': 60, 'HOUR': 3600, 'DAY': 86400}
 
 
 def hmac_hashing(secret: str, payload: str):
@@ -38,39 +61,74 @@ class Binance(Exchange):
     def __init__(self, secret: Secret):
         super().__init__(secret)
         self.req = requests.Session()
-        self.wss: dict[str, WS] = {}
-
-        self.private_key = load_pem_private_key(
-            data=self.secret.private_key.encode('ASCII'),
-            password=None,
-            backend=default_backend(),
-        )
+        self.rest_url = BASE_REST
+        # 权重 2400/分钟，下单 300/10秒、1200/分钟，建连 300/5分钟
+        self.governor = Governor({
+            'weight': (40, 200),
+            'order': (20, 30),
+            'conn': (1, 300),
+        })
+        self.ip_limits = ('weight', 'conn')
+
+        # 只用行情时(监控、回放)可以不配置私钥
+        self.private_key = None
+        if self.secret.private_key:
+            self.private_key = load_pem_private_key(
+                data=self.secret.private_key.encode('ASCII'),
+                password=None,
+                backend=default_backend(),
+            )
 
     async def listen_public(self, symbol: str = ''):
         if symbol:
             name = f'{self.__class__.__name__} {symbol}'
             url = f'{BASE_WS}/ws/{symbol.lower()}@bookTicker'
+            if self.book:
+                # 同一条连接订阅最优买卖和增量深度
+                self.books[symbol] = OrderBook(symbol)
+                streams = f'{symbol.lower()}@bookTicker/{symbol.lower()}@depth@100ms'
+                url = f'{BASE_WS}/stream?streams={streams}'
             ws = WS(
                 uri=url,
                 name=name,
+                conn_bucket=self.governor.buckets['conn'],
                 symbol=symbol,
+                on_conn=self.pub_conn if self.book else None,
                 on_msg=self.pub_msg,
             )
             self.wss[symbol] = ws
             await ws.loop_conn()
 
     async def listen_private(self):
-        name = f'{self.__class__.__name__} 私有连接'
         key = await self.gen_listen_key()
         url = f'{BASE_WS}/ws/{key}'
-        ws = WS(
-            uri=url,
-            name=name,
-            on_conn=self.pri_conn,
-            on_msg=self.pri_msg,
-        )
-        self.wss['PRIVATE'] = ws
-        await ws.loop_conn()
+
+        def new_ws() -> WS:
+            name = f'{self.__class__.__name__} 私有连接'
+            return WS(
+                uri=url,
+                name=name,
+                conn_bucket=self.governor.buckets['conn'],
+                on_conn=self.pri_conn,
+                on_msg=self.pri_msg,
+            )
+
+        self.private = StandbyPair(self.log, new_ws, self.resync_private)
+        # listenKey续期按账号来，不跟着连接走(主备切换后两条连接都是以备用身份连上的)
+        task = asyncio.create_task(self.loop_listen_key())
+        try:
+            await self.private.run()
+        finally:
+            task.cancel()
+
+    async def loop_listen_key(self):
+        """listenKey 60分钟过期，定时续期"""
+        while 1:
+            await asyncio.sleep(55 * 60)
+            try:
+                await self.prolong_listen_key()
+            except Exception as e:
+                self.log.error(f'listenKey续期失败: {e}')
 
     async def listen_ws_api(self, count: int):
 
@@ -79,6 +137,7 @@ class Binance(Exchange):
             return WS(
                 uri=BASE_WS_API,
                 name=name,
+                conn_bucket=self.governor.buckets['conn'],
                 on_conn=self.wsapi_conn,
                 on_msg=self.wsapi_msg,
             )
@@ -94,29 +153,51 @@ class Binance(Exchange):
     ):
         """公共ws消息事件"""
         msg = json.loads(msg)
-        bbo = BBO(msg['s'], msg['b'], msg['B'], msg['a'], msg['A'], msg['T'])
+        # 组合流
+        data = msg['data'] if 'stream' in msg else msg
+        if data.get('e') == 'depthUpdate':
+            self.handle_depth(symbol, data)
+            return msg, ''
+
+        bbo = BBO(data['s'], data['b'], data['B'], data['a'], data['A'],
+                  data['T'])
         self.bbos[symbol] = bbo
         await self.emit_bbo(bbo)
 
         return msg, ''
 
-    async def pri_conn(
+    async def pub_conn(
         self,
         conn: WebSocketClientProtocol,
         symbol: str,
     ) -> list[asyncio.Task]:
-        """私有ws连接事件"""
-
-        # 重连的时候防止丢数据
-        self.orders = await self.get_orders()
-        self.pos = await self.get_positions()
+        """公共ws连接事件，重连后订单簿要重新拉快照"""
+        self.books[symbol].reset()
+        self.resync_book(symbol)
+        return []
 
-        async def listen_key():
-            while 1:
-                await asyncio.sleep(55 * 60)
-                await self.prolong_listen_key()
+    def handle_depth(self, symbol: str, data: dict):
+        """增量深度"""
+        book = self.books.get(symbol)
+        if not book:
+            return
+        bids = [(float(p), float(q)) for p, q in data['b']]
+        asks = [(float(p), float(q)) for p, q in data['a']]
+        if not book.on_diff(data['U'], data['u'], data['pu'], bids, asks,
+                            data['T']):
+            self.log.warning(f'{symbol} 深度序号断档 重新拉快照')
+            self.resync_book(symbol)
 
-        return [asyncio.create_task(listen_key())]
+    async def pri_conn(
+        self,
+        conn: WebSocketClientProtocol,
+        symbol: str,
+    ) -> list[asyncio.Task]:
+        """私有ws连接事件"""
+        # 重连的时候用rest补齐断线期间丢掉的推送，备用连接不处理推送不用补
+        if not self.private.find(conn).standby:
+            await self.resync_private()
+        return []
 
     async def pri_msg(
         self,
@@ -129,6 +210,8 @@ class Binance(Exchange):
         if msg['e'] == 'ACCOUNT_UPDATE':
             await self.handle_account(msg)
             await self.handle_pos(msg)
+            self.update_available()
+            self.log.info(f'可用余额:{self.account.swap_available}')
         elif msg['e'] == 'ORDER_TRADE_UPDATE':
             await self.handle_order(msg)
 
@@ -153,7 +236,8 @@ class Binance(Exchange):
         params = {}
         params['signature'] = self.wsapi_sign(now, params)
         req = {"id": msg_id, "method": "session.logon", "params": params}
-        await self.ws_api_pool.send(req)
+        # 在这条连接上登录(备用连接也提前登录好)
+        await self.ws_api_pool.find(conn).send(req)
 
         return []
 
@@ -165,18 +249,34 @@ class Binance(Exchange):
     ):
         """wsapi消息事件"""
         msg = json.loads(msg)
+        self.wsapi_limits(msg)
 
         if 'id' in msg:
             return msg, msg['id']
         return msg, ''
 
+    def wsapi_limits(self, msg: dict):
+        """用ws api返回的限频信息校准"""
+        for limit in msg.get('rateLimits', []):
+            kind = 'weight'
+            if limit['rateLimitType'] == 'ORDERS':
+                kind = 'order'
+            window = limit['intervalNum'] * INTERVALS.get(limit['interval'], 60)
+            self.governor.update(kind, limit['count'], limit['limit'], window)
+
+        # 被限频，retryAfter是可以恢复请求的时间戳
+        if msg.get('status') in [418, 429]:
+            data = msg.get('error', {}).get('data', {})
+            retry = data.get('retryAfter', 0)
+            seconds = (retry - timex.time_ms()) / 1000 if retry else 60
+            self.governor.block('order', seconds)
+            self.log.error(f'ws api被限频 暂停下单{seconds:.0f}秒')
+
     async def handle_account(self, msg: dict):
-        """更新账户信息"""
+        """更新账户信息，推送里没有可用余额，在rest基准上按变化量更新"""
         for data in msg['a']['B']:
             if data['a'] == settings.quote:
                 self.account.swap_balance = float(data['wb'])
-                self.account.swap_available = float(data['cw'])
-                self.log.info(f'可用余额:{self.account.swap_available}')
 
     async def handle_pos(self, msg: dict):
         """更新仓位"""
@@ -190,6 +290,14 @@ class Binance(Exchange):
             # 平仓
             if amount == 0 and id in self.pos:
                 del self.pos[id]
+                await self.emit_pos(Position(
+                    symbol=symbol,
+                    id=id,
+                    side=side,
+                    price=price,
+                    amount=0,
+                    ex_name=self.__class__.__name__,
+                ))
                 continue
 
             status_str = '更新' if id in self.pos else '新增'
@@ -199,8 +307,10 @@ class Binance(Exchange):
                 side=side,
                 price=price,
                 amount=amount,
+                ex_name=self.__class__.__name__,
             )
             self.pos[id] = pos
+            await self.emit_pos(pos)
 
             m = f'{status_str}仓位: {id} 方向:{side} 价格:{price} 数量:{amount}'
             self.log.info(m)
@@ -241,19 +351,14 @@ class Binance(Exchange):
             side=side,
             trade_side=tside,
             c_time=data['T'],
+            client_id=data.get('c', ''),
         )
 
         # 维护本地订单
-        if status in self.done_staus and id in self.orders:
-            del self.orders[id]
-        else:
-            self.orders[id] = order
+        self.orders.put(order)
 
         await self.emit_order(order)
 
-        if len(self.orders) > 500:
-            self.orders = dict(list(self.orders.items())[-100:])
-
     async def init(self, symbols: list[str]):
         await self.set_margin_mode()
         await self.set_position_mode()
@@ -267,7 +372,19 @@ class Binance(Exchange):
         secret = self.secret.secret
         return q, hmac_hashing(secret, q)
 
-    async def go(self, method: str, path: str, payload: dict = {}):
+    async def go(
+        self,
+        method: str,
+        path: str,
+        payload: dict = {},
+        priority: Priority = Priority.NORMAL,
+    ):
+        """rest请求，低优先级请求被丢弃、关键请求被限频时返回None"""
+        cost = WEIGHTS.get(path, 1)
+        if not await self.governor.acquire('weight', cost, priority):
+            self.log.warning(f'限频 丢弃请求 {path}')
+            return None
+
         now = timex.time_ms()
         url = BASE_REST + path
         q, signature = self.sign(now, payload)
@@ -276,14 +393,30 @@ class Binance(Exchange):
         headers = {
             'X-MBX-APIKEY': self.secret.key,
         }
-        res = self.req.request(
+        # 同步请求放到线程里执行，不阻塞事件循环
+        res = await asyncio.to_thread(
+            self.req.request,
             method=method,
             url=url,
             headers=headers,
         )
+        self.rest_limits(res)
 
         return res.json()
 
+    def rest_limits(self, res: requests.Response):
+        """用rest响应头里的已用量校准"""
+        for key, value in res.headers.items():
+            limit = RATE_HEADERS.get(key.lower())
+            if limit:
+                kind, count, window = limit
+                self.governor.update(kind, int(value), count, window)
+
+        if res.status_code in [418, 429]:
+            seconds = int(res.headers.get('Retry-After', 60))
+            self.governor.block('weight', seconds)
+            self.log.error(f'rest被限频 暂停{seconds}秒')
+
     async def gen_listen_key(self) -> str:
         """生成ws身份认证"""
         res = await self.go('POST', '/fapi/v1/listenKey')
@@ -321,6 +454,21 @@ class Binance(Exchange):
             )
         return rules
 
+    async def get_book_snapshot(
+        self,
+        symbol: str,
+    ) -> tuple[int, list, list, int] | None:
+        limit = fit_levels(BOOK_LEVELS, [5, 10, 20, 50, 100, 500, 1000])
+        res = await self.go('GET', '/fapi/v1/depth', {
+            'symbol': symbol,
+            'limit': limit,
+        })
+        if res is None:
+            return None
+        bids = [(float(p), float(q)) for p, q in res['bids']]
+        asks = [(float(p), float(q)) for p, q in res['asks']]
+        return res['lastUpdateId'], bids, asks, res['T']
+
     async def create_order(
         self,
         symbol: str,
@@ -330,6 +478,34 @@ class Binance(Exchange):
         amount: float,
         price: float = 0,
     ) -> tuple[str, str]:
+        msg_id, req = self.order_request(
+            symbol,
+            side,
+            trade_side,
+            type,
+            amount,
+            price,
+        )
+        if not await self.governor.acquire('order', 1, Priority.CRITICAL):
+            return '', '被限频'
+        res, ok = await self.ws_api_pool.send(req, msg_id)
+        if not ok:
+            return '', 'ws未连接'
+        if 'result' not in res or 'orderId' not in res['result']:
+            return '', res
+
+        return str(res['result']['orderId']), ''
+
+    def order_request(
+        self,
+        symbol: str,
+        side: Side,
+        trade_side: TradeSide,
+        type: OrderType,
+        amount: float,
+        price: float = 0,
+    ) -> tuple[str, dict]:
+        """生成ws api下单请求: 请求id, 请求"""
         now = timex.time_ms()
 
         args = {
@@ -351,31 +527,32 @@ class Binance(Exchange):
             args['timeInForce'] = str(type)
 
         msg_id = uuid.uuid4().hex
+        # 客户端订单id用请求id，推送里能直接对上
+        args['newClientOrderId'] = msg_id
         req = {
             'id': msg_id,
             'method': 'order.place',
             'params': args,
         }
-        res, ok = await self.ws_api_pool.send(req, msg_id)
-        if not ok:
-            return '', 'ws未连接'
-        if 'result' not in res or 'orderId' not in res['result']:
-            return '', res
-
-        return str(res['result']['orderId']), ''
+        return msg_id, req
 
     async def cancel_order(self, id: str, symbol: str = ''):
         res = await self.go('DELETE', '/fapi/v1/order', {
             'symbol': symbol,
             'orderId': id,
-        })
+        }, Priority.CRITICAL)
+        if res is None:
+            self.log.error(f'撤销订单 {id} 失败: 被限频')
+            return
         self.log.info(f'撤销订单 {id} 成功')
 
     async def cancel_all_order(self, symbol: str = ''):
         res = await self.go('DELETE', '/fapi/v1/allOpenOrders', {
             'symbol': symbol,
-        })
-        if res['code'] == 200:
+        }, Priority.CRITICAL)
+        if res is None:
+            self.log.error(f'撤销全部订单失败: 被限频')
+        elif res['code'] == 200:
             self.log.info(f'撤销全部订单成功')
         else:
             self.log.info(f'撤销全部订单失败: {res}')
@@ -420,11 +597,17 @@ class Binance(Exchange):
                 side=side,
                 trade_side=tside,
                 c_time=data['time'],
+                client_id=data.get('clientOrderId', ''),
             )
         return orders
 
-    async def get_positions(self) -> dict[str, Position]:
-        res = await self.go('GET', '/fapi/v3/positionRisk')
+    async def get_positions(
+        self,
+        priority: Priority = Priority.NORMAL,
+    ) -> dict[str, Position] | None:
+        res = await self.go('GET', '/fapi/v3/positionRisk', {}, priority)
+        if res is None:
+            return None
         positions = {}
         for data in res:
             symbol = data['symbol']
@@ -439,6 +622,7 @@ class Binance(Exchange):
                 price=data['entryPrice'],
                 amount=abs(amount),
                 c_time=data['updateTime'],
+                ex_name=self.__class__.__name__,
             )
         return positions
 
@@ -452,6 +636,16 @@ class Binance(Exchange):
         if 'maxNotionalValue' not in res:
             return str(res)
 
+    async def get_leverages(self) -> dict[str, int]:
+        res = await self.go('GET', '/fapi/v1/symbolConfig')
+        leverages = {}
+        for data in res:
+            leverage = int(data['leverage'])
+            if data['marginType'] != 'CROSSED':
+                leverage = 0
+            leverages[data['symbol']] = leverage
+        return leverages
+
     async def set_margin_mode(self, symbol: str = ''):
         res = await self.go('GET', '/fapi/v1/multiAssetsMargin')
         if res['multiAssetsMargin']:
@@ -480,14 +674,17 @@ class Binance(Exchange):
         else:
             self.log.info(f'设置双向持仓失败: {res}')
 
-    async def update_balance(self):
-        res = await self.go('GET', '/fapi/v3/balance')
+    async def update_balance(self, priority: Priority = Priority.NORMAL):
+        res = await self.go('GET', '/fapi/v3/balance', {}, priority)
+        if res is None:
+            return
         for data in res:
             if data['asset'] == settings.quote:
                 self.account = Account(
                     swap_balance=data['balance'],
                     swap_available=data['availableBalance'],
                 )
+                self.mark_available()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,219 @@
+import collections
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Iterator
+
+from config import settings
+from tool import logger
+
+CAPTURE: bool = settings.capture  # 是否录制ws原始帧
+CAPTURE_DIR: str = settings.capture_dir  # 录制目录
+CAPTURE_SEGMENT_MB: int = settings.capture_segment_mb  # 单个分段的原始大小(MB)
+CAPTURE_KEEP: int = settings.capture_keep  # 最多保留的分段数，0为不限(不删除)
+CAPTURE_BUFFER: int = settings.capture_buffer  # 内存缓冲的最大帧数
+
+# 帧方向
+DIR_IN = 0  # 收到的消息
+DIR_OUT = 1  # 发出的消息
+DIR_CONN = 2  # 连接信息(json: name, uri, symbol)
+
+# 帧头: 接收时间(纳秒) 连接id 方向 长度
+FRAME_HEAD = struct.Struct('<qIBI')
+SEGMENT_SUFFIX = '.frames.z'
+
+
+class FrameCapture:
+    """
+    ws原始帧录制
+    recv只把帧放进有界缓冲区，压缩和写盘在后台线程完成，缓冲区满了就丢帧计数
+    分段文件: 帧头 + 原始帧，整体zlib流式压缩，按大小切分并只保留最近的N个
+    """
+
+    def __init__(
+        self,
+        path: str = CAPTURE_DIR,
+        segment_mb: int = CAPTURE_SEGMENT_MB,
+        keep: int = CAPTURE_KEEP,
+        buffer: int = CAPTURE_BUFFER,
+    ):
+        self.path = path
+        self.segment_size = segment_mb * 1024 * 1024
+        self.keep = keep
+        self.buffer = buffer
+
+        self.log = logger.get_logger(self.__class__.__name__)
+        self.frames: collections.deque = collections.deque()
+        self.conns: dict[int, bytes] = {}
+        self.dropped = 0
+        self.written = 0
+
+        self.file = None
+        self.zip = None
+        self.seg_bytes = 0
+        self.running = False
+        self.wakeup = threading.Event()
+        self.thread: threading.Thread | None = None
+
+    def start(self):
+        os.makedirs(self.path, exist_ok=True)
+        if self.keep <= 0:
+            self.log.warning('录制不限分段数 不会删除旧分段 注意磁盘空间')
+        self.running = True
+        self.thread = threading.Thread(
+            target=self._loop,
+            name='frame-capture',
+            daemon=True,
+        )
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def conn(self, conn_id: int, name: str, uri: str, symbol: str = ''):
+        """记录连接信息，每个新分段开头都会重写一遍"""
+        info = json.dumps({'name': name, 'uri': uri, 'symbol': symbol})
+        data = info.encode('utf-8')
+        self.conns[conn_id] = data
+        self.put(conn_id, DIR_CONN, data)
+
+    def put(self, conn_id: int, direction: int, data: str | bytes):
+        """放入一帧(在事件循环里调用，不做任何io)"""
+        # 录制线程已经退出(停止或者报错)，不再缓冲
+        if not self.running:
+            return
+        if len(self.frames) >= self.buffer:
+            self.dropped += 1
+            return
+        # 缓冲区从空变成非空时叫醒录制线程，不用等轮询
+        wake = not self.frames
+        self.frames.append((time.time_ns(), conn_id, direction, data))
+        if wake:
+            self.wakeup.set()
+
+    def _loop(self):
+        try:
+            while self.running or self.frames:
+                if not self.frames:
+                    self.wakeup.wait(0.05)
+                    self.wakeup.clear()
+                    continue
+                self._write_batch()
+        except Exception as e:
+            self.running = False
+            self.frames.clear()
+            self.log.error(f'录制线程报错 停止录制 {e}')
+        finally:
+            self._close_segment()
+
+    def _write_batch(self):
+        chunks = []
+        size = 0
+        while self.frames and size < 1024 * 1024:
+            ns, conn_id, direction, data = self.frames.popleft()
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+            chunks.append(FRAME_HEAD.pack(ns, conn_id, direction, len(data)))
+            chunks.append(data)
+            size += FRAME_HEAD.size + len(data)
+            self.written += 1
+
+        if self.file is None or self.seg_bytes >= self.segment_size:
+            self._new_segment()
+        self.file.write(self.zip.compress(b''.join(chunks)))
+        self.seg_bytes += size
+
+    def _new_segment(self):
+        self._close_segment()
+
+        name = time.strftime('%Y%m%d_%H%M%S') + f'_{time.time_ns() % 10**9:09d}'
+        file_path = os.path.join(self.path, name + SEGMENT_SUFFIX)
+        self.file = open(file_path, 'wb')
+        self.zip = zlib.compressobj(1)
+        self.seg_bytes = 0
+
+        # 新分段先写连接信息，保证每个分段都能独立回放
+        head = []
+        now = time.time_ns()
+        for conn_id, data in list(self.conns.items()):
+            head.append(FRAME_HEAD.pack(now, conn_id, DIR_CONN, len(data)))
+            head.append(data)
+        if head:
+            self.file.write(self.zip.compress(b''.join(head)))
+
+        self._rotate()
+
+    def _close_segment(self):
+        if self.file is None:
+            return
+        self.file.write(self.zip.flush())
+        self.file.close()
+        self.file = None
+        self.zip = None
+
+    def _rotate(self):
+        # 不限分段数
+        if self.keep <= 0:
+            return
+        segments = list_segments(self.path)
+        for file_path in segments[:-self.keep]:
+            os.remove(file_path)
+
+
+def list_segments(path: str) -> list[str]:
+    """按时间顺序列出录制分段"""
+    if not os.path.isdir(path):
+        return []
+    names = [n for n in os.listdir(path) if n.endswith(SEGMENT_SUFFIX)]
+    return [os.path.join(path, n) for n in sorted(names)]
+
+
+def read_frames(file_path: str) -> Iterator[tuple[int, int, int, bytes]]:
+    """读取一个分段: (接收时间纳秒, 连接id, 方向, 原始帧)"""
+    unzip = zlib.decompressobj()
+    buf = b''
+    with open(file_path, 'rb') as f:
+        while 1:
+            chunk = f.read(1024 * 1024)
+            if chunk:
+                buf += unzip.decompress(chunk)
+            else:
+                buf += unzip.flush()
+
+            pos = 0
+            while len(buf) - pos >= FRAME_HEAD.size:
+                ns, conn_id, direction, length = FRAME_HEAD.unpack_from(buf, pos)
+                end = pos + FRAME_HEAD.size + length
+                if end > len(buf):
+                    break
+                yield ns, conn_id, direction, buf[pos + FRAME_HEAD.size:end]
+                pos = end
+            buf = buf[pos:]
+
+            if not chunk:
+                break
+
+
+# 全局录制器，开启后所有WS共用
+capture: FrameCapture | None = None
+
+
+def enable_capture() -> FrameCapture:
+    global capture
+    if capture is None:
+        capture = FrameCapture()
+        capture.start()
+    return capture
+
+
+if __name__ == '__main__':
+    for file_path in list_segments(CAPTURE_DIR):
+        for ns, conn_id, direction, data in read_frames(file_path):
+            print(ns, conn_id, direction, data[:120])
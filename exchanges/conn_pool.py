@@ -2,7 +2,12 @@ import asyncio
 import logging
 from typing import Callable
 
+from websockets.client import WebSocketClientProtocol
+
 from exchanges.ws import WS
+from config import settings
+
+WS_API_STANDBY: int = settings.ws_api_standby  # wsapi备用连接数，保持连接和登录，工作连接断开时顶上
 
 
 class ConnPool:
@@ -14,13 +19,19 @@ class ConnPool:
     ):
         self.log = log
         self.new_ws = new_ws
+        # 前active条是工作连接，后面的是备用连接
         self.wss: list[WS] = []
+        self.active = 0
         self.next_conn = 0
+        # 备用连接顶替的次数
+        self.promotions = 0
         
-    async def run(self, count: int, sleep: int = 0):
+    async def run(self, count: int, sleep: int = 0, standby: int = WS_API_STANDBY):
+        self.active = count
         futures = []
-        for i in range(count):
+        for i in range(count + standby):
             ws = self.new_ws()
+            ws.on_close = self.on_close
             self.wss.append(ws)
             futures.append(self._conn(ws, i * sleep))
         await asyncio.gather(*futures)
@@ -29,9 +40,28 @@ class ConnPool:
         if sleep:
             await asyncio.sleep(sleep)
         await ws.loop_conn()
+
+    def find(self, conn: WebSocketClientProtocol) -> WS | None:
+        """按底层连接找到WS，连接事件里用来在这条连接上登录"""
+        for ws in self.wss:
+            if ws.ws is conn:
+                return ws
+        return None
+
+    def on_close(self, ws: WS):
+        """工作连接断开，和一条在线的备用连接换位置，断开的那条重连后做备用"""
+        idx = self.wss.index(ws)
+        if idx >= self.active:
+            return
+        for j in range(self.active, len(self.wss)):
+            if self.wss[j].ok():
+                self.wss[idx], self.wss[j] = self.wss[j], ws
+                self.promotions += 1
+                self.log.warning(f'wsapi连接断开 切换到备用连接')
+                return
         
     async def send(self, msg: dict, id: str = '') -> tuple[dict, bool]:
-        length = len(self.wss)
+        length = self.active or len(self.wss)
         try_count = 0
         ws: WS | None = None
         
@@ -42,6 +72,12 @@ class ConnPool:
             self.next_conn = (self.next_conn + 1) % length
             if ws.ok():
                 break
+        else:
+            # 工作连接都不在，用备用连接
+            for standby in self.wss[length:]:
+                if standby.ok():
+                    ws = standby
+                    break
         
         if not ws:
             self.log.error('没有能用的wsapi')
@@ -52,4 +88,4 @@ class ConnPool:
     async def close_all(self):
         for ws in self.wss:
             await ws.close()
-        self.wss.clear()
\ No newline at end of file
+        self.wss.clear()
@@ -1,10 +1,19 @@
 from abc import ABC, abstractmethod
+import asyncio
 import copy
 from typing import Awaitable, Callable
+from urllib.parse import urlsplit
 
 from models.enums import *
+from exchanges import capture, rule_cache
+from exchanges.order_store import OrderStore
+from exchanges.orderbook import BOOK, OrderBook
+from exchanges.standby import StandbyPair
+from exchanges.ws import WS
 from models.models import *
 from tool import logger
+from tool.event_bus import EventBus, Subscription
+from tool.ratelimit import Governor, Priority
 
 
 class Exchange(ABC):
@@ -12,28 +21,100 @@ class Exchange(ABC):
     def __init__(self, secret: Secret):
         self.secret = secret
 
-        self.log = logger.get_logger(self.__class__.__name__)
+        name = self.__class__.__name__
+        self.log = logger.get_logger(
+            f'{name} {secret.name}' if secret.name else name)
         self.rules: dict[str, ContractRule] = {}
+        # rest地址，交易规则缓存按它区分实盘、测试网和模拟交易所
+        self.rest_url = ''
         self.bbos: dict[str, BBO] = {}
-        self.orders: dict[str, Order] = {}
+        # 交易对 -> 行情ws连接
+        self.wss: dict[str, WS] = {}
+        # 私有流主备连接
+        self.private: StandbyPair | None = None
+        # 是否维护本地订单簿，行情分片的工作进程里关掉(主进程读不到，白拉快照)
+        self.book = BOOK
+        # 本地订单簿(开了book才有)，交易对 -> 订单簿
+        self.books: dict[str, OrderBook] = {}
+        # 交易对 -> 拉快照的任务
+        self.book_tasks: dict[str, asyncio.Task] = {}
+        self.orders = OrderStore()
         self.pos: dict[str, Position] = {}
         self.taker_fee_rate = 0.0005
         self.account: Account = Account()
+        # 保证金预占: 交易对 -> 预占的保证金
+        # 开仓下单时预扣，成交后(仓位已计入可用余额)或者失败时释放
+        self.reserved: dict[str, float] = {}
+        self.reserved_total = 0.0
+        # 交易对 -> 交易所上的实际杠杆(调整杠杆时读取)，没有的按规则里的交易杠杆
+        self.leverages: dict[str, int] = {}
+        # 可用余额基准: rest返回可用余额时的(可用余额, 钱包余额, 仓位保证金)
+        self.available_base: tuple[float, float, float] | None = None
+        # 限频调度，各交易所按自己的限制设置接口类别
+        self.governor = Governor({
+            'rest': (10, 10),
+            'order': (10, 10),
+            'conn': (10, 10),
+        })
 
-        self.emit_bbo: Callable[[BBO], Awaitable[None]] = None
-        self.emit_order: Callable[[Order], Awaitable[None]] = None
+        # 事件总线，多个订阅者共用一份解析好的事件
+        self.bbo_bus: EventBus[BBO] = EventBus(f'{self.__class__.__name__} bbo')
+        self.order_bus: EventBus[Order] = EventBus(
+            f'{self.__class__.__name__} order')
+        self.pos_bus: EventBus[Position] = EventBus(
+            f'{self.__class__.__name__} pos')
+        self.emit_bbo: Callable[[BBO], Awaitable[None]] = self.bbo_bus.emit
+        self.emit_order: Callable[[Order], Awaitable[None]] = self.order_bus.emit
+        self.emit_pos: Callable[[Position], Awaitable[None]] = self.pos_bus.emit
 
-        self.done_staus = [
-            OrderStatus.PARTIALLY_FILLED,
-            OrderStatus.FILLED,
-            OrderStatus.CANCELED,
-        ]
+        # 按IP计的限频类别，多账户共用
+        self.ip_limits: tuple[str, ...] = ('conn', )
 
-    def listen_bbo(self, handler: Callable[[BBO], Awaitable[None]]):
-        self.emit_bbo = handler
+    def share_market(self, market: 'Exchange'):
+        """
+        多账户时共用另一个账户的行情和交易规则，自己只管私有流和下单
+        bbo、订单簿、交易规则是同一份，bbo总线也是同一条，已有的订阅者搬过去
+        交易规则加载完之后再调用(加载会替换rules，刷新是原地合并)
+        """
+        self.rules = market.rules
+        self.bbos = market.bbos
+        self.books = market.books
+        market.bbo_bus.subs += self.bbo_bus.subs
+        self.bbo_bus = market.bbo_bus
+        self.emit_bbo = market.emit_bbo
+        for kind in self.ip_limits:
+            self.governor.buckets[kind] = market.governor.buckets[kind]
+
+    def listen_bbo(
+        self,
+        handler: Callable,
+        symbols: list[str] | None = None,
+        batch: float = 0,
+    ) -> Subscription[BBO]:
+        """
+        订阅bbo，可以有多个订阅者
+        handler: 同步异步都可以
+        symbols: 只收这些交易对(交易所上的交易对名)
+        batch: 批量间隔(毫秒)，大于0时handler收到的是列表
+        """
+        return self.bbo_bus.subscribe(handler, symbols, batch)
 
-    def listen_order(self, handler: Callable[[Order], Awaitable[None]]):
-        self.emit_order = handler
+    def listen_order(
+        self,
+        handler: Callable,
+        symbols: list[str] | None = None,
+        batch: float = 0,
+    ) -> Subscription[Order]:
+        return self.order_bus.subscribe(handler, symbols, batch)
+
+    def listen_pos(
+        self,
+        handler: Callable,
+        symbols: list[str] | None = None,
+        batch: float = 0,
+    ) -> Subscription[Position]:
+        """仓位推送，平仓时数量为0"""
+        return self.pos_bus.subscribe(handler, symbols, batch)
 
     @abstractmethod
     async def init(self, symbols: list[str]):
@@ -67,6 +148,86 @@ class Exchange(ABC):
         """获取交易规则"""
         pass
 
+    async def load_rules(self) -> bool:
+        """
+        加载交易规则，缓存没过期就直接用缓存，否则从交易所拉取并写缓存
+        return: 是否用了缓存(用了缓存需要后台刷新)
+        """
+        name = self.rules_cache_name()
+        rules, age = rule_cache.load(name)
+        if rules and age < rule_cache.RULES_CACHE_TTL:
+            self.rules = rules
+            self.log.info(f'使用交易规则缓存 {len(rules)}个 {age:.0f}秒前')
+            return True
+
+        self.rules = await self.get_rules()
+        self.save_rules()
+        return False
+
+    async def loop_refresh_rules(self, delay: float = 0):
+        """后台定期刷新交易规则，合并差异并更新缓存"""
+        while 1:
+            await asyncio.sleep(delay)
+            delay = rule_cache.RULES_CACHE_TTL
+            try:
+                rules = await self.get_rules()
+            except Exception as e:
+                self.log.error(f'刷新交易规则失败: {e}')
+                delay = 60
+                continue
+
+            added, removed, changed = rule_cache.apply(self.rules, rules)
+            self.save_rules()
+            if added or removed or changed:
+                self.log.info(f'交易规则更新 新增:{added} 下架:{removed} 变更:{changed}')
+
+    def save_rules(self):
+        """写交易规则缓存，录制行情时录制目录里也存一份，回放时离线读取"""
+        rule_cache.save(self.rules_cache_name(), self.rules)
+        if capture.capture:
+            rule_cache.save(self.__class__.__name__, self.rules,
+                            capture.capture.path)
+
+    def rules_cache_name(self) -> str:
+        """交易规则缓存文件名: 交易所名_rest地址"""
+        name = self.__class__.__name__
+        if self.rest_url:
+            host = urlsplit(self.rest_url).netloc.replace(':', '_')
+            name = f'{name}_{host}'
+        return name
+
+    def reconnect_public(self, symbol: str) -> bool:
+        """断开交易对的行情连接，重连后重新订阅；这个进程里没有这条连接时返回False"""
+        ws = self.wss.get(symbol)
+        if not ws or not ws.ok():
+            return False
+        ws.abort()
+        return True
+
+    async def resync_private(self):
+        """用rest补齐私有流断开期间丢掉的推送，有变化的仓位补发出去(等仓位推送的下单锁才能解开)"""
+        self.orders.sync_open(await self.get_orders())
+        positions = await self.get_positions()
+        if positions is not None:
+            old, self.pos = self.pos, positions
+            for id, pos in positions.items():
+                prev = old.get(id)
+                if not prev or prev.amount != pos.amount:
+                    await self.emit_pos(pos)
+            for id, prev in old.items():
+                if id not in positions:
+                    # 断开期间平掉的仓位
+                    await self.emit_pos(Position(
+                        symbol=prev.symbol,
+                        id=id,
+                        side=prev.side,
+                        price=prev.price,
+                        amount=0,
+                        ex_name=prev.ex_name,
+                    ))
+        await self.update_balance()
+        self.update_available()
+
     def get_rule(self, symbol: str) -> ContractRule | None:
         """获取交易对的交易规则"""
         if symbol in self.rules:
@@ -78,6 +239,60 @@ class Exchange(ABC):
         else:
             return None
 
+    def listed(self, symbol: str) -> bool:
+        """交易对在交易所上架中(有规则并且没有下架)"""
+        rule = self.get_rule(symbol)
+        return rule is not None and not rule.delisted
+
+    def pos_margin(self) -> float:
+        """仓位占用的保证金，按交易所上的实际杠杆"""
+        margin = 0
+        for pos in self.pos.values():
+            rule = self.get_rule(pos.symbol)
+            if rule:
+                value = pos.price * pos.amount * rule.contract_size
+                leverage = self.leverages.get(rule.symbol) or rule.trade_leverage
+                margin += value / leverage
+        return margin
+
+    def mark_available(self):
+        """rest返回的可用余额(已经算上未实现盈亏和挂单占用)作为基准"""
+        self.available_base = (
+            self.account.swap_available,
+            self.account.swap_balance,
+            self.pos_margin(),
+        )
+
+    def update_available(self):
+        """
+        推送之后更新可用余额，不用再走rest
+        私有流只推钱包余额，以rest返回的可用余额为准，加上之后钱包余额和仓位保证金的变化量
+        还没有rest基准时按钱包余额减仓位保证金估算
+        """
+        margin = self.pos_margin()
+        if self.available_base is None:
+            self.account.swap_available = self.account.swap_balance - margin
+            return
+        available, balance, base_margin = self.available_base
+        self.account.swap_available = (available
+                                       + self.account.swap_balance - balance
+                                       - (margin - base_margin))
+
+    def reserve(self, symbol: str, margin: float):
+        """预占保证金"""
+        self.reserved[symbol] = self.reserved.get(symbol, 0) + margin
+        self.reserved_total += margin
+
+    def unreserve(self, symbol: str):
+        """释放交易对预占的保证金"""
+        if self.reserved.pop(symbol, None) is not None:
+            # 重新求和，避免浮点误差累积
+            self.reserved_total = sum(self.reserved.values())
+
+    def available(self) -> float:
+        """扣掉预占后的可用余额"""
+        return self.account.swap_available - self.reserved_total
+
     def get_last_bbo(self, symbol: str) -> BBO | None:
         """获取最新的bbo"""
         bbo = None
@@ -98,6 +313,62 @@ class Exchange(ABC):
             bbo.ask_amount = bbo.ask_amount * 1000
         return bbo
 
+    def book_depth(self, symbol: str, side: Side, limit: float) -> float | None:
+        """
+        吃单方向为side时，价格不差于limit能成交的数量
+        没有订单簿或者还没同步好返回None
+        """
+        book = None
+        if symbol in self.books:
+            book = self.books[symbol]
+        elif "1000" + symbol in self.books:
+            book = self.books["1000" + symbol]
+        elif symbol.replace("1000", "") in self.books:
+            book = self.books[symbol.replace("1000", "")]
+
+        if not book or not book.synced:
+            return None
+
+        if book.symbol.startswith('1000'):
+            return book.depth(side, limit * 1000) * 1000
+        return book.depth(side, limit)
+
+    def resync_book(self, symbol: str):
+        """订单簿失步，后台重新拉快照"""
+        task = self.book_tasks.get(symbol)
+        if task and not task.done():
+            return
+        task = asyncio.create_task(self.loop_book_snapshot(symbol))
+        self.book_tasks[symbol] = task
+
+    async def loop_book_snapshot(self, symbol: str):
+        """拉快照直到接上增量"""
+        book = self.books[symbol]
+        while not book.synced:
+            try:
+                snapshot = await self.get_book_snapshot(symbol)
+            except Exception as e:
+                self.log.error(f'{symbol} 拉订单簿快照失败: {e}')
+                snapshot = None
+            if not snapshot:
+                await asyncio.sleep(1)
+                continue
+            if not book.on_snapshot(*snapshot):
+                # 快照比缓存的增量旧，等一下再拉
+                self.log.warning(f'{symbol} 订单簿快照没接上增量 重新拉取')
+                await asyncio.sleep(0.5)
+
+    @abstractmethod
+    async def get_book_snapshot(
+        self,
+        symbol: str,
+    ) -> tuple[int, list, list, int] | None:
+        """
+        获取订单簿快照
+        return: (更新id, 买盘[(价格, 数量)], 卖盘[(价格, 数量)], 时间)，被限频丢弃返回None
+        """
+        pass
+
     @abstractmethod
     async def create_order(
         self,
@@ -130,8 +401,11 @@ class Exchange(ABC):
         pass
 
     @abstractmethod
-    async def get_positions(self) -> dict[str, Position]:
-        """获取仓位列表"""
+    async def get_positions(
+        self,
+        priority: Priority = Priority.NORMAL,
+    ) -> dict[str, Position] | None:
+        """获取仓位列表，低优先级请求被限频丢弃时返回None"""
         pass
 
     @abstractmethod
@@ -139,6 +413,49 @@ class Exchange(ABC):
         """设置杠杆"""
         pass
 
+    @abstractmethod
+    async def get_leverages(self) -> dict[str, int]:
+        """
+        批量获取当前杠杆
+        return: 交易对 -> 全仓杠杆，不是全仓的返回0
+        """
+        pass
+
+    async def reconcile_leverage(
+        self,
+        targets: dict[str, int],
+        concurrency: int = 10,
+    ) -> dict[str, str]:
+        """
+        把杠杆调整到目标值
+        先批量读取当前杠杆，跳过已经一致的，剩下的并发设置，由限频调度排队
+        return: 交易对 -> 错误信息
+        """
+        current = await self.get_leverages()
+        todo = {s: l for s, l in targets.items() if current.get(s) != l}
+        self.log.info(f'杠杆需要调整 {len(todo)}/{len(targets)} 个交易对')
+
+        errs: dict[str, str] = {}
+        sem = asyncio.Semaphore(concurrency)
+
+        async def set_one(symbol: str, leverage: int):
+            async with sem:
+                try:
+                    err = await self.set_leverage(symbol, leverage)
+                except Exception as e:
+                    err = str(e)
+                if err:
+                    errs[symbol] = err
+
+        await asyncio.gather(*[set_one(s, l) for s, l in todo.items()])
+
+        # 记下实际杠杆，估算仓位保证金用
+        self.leverages.update(current)
+        for symbol, leverage in todo.items():
+            if symbol not in errs:
+                self.leverages[symbol] = leverage
+        return errs
+
     @abstractmethod
     async def set_margin_mode(self, symbol: str = ''):
         """设置保证金模式为全仓"""
@@ -150,9 +467,9 @@ class Exchange(ABC):
         pass
 
     @abstractmethod
-    async def update_balance(self):
+    async def update_balance(self, priority: Priority = Priority.NORMAL):
         """
         更新余额
-        合约余额、合约可用余额等
+        合约余额、合约可用余额等，低优先级请求被限频丢弃时不更新
         """
         pass
@@ -0,0 +1,272 @@
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import sys
+
+if __name__ == "__main__":
+    sys.path.append(
+        os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from exchanges import rule_cache
+from exchanges.bbo_table import BBOReader, BBOTable
+from exchanges.exchange import Exchange
+from exchanges.feed_shards import FEED_WORKERS, FeedShards, shard_keys
+from exchanges.startup import match_symbols, start_feeds
+from exchanges.watchdog import WATCHDOG, FeedWatchdog
+from models.models import *
+from tool import logger
+from config import settings
+
+FEED_SERVICE: bool = settings.feed_service  # 是否从本地行情服务读行情，不自己连交易所
+FEED_SOCK: str = settings.feed_sock  # 本地行情服务的通知socket
+
+# 通知消息: 订阅者发HELLO注册，服务回TABLE+表名，有更新时发CHANGED
+MSG_HELLO = b'H'
+MSG_TABLE = b'T'
+MSG_CHANGED = b'C'
+# 订阅者重新注册的间隔(秒)，服务重启后订阅者能自动接上
+HELLO_INTERVAL = 3
+
+
+def unix_socket(path: str) -> socket.socket:
+    """绑定一个非阻塞的unix数据报socket"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if os.path.exists(path):
+        os.unlink(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(path)
+    sock.setblocking(False)
+    return sock
+
+
+class FeedPublisher:
+    """
+    更新通知
+    数据在共享内存表里，这里只发一个字节的通知；同一轮事件循环里的多次更新只通知一次
+    订阅者来不及读时socket缓冲区满了就不再发，缓冲区里已经有没处理的通知
+    """
+
+    def __init__(self, table: BBOTable, path: str = FEED_SOCK):
+        self.log = logger.get_logger(self.__class__.__name__)
+        self.table = table
+        self.path = path
+        self.sock: socket.socket | None = None
+        # 订阅者socket地址
+        self.subs: set[str] = set()
+        self.scheduled = False
+
+    def start(self):
+        self.sock = unix_socket(self.path)
+        asyncio.get_running_loop().add_reader(self.sock.fileno(), self.on_read)
+
+    def stop(self):
+        if self.sock:
+            asyncio.get_running_loop().remove_reader(self.sock.fileno())
+            self.sock.close()
+            self.sock = None
+            os.unlink(self.path)
+
+    def on_read(self):
+        while 1:
+            try:
+                data, addr = self.sock.recvfrom(64)
+            except (BlockingIOError, InterruptedError):
+                return
+            if data == MSG_HELLO and addr:
+                if addr not in self.subs:
+                    self.log.info(f'订阅者接入 {addr} 共{len(self.subs) + 1}个')
+                self.subs.add(addr)
+                self.send(addr, MSG_TABLE + self.table.name.encode())
+
+    def send(self, addr: str, msg: bytes):
+        try:
+            self.sock.sendto(msg, addr)
+        except (BlockingIOError, InterruptedError):
+            pass
+        except (ConnectionRefusedError, FileNotFoundError):
+            self.log.info(f'订阅者断开 {addr}')
+            self.subs.discard(addr)
+
+    def notify(self):
+        if not self.scheduled and self.subs:
+            self.scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+
+    def flush(self):
+        self.scheduled = False
+        if not self.sock:
+            return
+        for addr in list(self.subs):
+            self.send(addr, MSG_CHANGED)
+
+
+class FeedSubscriber:
+    """
+    本地行情订阅
+    向本地行情服务注册，收到通知后直接读共享内存表，把bbo推给本进程的交易所对象
+    交易所对象照常提供get_last_bbo和emit_bbo，使用方不用改，也不占交易所的连接
+    """
+
+    def __init__(
+        self,
+        exchanges: list[Exchange],
+        symbols: list[str] | None = None,
+        path: str = FEED_SOCK,
+    ):
+        self.log = logger.get_logger(self.__class__.__name__)
+        self.exchanges = exchanges
+        self.symbols = symbols
+        self.path = path
+        self.sock_path = f'{path}.{os.getpid()}'
+        self.sock: socket.socket | None = None
+
+        self.table: BBOTable | None = None
+        self.reader: BBOReader | None = None
+        self.wake = asyncio.Event()
+
+    def on_read(self):
+        while 1:
+            try:
+                data = self.sock.recv(256)
+            except (BlockingIOError, InterruptedError):
+                break
+            if data.startswith(MSG_TABLE):
+                self.attach(data[len(MSG_TABLE):].decode())
+        self.wake.set()
+
+    def attach(self, name: str):
+        """接入服务的共享表，服务重启后表名会变"""
+        if self.table and self.table.name.lstrip('/') == name.lstrip('/'):
+            return
+        if self.table:
+            self.table.close()
+        self.table = BBOTable.attach(name)
+        self.reader = BBOReader(self.table, self.exchanges, self.symbols)
+        self.log.info(f'接入本地行情 共享表:{name} 交易对:{len(self.table.keys)}')
+
+    def hello(self):
+        try:
+            self.sock.sendto(MSG_HELLO, self.path)
+        except (BlockingIOError, ConnectionRefusedError, FileNotFoundError):
+            if not self.table:
+                self.log.warning(f'本地行情服务未启动 {self.path}')
+
+    async def loop_hello(self):
+        while 1:
+            self.hello()
+            await asyncio.sleep(HELLO_INTERVAL)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.sock = unix_socket(self.sock_path)
+        loop.add_reader(self.sock.fileno(), self.on_read)
+        hello = asyncio.create_task(self.loop_hello())
+        try:
+            while 1:
+                await self.wake.wait()
+                self.wake.clear()
+                if self.reader:
+                    await self.reader.poll()
+        finally:
+            hello.cancel()
+            loop.remove_reader(self.sock.fileno())
+            self.sock.close()
+            os.unlink(self.sock_path)
+            if self.table:
+                self.table.close()
+
+
+class FeedService:
+    """
+    本地行情服务
+    只有这一份交易所行情连接，解析后的bbo写进共享内存表，通知本机的订阅者
+    Trader、Market和临时工具都通过FeedSubscriber读，不再各自连交易所
+    workers>0时再分片到多个进程收(见FeedShards)
+    """
+
+    def __init__(self, exchanges: list[Exchange], workers: int = FEED_WORKERS):
+        self.log = logger.get_logger(self.__class__.__name__)
+        self.exchanges = exchanges
+        self.workers = workers
+
+    async def run(self, symbols: list[str] = []):
+        cached = await asyncio.gather(*[ex.load_rules() for ex in self.exchanges])
+        tasks = []
+        for ex, hit in zip(self.exchanges, cached):
+            delay = 0 if hit else rule_cache.RULES_CACHE_TTL
+            tasks.append(asyncio.create_task(ex.loop_refresh_rules(delay)))
+
+        symbols = symbols or match_symbols(self.exchanges)
+        if not symbols:
+            self.log.error('没有匹配的交易对')
+            return
+        ex_names = [ex.__class__.__name__ for ex in self.exchanges]
+
+        if self.workers > 0:
+            # 工作进程写表，这个进程轮询到更新后通知订阅者
+            shards = FeedShards(self.exchanges, symbols, self.workers)
+            shards.start()
+            table = shards.table
+            publisher = FeedPublisher(table)
+
+            async def on_bbo(bbo: BBO):
+                publisher.notify()
+
+            for ex in self.exchanges:
+                ex.listen_bbo(on_bbo)
+            tasks.append(asyncio.create_task(shards.run()))
+        else:
+            table = BBOTable.create(shard_keys(ex_names, symbols, 1))
+            table.own(0)
+            publisher = FeedPublisher(table)
+
+            for ex in self.exchanges:
+                ex_name = ex.__class__.__name__
+
+                async def on_bbo(bbo: BBO, ex_name=ex_name):
+                    slot = table.index.get((ex_name, bbo.symbol))
+                    if slot is not None:
+                        table.write(slot, bbo)
+                        publisher.notify()
+
+                ex.listen_bbo(on_bbo)
+            tasks += start_feeds(self.exchanges, symbols)
+            if WATCHDOG:
+                watchdog = FeedWatchdog(self.exchanges, symbols)
+                tasks.append(asyncio.create_task(watchdog.loop_check()))
+
+        publisher.start()
+        self.log.info(f'本地行情服务启动 交易对:{len(symbols)} 通知:{publisher.path}')
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            publisher.stop()
+            if self.workers <= 0:
+                table.close()
+
+
+if __name__ == '__main__':
+    from exchanges.binance import Binance
+    from exchanges.gate import Gate
+
+    parser = argparse.ArgumentParser(description='本地行情服务')
+    parser.add_argument('--workers', type=int, default=FEED_WORKERS)
+    parser.add_argument('symbols', nargs='*')
+    args = parser.parse_args()
+
+    async def main():
+        # 收到退出信号时取消服务，清理共享表和socket
+        task = asyncio.current_task()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, task.cancel)
+
+        exchanges = [Binance(Secret()), Gate(Secret())]
+        try:
+            await FeedService(exchanges, args.workers).run(args.symbols)
+        except asyncio.CancelledError:
+            print('本地行情服务已停止')
+
+    asyncio.run(main())
@@ -0,0 +1,172 @@
+import asyncio
+import multiprocessing
+
+from exchanges.bbo_table import BBOReader, BBOTable
+from exchanges.exchange import Exchange
+from exchanges.startup import start_feeds
+from exchanges.watchdog import WATCHDOG, FeedWatchdog
+from models.models import *
+from tool import logger
+from tool.ratelimit import TokenBucket
+from config import settings
+
+FEED_WORKERS: int = settings.feed_workers  # 行情工作进程数，0为在主进程里收行情
+FEED_POLL: int = settings.feed_poll  # 主进程轮询共享行情表的间隔(毫秒)
+
+
+def shard_keys(
+    ex_names: list[str],
+    symbols: list[str],
+    workers: int,
+) -> list[tuple[str, str, int]]:
+    """交易对轮流分给各分片，同一个交易对的所有交易所在同一个分片"""
+    keys = []
+    for i, symbol in enumerate(symbols):
+        for ex_name in ex_names:
+            keys.append((ex_name, symbol, i % workers))
+    return keys
+
+
+def run_worker(
+    table_name: str,
+    shard: int,
+    workers: int,
+    ex_types: list[type[Exchange]],
+    symbols: list[str],
+    conn_limit: bool,
+):
+    """工作进程入口"""
+    asyncio.run(worker_main(table_name, shard, workers, ex_types, symbols,
+                            conn_limit))
+
+
+async def worker_main(
+    table_name: str,
+    shard: int,
+    workers: int,
+    ex_types: list[type[Exchange]],
+    symbols: list[str],
+    conn_limit: bool,
+):
+    """建立分片内所有交易对的行情连接，解析出的bbo写进共享内存表"""
+    table = BBOTable.attach(table_name, untrack=False)
+    table.own(shard)
+    index = table.index
+
+    exchanges = []
+    for ex_type in ex_types:
+        ex = ex_type(Secret())
+        ex_name = ex_type.__name__
+        # 订单簿在这里主进程读不到，不维护，也就不用rest拉深度快照
+        ex.book = False
+
+        # 按IP计的限频(建连、rest权重)按进程数均分，所有进程加起来不超过交易所的限制
+        for kind in ex.ip_limits:
+            bucket = ex.governor.buckets[kind]
+            ex.governor.buckets[kind] = TokenBucket(
+                bucket.rate / workers,
+                max(1, bucket.capacity / workers),
+            )
+        if not conn_limit:
+            ex.governor.buckets['conn'] = TokenBucket(1e9, 1e9)
+
+        async def write(bbo: BBO, ex_name=ex_name):
+            slot = index.get((ex_name, bbo.symbol))
+            if slot is not None:
+                table.write(slot, bbo)
+
+        ex.listen_bbo(write)
+        exchanges.append(ex)
+
+    tasks = start_feeds(exchanges, symbols)
+    if WATCHDOG:
+        watchdog = FeedWatchdog(exchanges, symbols)
+        tasks.append(asyncio.create_task(watchdog.loop_check()))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        table.close()
+
+
+class FeedShards:
+    """
+    多进程收行情
+    交易对按分片分给工作进程，每个进程自己建连、解析，把bbo写进共享内存表(见BBOTable)
+    主进程轮询表，把有变化的bbo写回各交易所的bbos并触发emit_bbo，策略照常读(见BBOReader)
+    工作进程不维护本地订单簿(book)，按深度下单不可用
+    """
+
+    def __init__(
+        self,
+        exchanges: list[Exchange],
+        symbols: list[str],
+        workers: int = FEED_WORKERS,
+        conn_limit: bool = True,
+    ):
+        self.log = logger.get_logger(self.__class__.__name__)
+        self.exchanges = {ex.__class__.__name__: ex for ex in exchanges}
+        self.symbols = symbols
+        self.workers = max(1, min(workers, len(symbols)))
+        # 本地压测时可以不限建连速率
+        self.conn_limit = conn_limit
+
+        self.table: BBOTable | None = None
+        self.reader: BBOReader | None = None
+        self.procs: dict[int, multiprocessing.Process] = {}
+        self.ctx = multiprocessing.get_context('spawn')
+
+    def start(self):
+        keys = shard_keys(list(self.exchanges), self.symbols, self.workers)
+        self.table = BBOTable.create(keys)
+        self.reader = BBOReader(self.table, list(self.exchanges.values()))
+
+        for shard in range(self.workers):
+            self.spawn(shard)
+        self.log.info(f'启动 {self.workers} 个行情进程 '
+                      f'{len(self.symbols)} 个交易对 共享表:{self.table.name}')
+
+    def spawn(self, shard: int):
+        symbols = self.symbols[shard::self.workers]
+        ex_types = [type(ex) for ex in self.exchanges.values()]
+        p = self.ctx.Process(
+            target=run_worker,
+            args=(self.table.name, shard, self.workers, ex_types, symbols,
+                  self.conn_limit),
+            name=f'feed-{shard}',
+            daemon=True,
+        )
+        p.start()
+        self.procs[shard] = p
+
+    def stop(self):
+        for p in self.procs.values():
+            p.terminate()
+        for p in self.procs.values():
+            p.join()
+        self.procs.clear()
+        if self.table:
+            self.table.close()
+            self.table = None
+
+    async def loop_supervise(self, interval: float = 1):
+        """工作进程挂了就重启"""
+        while 1:
+            await asyncio.sleep(interval)
+            for shard, p in list(self.procs.items()):
+                if not p.is_alive():
+                    self.log.error(f'行情进程{shard}退出(code:{p.exitcode}) 重启')
+                    self.spawn(shard)
+
+    async def run(self):
+        if not self.table:
+            self.start()
+        supervise = asyncio.create_task(self.loop_supervise())
+        try:
+            poll = FEED_POLL / 1000
+            while 1:
+                # 有更新马上再读一轮，没有就等一个轮询间隔
+                count = await self.reader.poll()
+                await asyncio.sleep(0 if count else poll)
+        finally:
+            supervise.cancel()
+            self.stop()
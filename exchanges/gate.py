@@ -10,16 +10,22 @@ import requests
 from websockets import WebSocketClientProtocol
 from exchanges.conn_pool import ConnPool
 from exchanges.exchange import Exchange
+from exchanges.orderbook import BOOK_LEVELS, OrderBook, fit_levels
+from exchanges.standby import StandbyPair
 from exchanges.ws import WS
 from models.enums import *
 from models.models import *
 from tool import timex
+from tool.ratelimit import Governor, Priority
 from tool.mathx import prec
 from tool.timex import time_s
 from config import settings
 
-BASE_REST = 'https://api.gateio.ws'
-BASE_WS = 'wss://fx-ws.gateio.ws/v4/ws/usdt'
+BASE_REST: str = settings.gate_rest  # rest地址
+BASE_WS: str = settings.gate_ws  # ws地址
+
+# 心跳回复的频道
+PONG = 'futures.pong'
 
 
 class Gate(Exchange):
@@ -27,32 +33,48 @@ class Gate(Exchange):
     def __init__(self, secret: Secret):
         super().__init__(secret)
         self.req = requests.Session()
-        self.wss: dict[str, WS] = {}
-        self.ping_interval = 10
+        self.rest_url = BASE_REST
+        # 私有rest接口 200次/10秒，ws下单 100次/秒，建连没有公开限制按10次/秒
+        self.governor = Governor({
+            'rest': (20, 20),
+            'order': (100, 100),
+            'conn': (10, 100),
+        })
 
     async def listen_public(self, symbol: str = ''):
         if symbol:
             name = f'{self.__class__.__name__} {symbol}'
+            if self.book:
+                self.books[symbol] = OrderBook(symbol, offset=1)
             ws = WS(
                 uri=BASE_WS,
                 name=name,
+                conn_bucket=self.governor.buckets['conn'],
                 symbol=symbol,
                 on_conn=self.pub_conn,
                 on_msg=self.pub_msg,
+                ping_msg=self.ping_msg,
+                pong=PONG,
             )
             self.wss[symbol] = ws
             await ws.loop_conn()
 
     async def listen_private(self):
-        name = f'{self.__class__.__name__} 私有连接'
-        ws = WS(
-            uri=BASE_WS,
-            name=name,
-            on_conn=self.pri_conn,
-            on_msg=self.pri_msg,
-        )
-        self.wss['PRIVATE'] = ws
-        await ws.loop_conn()
+
+        def new_ws() -> WS:
+            name = f'{self.__class__.__name__} 私有连接'
+            return WS(
+                uri=BASE_WS,
+                name=name,
+                conn_bucket=self.governor.buckets['conn'],
+                on_conn=self.pri_conn,
+                on_msg=self.pri_msg,
+                ping_msg=self.ping_msg,
+                pong=PONG,
+            )
+
+        self.private = StandbyPair(self.log, new_ws, self.resync_private)
+        await self.private.run()
 
     async def listen_ws_api(self, count: int):
 
@@ -61,19 +83,19 @@ class Gate(Exchange):
             return WS(
                 uri=BASE_WS,
                 name=name,
+                conn_bucket=self.governor.buckets['conn'],
                 on_conn=self.wsapi_conn,
                 on_msg=self.wsapi_msg,
+                ping_msg=self.ping_msg,
+                pong=PONG,
             )
 
         self.ws_api_pool = ConnPool(self.log, new_ws)
         await self.ws_api_pool.run(count, 0.5)
 
-    async def loop_ping(self, conn: WebSocketClientProtocol):
-        while 1:
-            await asyncio.sleep(self.ping_interval)
-            now = time_s()
-            req = {"time": now, "channel": "futures.ping"}
-            await conn.send(json.dumps(req))
+    def ping_msg(self) -> str:
+        """应用层心跳，回复是futures.pong(见Heartbeat)"""
+        return json.dumps({"time": time_s(), "channel": "futures.ping"})
 
     async def pub_conn(
         self,
@@ -91,7 +113,21 @@ class Gate(Exchange):
             "payload": [ex_symbol],
         }
         await ws.send(msg)
-        return [asyncio.create_task(self.loop_ping(conn))]
+
+        if self.book:
+            # 增量深度，重连后订单簿要重新拉快照
+            self.books[symbol].reset()
+            levels = fit_levels(BOOK_LEVELS, [20, 50, 100])
+            msg = {
+                "time": now,
+                "channel": "futures.order_book_update",
+                "event": "subscribe",
+                "payload": [ex_symbol, "100ms", str(levels)],
+            }
+            await ws.send(msg)
+            self.resync_book(symbol)
+
+        return []
 
     async def pub_msg(
         self,
@@ -114,18 +150,32 @@ class Gate(Exchange):
 
             self.bbos[symbol] = bbo
             await self.emit_bbo(bbo)
+        elif msg['channel'] == 'futures.order_book_update' and msg[
+                'event'] == 'update':
+            self.handle_depth(symbol, msg['result'])
 
         if 'request_id' in msg and ('ack' not in msg or not msg['ack']):
             return msg, msg['request_id']
         return msg, ''
 
+    def handle_depth(self, symbol: str, data: dict):
+        """增量深度"""
+        book = self.books.get(symbol)
+        if not book:
+            return
+        bids = [(float(l['p']), float(l['s'])) for l in data['b']]
+        asks = [(float(l['p']), float(l['s'])) for l in data['a']]
+        if not book.on_diff(data['U'], data['u'], None, bids, asks, data['t']):
+            self.log.warning(f'{symbol} 深度序号断档 重新拉快照')
+            self.resync_book(symbol)
+
     async def pri_conn(
         self,
         conn: WebSocketClientProtocol,
         symbol: str,
     ) -> list[asyncio.Task]:
         """私有ws连接事件"""
-        ws = self.wss['PRIVATE']
+        ws = self.private.find(conn)
         now = time_s()
 
         sign = self.get_sign('futures.orders', 'subscribe', now)
@@ -156,11 +206,25 @@ class Gate(Exchange):
         }
         await ws.send(req)
 
-        # 重连的时候防止丢数据
-        self.orders = await self.get_orders()
-        self.pos = await self.get_positions()
+        sign = self.get_sign('futures.balances', 'subscribe', now)
+        req = {
+            "time": now,
+            "channel": "futures.balances",
+            "event": "subscribe",
+            "payload": [self.account.user_id],
+            "auth": {
+                "method": "api_key",
+                "KEY": self.secret.key,
+                "SIGN": sign
+            }
+        }
+        await ws.send(req)
+
+        # 重连的时候用rest补齐断线期间丢掉的推送，备用连接不处理推送不用补
+        if not ws.standby:
+            await self.resync_private()
 
-        return [asyncio.create_task(self.loop_ping(conn))]
+        return []
 
     def get_sign(self, ch: str, event: str, now: int) -> str:
         """账号ws鉴权"""
@@ -186,6 +250,8 @@ class Gate(Exchange):
                 await self.handle_order(msg)
             elif msg['channel'] == 'futures.positions':
                 await self.handle_pos(msg)
+            elif msg['channel'] == 'futures.balances':
+                await self.handle_account(msg)
 
         if 'request_id' in msg and ('ack' not in msg or not msg['ack']):
             return msg, msg['request_id']
@@ -196,12 +262,12 @@ class Gate(Exchange):
         conn: WebSocketClientProtocol,
         symbol: str,
     ) -> list[asyncio.Task]:
-        """wsapi连接事件"""
-        await self.ws_login()
+        """wsapi连接事件，在这条连接上登录(备用连接也提前登录好)"""
+        await self.ws_login(self.ws_api_pool.find(conn))
 
-        return [asyncio.create_task(self.loop_ping(conn))]
+        return []
 
-    async def ws_login(self):
+    async def ws_login(self, ws: WS):
         """登录websocket"""
         now = timex.time_s()
         msg_id = uuid.uuid4().hex
@@ -217,7 +283,7 @@ class Gate(Exchange):
                 "req_id": msg_id,
             },
         }
-        await self.ws_api_pool.send(req)
+        await ws.send(req)
 
     async def wsapi_msg(
         self,
@@ -227,6 +293,8 @@ class Gate(Exchange):
     ):
         """wsapi消息事件"""
         msg = json.loads(msg)
+        if 'header' in msg:
+            self.wsapi_limits(msg['header'])
 
         if 'ack' in msg and msg['ack']:
             return msg, ''
@@ -244,6 +312,19 @@ class Gate(Exchange):
             return msg, msg['request_id']
         return msg, ''
 
+    def wsapi_limits(self, header: dict):
+        """用ws api响应头里的剩余次数校准"""
+        remain = header.get('x_gate_ratelimit_requests_remain')
+        limit = header.get('x_gate_ratelimit_limit')
+        # 交易所返回的字段名就是x_gat
+        reset = header.get('x_gat_ratelimit_reset_timestamp') or header.get(
+            'x_gate_ratelimit_reset_timestamp')
+        if remain is None or not limit:
+            return
+        window = max((int(reset) - timex.time_ms()) / 1000, 1) if reset else 1
+        limit = int(limit)
+        self.governor.update('order', limit - int(remain), limit, window)
+
     def ws_api_sign(self, ch: str, query: str, now: int) -> str:
         """ws登录鉴权"""
         secret = self.secret.secret
@@ -289,18 +370,21 @@ class Gate(Exchange):
                 side=side,
                 trade_side=tside,
                 c_time=data['create_time_ms'],
+                client_id=data.get('text', ''),
             )
 
             # 维护本地订单
-            if status in self.done_staus and id in self.orders:
-                del self.orders[id]
-            else:
-                self.orders[id] = order
+            self.orders.put(order)
 
             await self.emit_order(order)
 
-            if len(self.orders) > 500:
-                self.orders = dict(list(self.orders.items())[-100:])
+    async def handle_account(self, msg: dict):
+        """更新余额，推送里只有总余额，可用余额在rest基准上按变化量更新"""
+        for data in msg['result']:
+            if data['currency'].upper() == settings.quote:
+                self.account.swap_balance = float(data['balance'])
+        self.update_available()
+        self.log.info(f'可用余额:{self.account.swap_available}')
 
     async def handle_pos(self, msg: dict):
         """更新仓位"""
@@ -309,12 +393,27 @@ class Gate(Exchange):
             price = data['entry_price']
             size = float(data['size'])
             amount = abs(size)
-            side = Side.BUY if size > 0 else Side.SELL
+            # 双向持仓平仓后size是0，要按mode区分多空
+            mode = data.get('mode', '')
+            if mode == 'dual_long':
+                side = Side.BUY
+            elif mode == 'dual_short':
+                side = Side.SELL
+            else:
+                side = Side.BUY if size > 0 else Side.SELL
             id = symbol + str(side)
 
             # 平仓
             if amount == 0 and id in self.pos:
                 del self.pos[id]
+                await self.emit_pos(Position(
+                    symbol=symbol,
+                    id=id,
+                    side=side,
+                    price=price,
+                    amount=0,
+                    ex_name=self.__class__.__name__,
+                ))
                 continue
 
             status_str = '更新' if id in self.pos else '新增'
@@ -324,11 +423,14 @@ class Gate(Exchange):
                 side=side,
                 price=price,
                 amount=amount,
+                ex_name=self.__class__.__name__,
             )
             self.pos[id] = pos
+            await self.emit_pos(pos)
 
             m = f'{status_str}仓位: {id} 方向:{side} 价格:{price} 数量:{amount}'
             self.log.info(m)
+        self.update_available()
 
     async def init(self, symbols: list[str]):
         await self.set_position_mode()
@@ -357,7 +459,13 @@ class Gate(Exchange):
         path: str,
         query: dict = {},
         payload: dict = {},
+        priority: Priority = Priority.NORMAL,
     ):
+        """rest请求，低优先级请求被丢弃、关键请求被限频时返回None"""
+        if not await self.governor.acquire('rest', 1, priority):
+            self.log.warning(f'限频 丢弃请求 {path}')
+            return None
+
         url = BASE_REST + path
         args = {}
 
@@ -376,9 +484,27 @@ class Gate(Exchange):
         })
         args['headers'] = headers
 
-        res = self.req.request(method, url, **args)
+        # 同步请求放到线程里执行，不阻塞事件循环
+        res = await asyncio.to_thread(self.req.request, method, url, **args)
+        self.rest_limits(res)
         return res
 
+    def rest_limits(self, res: requests.Response):
+        """用rest响应头里的剩余次数校准"""
+        remain = res.headers.get('X-Gate-RateLimit-Requests-Remain')
+        limit = res.headers.get('X-Gate-RateLimit-Limit')
+        reset = res.headers.get('X-Gate-RateLimit-Reset-Timestamp')
+        window = 10
+        if reset:
+            window = max((int(reset) - timex.time_ms()) / 1000, 1)
+        if remain is not None and limit:
+            limit = int(limit)
+            self.governor.update('rest', limit - int(remain), limit, window)
+
+        if res.status_code == 429:
+            self.governor.block('rest', window)
+            self.log.error(f'rest被限频 暂停{window:.0f}秒')
+
     async def get_rules(self) -> dict[str, ContractRule]:
         res = await self.go('GET', '/api/v4/futures/usdt/contracts')
         res = res.json()
@@ -399,6 +525,23 @@ class Gate(Exchange):
             )
         return rules
 
+    async def get_book_snapshot(
+        self,
+        symbol: str,
+    ) -> tuple[int, list, list, int] | None:
+        ex_symbol = symbol.replace(settings.quote, '_' + settings.quote)
+        res = await self.go('GET', '/api/v4/futures/usdt/order_book', {
+            'contract': ex_symbol,
+            'limit': BOOK_LEVELS,
+            'with_id': 'true',
+        })
+        if res is None:
+            return None
+        res = res.json()
+        bids = [(float(l['p']), float(l['s'])) for l in res['bids']]
+        asks = [(float(l['p']), float(l['s'])) for l in res['asks']]
+        return res['id'], bids, asks, int(res['current'] * 1000)
+
     async def create_order(
         self,
         symbol: str,
@@ -408,6 +551,34 @@ class Gate(Exchange):
         amount: float,
         price: float = 0,
     ) -> tuple[str, str]:
+        msg_id, req = self.order_request(
+            symbol,
+            side,
+            trade_side,
+            type,
+            amount,
+            price,
+        )
+        if not await self.governor.acquire('order', 1, Priority.CRITICAL):
+            return '', '被限频'
+        res, ok = await self.ws_api_pool.send(req, msg_id)
+        if not ok:
+            return '', 'ws未连接'
+        if 'errs' in res['data'] and res['data']['errs']:
+            return '', str(res['data']['errs'])
+
+        return str(res['data']['result']['id']), ''
+
+    def order_request(
+        self,
+        symbol: str,
+        side: Side,
+        trade_side: TradeSide,
+        type: OrderType,
+        amount: float,
+        price: float = 0,
+    ) -> tuple[str, dict]:
+        """生成ws api下单请求: 请求id, 请求"""
         args = {}
         args['contract'] = symbol.replace(settings.quote, '_' + settings.quote)
 
@@ -425,6 +596,8 @@ class Gate(Exchange):
             args['tif'] = str(type).lower()
 
         msg_id = uuid.uuid4().hex
+        # 客户端订单id必须以t-开头，最多28个字符
+        args['text'] = 't-' + msg_id[:26]
         req = {
             "time": int(time.time()),
             "channel": "futures.order_place",
@@ -434,17 +607,17 @@ class Gate(Exchange):
                 "req_param": args
             },
         }
-        res, ok = await self.ws_api_pool.send(req, msg_id)
-        if not ok:
-            return '', 'ws未连接'
-        if 'errs' in res['data'] and res['data']['errs']:
-            return '', str(res['data']['errs'])
-
-        return str(res['data']['result']['id']), ''
+        return msg_id, req
 
     async def cancel_order(self, id: str, symbol: str = ''):
-        res = await self.go('DELETE', f'/api/v4/futures/usdt/orders/{id}')
-        if res.status_code == 200:
+        res = await self.go(
+            'DELETE',
+            f'/api/v4/futures/usdt/orders/{id}',
+            priority=Priority.CRITICAL,
+        )
+        if res is None:
+            self.log.error(f'撤销订单{id}失败: 被限频')
+        elif res.status_code == 200:
             self.log.info(f'撤销订单{id}成功')
         else:
             self.log.info(f'撤销订单{id}失败: {res.text}')
@@ -456,8 +629,11 @@ class Gate(Exchange):
             query={
                 'contract': symbol,
             },
+            priority=Priority.CRITICAL,
         )
-        if res.status_code == 200:
+        if res is None:
+            self.log.error(f'全部撤单失败: 被限频')
+        elif res.status_code == 200:
             self.log.info(f'全部撤单成功')
         else:
             self.log.info(f'全部撤单失败: {res.text}')
@@ -504,16 +680,23 @@ class Gate(Exchange):
                 side=side,
                 trade_side=tside,
                 c_time=int(data['create_time'] * 1000),
+                client_id=data.get('text', ''),
             )
 
         return orders
 
-    async def get_positions(self) -> dict[str, Position]:
+    async def get_positions(
+        self,
+        priority: Priority = Priority.NORMAL,
+    ) -> dict[str, Position] | None:
         res = await self.go(
             'GET',
             f'/api/v4/futures/usdt/positions',
             query={'holding': True},
+            priority=priority,
         )
+        if res is None:
+            return None
         res = res.json()
 
         positions = {}
@@ -535,6 +718,7 @@ class Gate(Exchange):
                 side=side,
                 price=price,
                 amount=amount,
+                ex_name=self.__class__.__name__,
             )
         return positions
 
@@ -555,6 +739,26 @@ class Gate(Exchange):
         if res.status_code > 299:
             return res.text
 
+    async def get_leverages(self) -> dict[str, int]:
+        res = await self.go(
+            'GET',
+            f'/api/v4/futures/usdt/positions',
+            query={'holding': False},
+        )
+        res = res.json()
+
+        # 双向持仓每个合约有多空两条，不一致时当成需要重新设置
+        leverages = {}
+        for data in res:
+            symbol = data['contract'].replace('_', '')
+            leverage = int(float(data['cross_leverage_limit']))
+            if float(data['leverage']) != 0:
+                leverage = 0
+            if leverages.get(symbol, leverage) != leverage:
+                leverage = 0
+            leverages[symbol] = leverage
+        return leverages
+
     async def set_margin_mode(self, symbol: str = ''):
         """在设置杠杆里已经实现了"""
         pass
@@ -576,17 +780,21 @@ class Gate(Exchange):
         else:
             self.log.info(f'设置双向持仓失败: {res.text}')
 
-    async def update_balance(self):
+    async def update_balance(self, priority: Priority = Priority.NORMAL):
         res = await self.go(
             'GET',
             '/api/v4/futures/usdt/accounts',
+            priority=priority,
         )
+        if res is None:
+            return
         res = res.json()
 
         self.account.user_id = str(res['user'])
         self.account.in_dual_mode = res['in_dual_mode']
         self.account.swap_balance = float(res['total'])
         self.account.swap_available = float(res['available'])
+        self.mark_available()
 
 
 if __name__ == '__main__':
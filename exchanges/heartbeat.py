@@ -0,0 +1,147 @@
+import asyncio
+import time
+import weakref
+
+from tool import logger
+from config import settings
+
+PING_INTERVAL: float = settings.ping_interval  # 心跳间隔(秒)
+PONG_TIMEOUT: float = settings.pong_timeout  # 心跳超时(秒)，超时没有回复就断开重连
+
+# 时间轮每格的时长(秒)和格数，超过一圈的按圈数等待
+WHEEL_TICK = 0.5
+WHEEL_SLOTS = 64
+
+
+class Heartbeat:
+    """
+    心跳服务
+    所有ws连接挂在一个时间轮上，一个任务按格推进，到期的连接发ping
+    没有应用层ping的发协议ping帧，回复的pong帧算往返时间；有应用层ping的(gate的futures.ping)由WS在收到回复时通知
+    发出ping之后超时没回复(静默或者半开的连接)直接断开，让WS.loop_conn重连
+    每个事件循环一个实例
+    """
+
+    services: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Heartbeat]' = (
+        weakref.WeakKeyDictionary())
+
+    def __init__(
+        self,
+        interval: float = PING_INTERVAL,
+        timeout: float = PONG_TIMEOUT,
+    ):
+        self.log = logger.get_logger(self.__class__.__name__)
+        self.interval = interval
+        self.timeout = timeout
+        # 每格: [(剩余圈数, 连接, 注册代数)]
+        self.wheel: list[list[tuple[int, object, int]]] = [
+            [] for _ in range(WHEEL_SLOTS)
+        ]
+        self.cursor = 0
+        self.count = 0
+        self.task: asyncio.Task | None = None
+        # 发ping的任务引用，防止被回收
+        self.sends: set[asyncio.Task] = set()
+        # 因为心跳超时断开的次数
+        self.dead = 0
+
+    @classmethod
+    def get(cls) -> 'Heartbeat':
+        """当前事件循环的心跳服务，第一次用时启动"""
+        loop = asyncio.get_running_loop()
+        hb = cls.services.get(loop)
+        if not hb:
+            hb = cls.services[loop] = cls()
+        if not hb.task or hb.task.done():
+            hb.task = loop.create_task(hb.loop_wheel())
+        return hb
+
+    def add(self, ws):
+        """连接建立后挂上时间轮，第一次ping在一个心跳间隔之后"""
+        ws.hb_gen += 1
+        ws.ping_at = 0
+        ws.last_ping = time.monotonic()
+        self.count += 1
+        self.schedule(ws, self.interval)
+
+    def remove(self, ws):
+        """连接断开，时间轮上的旧条目按代数作废"""
+        ws.hb_gen += 1
+        ws.ping_at = 0
+        self.count -= 1
+
+    def schedule(self, ws, delay: float):
+        ticks = max(1, round(delay / WHEEL_TICK))
+        slot = (self.cursor + ticks) % WHEEL_SLOTS
+        rounds = (ticks - 1) // WHEEL_SLOTS
+        self.wheel[slot].append((rounds, ws, ws.hb_gen))
+
+    async def loop_wheel(self):
+        next_at = time.monotonic()
+        while 1:
+            next_at += WHEEL_TICK
+            await asyncio.sleep(max(0, next_at - time.monotonic()))
+            self.cursor = (self.cursor + 1) % WHEEL_SLOTS
+            due = self.wheel[self.cursor]
+            if not due:
+                continue
+            self.wheel[self.cursor] = []
+            now = time.monotonic()
+            for rounds, ws, gen in due:
+                if gen != ws.hb_gen:
+                    continue
+                if rounds:
+                    self.wheel[self.cursor].append((rounds - 1, ws, gen))
+                    continue
+                self.check(ws, now)
+
+    def check(self, ws, now: float):
+        if not ws.ok():
+            return
+
+        # 等回复中
+        if ws.ping_at:
+            wait = now - ws.ping_at
+            if wait >= self.timeout:
+                self.dead += 1
+                ws.log.warning(f'心跳超时 {wait:.1f}秒没有回复 断开重连')
+                ws.abort()
+                return
+            self.schedule(ws, self.timeout - wait)
+            return
+
+        elapsed = now - ws.last_ping
+        if elapsed < self.interval:
+            self.schedule(ws, self.interval - elapsed)
+            return
+
+        ws.ping_at = ws.last_ping = now
+        task = asyncio.create_task(self.ping(ws))
+        self.sends.add(task)
+        task.add_done_callback(self.sends.discard)
+        self.schedule(ws, self.timeout)
+
+    async def ping(self, ws):
+        gen = ws.hb_gen
+        try:
+            if ws.ping_msg:
+                await ws.ws.send(ws.ping_msg())
+                return
+            # 协议ping帧，回复的pong帧完成waiter
+            waiter = await ws.ws.ping()
+
+            def on_pong(f: asyncio.Future):
+                if f.cancelled():
+                    return
+                # 连接断开时waiter带着ConnectionClosed结束，取出来避免报未读取的异常
+                if f.exception() is not None:
+                    return
+                if gen == ws.hb_gen:
+                    ws.on_pong()
+
+            waiter.add_done_callback(on_pong)
+        except Exception as e:
+            ws.log.warning(f'发送心跳失败 {e}')
+
+    def report(self) -> dict:
+        return {'conns': self.count, 'dead': self.dead}
@@ -0,0 +1,109 @@
+import asyncio
+import socket
+import ssl
+import time
+from urllib.parse import urlsplit
+
+import websockets
+from websockets.client import WebSocketClientProtocol
+
+from tool import logger
+from config import settings
+
+DNS_TTL: float = settings.dns_ttl  # dns缓存时间(秒)
+
+log = logger.get_logger('net')
+
+
+class DNSCache:
+    """
+    域名解析缓存
+    重连时不用再查一次dns；连接失败时作废，下次重新解析
+    """
+
+    def __init__(self, ttl: float = DNS_TTL):
+        self.ttl = ttl
+        # (域名, 端口) -> (地址, 过期时间)
+        self.entries: dict[tuple[str, int], tuple[str, float]] = {}
+
+    async def resolve(self, host: str, port: int) -> str:
+        key = (host, port)
+        entry = self.entries.get(key)
+        now = time.monotonic()
+        if entry and entry[1] > now:
+            return entry[0]
+
+        loop = asyncio.get_running_loop()
+        infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        addr = infos[0][4][0]
+        self.entries[key] = (addr, now + self.ttl)
+        return addr
+
+    def invalidate(self, host: str, port: int):
+        self.entries.pop((host, port), None)
+
+
+class ResumingContext(ssl.SSLContext):
+    """
+    按域名缓存TLS会话，重连时带上会话做恢复，省掉一次完整握手
+    asyncio建TLS连接时走wrap_bio，在这里补上缓存的会话
+    """
+
+    def __new__(cls):
+        return super().__new__(cls, ssl.PROTOCOL_TLS_CLIENT)
+
+    def __init__(self):
+        # 域名 -> 最近一次的会话
+        self.sessions: dict[str, ssl.SSLSession] = {}
+        self.load_default_certs()
+
+    def wrap_bio(self, incoming, outgoing, server_side=False,
+                 server_hostname=None, session=None):
+        if session is None and server_hostname:
+            session = self.sessions.get(server_hostname)
+        return super().wrap_bio(incoming, outgoing, server_side,
+                                server_hostname, session)
+
+    def save(self, host: str, conn: WebSocketClientProtocol) -> bool:
+        """
+        记下连接的TLS会话(TLS1.3的会话票据在握手之后才到，收到第一条消息后再记)
+        return: 这次连接是否是恢复的会话
+        """
+        obj = conn.transport.get_extra_info('ssl_object')
+        if obj is None:
+            return False
+        if obj.session is not None:
+            self.sessions[host] = obj.session
+        return obj.session_reused
+
+
+dns = DNSCache()
+tls = ResumingContext()
+
+
+async def connect(uri: str, **kwargs) -> WebSocketClientProtocol:
+    """
+    建立ws连接，地址走dns缓存，wss走带会话恢复的TLS
+    心跳由Heartbeat统一发，这里关掉websockets自己的ping
+    """
+    parts = urlsplit(uri)
+    secure = parts.scheme == 'wss'
+    host = parts.hostname
+    port = parts.port or (443 if secure else 80)
+
+    addr = await dns.resolve(host, port)
+    if secure:
+        kwargs.setdefault('ssl', tls)
+        kwargs.setdefault('server_hostname', host)
+    try:
+        return await websockets.connect(
+            uri,
+            host=addr,
+            port=port,
+            ping_interval=None,
+            **kwargs,
+        )
+    except OSError:
+        # 缓存的地址连不上，下次重新解析
+        dns.invalidate(host, port)
+        raise
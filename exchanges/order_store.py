@@ -0,0 +1,90 @@
+from collections import OrderedDict
+
+from models.enums import *
+from models.models import *
+
+# 结束状态，只有这些订单会被淘汰
+DONE_STATUS = {OrderStatus.FILLED, OrderStatus.CANCELED}
+
+
+class OrderStore:
+    """
+    订单存储
+    按订单id、客户端id O(1)查找，按交易对索引
+    只淘汰已结束的订单(按最近更新的LRU)，没结束的订单一直保留，内存不随订单流增长
+    """
+
+    def __init__(self, max_done: int = 500):
+        # 最多保留的已结束订单数
+        self.max_done = max_done
+
+        # 订单id -> 订单
+        self.orders: dict[str, Order] = {}
+        # 客户端id -> 订单id
+        self.by_client: dict[str, str] = {}
+        # 交易对 -> 订单id(用dict当有序集合)
+        self.by_symbol: dict[str, dict[str, None]] = {}
+        # 已结束的订单id，越靠后越新
+        self.done: OrderedDict[str, None] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.orders)
+
+    def __contains__(self, id: str) -> bool:
+        return id in self.orders
+
+    def get(self, id: str) -> Order | None:
+        return self.orders.get(id)
+
+    def get_client(self, client_id: str) -> Order | None:
+        id = self.by_client.get(client_id)
+        return self.orders.get(id) if id else None
+
+    def symbol_orders(self, symbol: str) -> list[Order]:
+        """交易对的所有订单"""
+        return [self.orders[id] for id in self.by_symbol.get(symbol, ())]
+
+    def open_orders(self) -> list[Order]:
+        """没结束的订单"""
+        return [o for id, o in self.orders.items() if id not in self.done]
+
+    def put(self, order: Order):
+        """新增或更新订单"""
+        id = order.id
+        self.orders[id] = order
+        if order.client_id:
+            self.by_client[order.client_id] = id
+        self.by_symbol.setdefault(order.symbol, {})[id] = None
+
+        if order.status in DONE_STATUS:
+            self.done[id] = None
+            self.done.move_to_end(id)
+            while len(self.done) > self.max_done:
+                old, _ = self.done.popitem(last=False)
+                self.remove(old)
+        else:
+            self.done.pop(id, None)
+
+    def remove(self, id: str):
+        order = self.orders.pop(id, None)
+        if not order:
+            return
+        self.done.pop(id, None)
+        if self.by_client.get(order.client_id) == id:
+            del self.by_client[order.client_id]
+        ids = self.by_symbol.get(order.symbol)
+        if ids is not None:
+            ids.pop(id, None)
+            if not ids:
+                del self.by_symbol[order.symbol]
+
+    def sync_open(self, orders: dict[str, Order]):
+        """
+        用rest拉到的挂单校准(断线重连时)
+        本地没结束但是挂单里没有的，断线期间已经结束了，状态未知直接删掉
+        """
+        for order in self.open_orders():
+            if order.id not in orders:
+                self.remove(order.id)
+        for order in orders.values():
+            self.put(order)
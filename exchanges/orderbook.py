@@ -0,0 +1,179 @@
+from array import array
+from bisect import bisect_left, bisect_right
+
+from models.enums import *
+from config import settings
+
+BOOK: bool = settings.book  # 是否维护本地订单簿(按深度计算下单量)
+BOOK_LEVELS: int = settings.book_levels  # 本地订单簿每边最多保留的档数
+BOOK_BUFFER: int = 1000  # 快照到达前最多缓存的增量条数
+
+
+def fit_levels(levels: int, choices: list[int]) -> int:
+    """交易所只支持固定档数，取不小于levels的最小档数"""
+    for c in choices:
+        if c >= levels:
+            return c
+    return choices[-1]
+
+
+class BookSide:
+    """
+    订单簿的一边，价位按从优到劣存在连续的double数组里
+    买盘存负价格，两边都是升序，查找和按价格累计数量都是二分+切片
+    档数不多，插入删除是一次内存移动，比numpy的单次调用开销小
+    保留的档数满了就挤掉最差的一档
+    """
+
+    def __init__(self, sign: int, levels: int):
+        # 买盘-1 卖盘1
+        self.sign = sign
+        self.levels = levels
+        self.keys = array('d')
+        self.amounts = array('d')
+
+    @property
+    def n(self) -> int:
+        return len(self.keys)
+
+    def clear(self):
+        del self.keys[:]
+        del self.amounts[:]
+
+    def set(self, price: float, amount: float):
+        """更新一档，数量为0就删掉"""
+        key = price * self.sign
+        keys = self.keys
+        i = bisect_left(keys, key)
+
+        if i < len(keys) and keys[i] == key:
+            if amount > 0:
+                self.amounts[i] = amount
+            else:
+                del keys[i]
+                del self.amounts[i]
+            return
+
+        if amount <= 0:
+            return
+        # 比保留的最差一档还差，丢掉
+        if i >= self.levels:
+            return
+        keys.insert(i, key)
+        self.amounts.insert(i, amount)
+        if len(keys) > self.levels:
+            keys.pop()
+            self.amounts.pop()
+
+    def best(self) -> tuple[float, float] | None:
+        if not self.keys:
+            return None
+        return self.keys[0] * self.sign, self.amounts[0]
+
+    def depth(self, limit: float) -> float:
+        """价格不差于limit的总数量"""
+        i = bisect_right(self.keys, limit * self.sign)
+        return sum(self.amounts[:i])
+
+
+class OrderBook:
+    """
+    本地L2订单簿，快照+增量维护
+    快照到之前增量先缓存，快照到了按序号接上；序号断档就清空，等重新拉快照
+    offset: 快照后第一条增量要满足 U <= 快照id+offset <= u (币安0，gate1)
+    """
+
+    def __init__(self, symbol: str, levels: int = BOOK_LEVELS, offset: int = 0):
+        self.symbol = symbol
+        self.offset = offset
+        self.bids = BookSide(-1, levels)
+        self.asks = BookSide(1, levels)
+        # 最后应用的更新id
+        self.last_id = 0
+        # 是否已经接上快照
+        self.synced = False
+        # 快照后还没接上第一条增量
+        self.first = True
+        # 最后更新时间
+        self.time = 0
+        # 快照到之前缓存的增量
+        self.buffer: list[tuple] = []
+
+    def reset(self):
+        """失步，清空等重新拉快照"""
+        self.synced = False
+        self.first = True
+        self.last_id = 0
+        self.buffer.clear()
+        self.bids.clear()
+        self.asks.clear()
+
+    def on_snapshot(
+        self,
+        id: int,
+        bids: list[tuple[float, float]],
+        asks: list[tuple[float, float]],
+        time: int,
+    ) -> bool:
+        """加载快照并接上缓存的增量，返回是否同步成功(失败需要重新拉快照)"""
+        buffer = self.buffer
+        self.buffer = []
+        self.reset()
+        for price, amount in bids:
+            self.bids.set(price, amount)
+        for price, amount in asks:
+            self.asks.set(price, amount)
+        self.last_id = id
+        self.time = time
+        self.synced = True
+
+        for diff in buffer:
+            if not self.on_diff(*diff):
+                return False
+        return True
+
+    def on_diff(
+        self,
+        U: int,
+        u: int,
+        pu: int | None,
+        bids: list[tuple[float, float]],
+        asks: list[tuple[float, float]],
+        time: int,
+    ) -> bool:
+        """
+        应用增量，返回False表示序号断档需要重新拉快照
+        pu: 上一条增量的u(币安有)，没有就要求 U = 上一条的u+1
+        """
+        if not self.synced:
+            self.buffer.append((U, u, pu, bids, asks, time))
+            if len(self.buffer) > BOOK_BUFFER:
+                self.buffer.pop(0)
+            return True
+
+        if self.first:
+            base = self.last_id + self.offset
+            # 比快照旧的增量丢掉
+            if u < base:
+                return True
+            if U > base:
+                self.reset()
+                return False
+            self.first = False
+        elif (pu if pu is not None else U - 1) != self.last_id:
+            self.reset()
+            return False
+
+        for price, amount in bids:
+            self.bids.set(price, amount)
+        for price, amount in asks:
+            self.asks.set(price, amount)
+        self.last_id = u
+        self.time = time
+        return True
+
+    def depth(self, side: Side, limit: float) -> float:
+        """吃单方向为side时，价格不差于limit能成交的数量"""
+        if side == Side.BUY:
+            return self.asks.depth(limit)
+        return self.bids.depth(limit)
@@ -0,0 +1,82 @@
+import json
+import os
+from dataclasses import asdict, fields
+
+from models.models import ContractRule
+from tool import timex
+from config import settings
+
+RULES_CACHE_DIR: str = settings.rules_cache_dir  # 交易规则缓存目录
+RULES_CACHE_TTL: int = settings.rules_cache_ttl  # 交易规则缓存有效期(秒)
+
+# 交易所运行时设置的字段，不从缓存和刷新结果覆盖
+RUNTIME_FIELDS = {'trade_leverage'}
+
+
+def cache_path(name: str, path: str = RULES_CACHE_DIR) -> str:
+    return os.path.join(path, f'{name}.json')
+
+
+def load(
+    name: str,
+    path: str = RULES_CACHE_DIR,
+) -> tuple[dict[str, ContractRule], float]:
+    """
+    读取缓存
+    path: 缓存目录，录制行情时录制目录里也有一份
+    return: (交易规则, 缓存时长秒)，没有缓存或格式不对时返回空规则
+    """
+    try:
+        with open(cache_path(name, path)) as f:
+            data = json.load(f)
+        rules = {s: ContractRule(**r) for s, r in data['rules'].items()}
+        age = timex.time_s() - float(data['time'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}, float('inf')
+    return rules, age
+
+
+def save(name: str, rules: dict[str, ContractRule], path: str = RULES_CACHE_DIR):
+    """写缓存，先写临时文件再替换，避免中途退出留下半个文件"""
+    os.makedirs(path, exist_ok=True)
+    path = cache_path(name, path)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({
+            'time': timex.time_s(),
+            'rules': {s: asdict(r) for s, r in rules.items()},
+        }, f)
+    os.replace(tmp, path)
+
+
+def apply(
+    rules: dict[str, ContractRule],
+    new: dict[str, ContractRule],
+) -> tuple[list[str], list[str], list[str]]:
+    """
+    把新规则合并到现有规则里
+    已有的规则原地更新(保留运行时字段)，外面持有的引用不会失效
+    下架的规则不删除，标记为delisted(还有仓位要平，运行中查规则不能查不到)
+    return: (新增, 下架, 变更)的交易对
+    """
+    added = [s for s in new if s not in rules]
+    removed = [s for s, r in rules.items() if s not in new and not r.delisted]
+    changed = []
+    for symbol, rule in new.items():
+        old = rules.get(symbol)
+        if old is None:
+            rules[symbol] = rule
+            continue
+        diff = False
+        for f in fields(ContractRule):
+            if f.name in RUNTIME_FIELDS:
+                continue
+            value = getattr(rule, f.name)
+            if getattr(old, f.name) != value:
+                setattr(old, f.name, value)
+                diff = True
+        if diff:
+            changed.append(symbol)
+    for symbol in removed:
+        rules[symbol].delisted = True
+    return added, removed, changed
@@ -0,0 +1,67 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+from websockets.client import WebSocketClientProtocol
+
+from exchanges.ws import WS
+from config import settings
+
+PRIVATE_STANDBY: bool = settings.private_standby  # 私有流是否多开一条备用连接
+
+
+class StandbyPair:
+    """
+    私有流主备连接
+    两条连接都连上并订阅，主连接处理推送，备用连接只保持连接(收到的推送丢掉)
+    主连接断开时备用连接马上接替，用rest补一次断开前后可能漏掉的推送；断开的那条重连后做备用
+    """
+
+    def __init__(
+        self,
+        log: logging.Logger,
+        new_ws: Callable[[], WS],
+        on_promote: Callable[[], Awaitable[None]] | None = None,
+        standby: bool = PRIVATE_STANDBY,
+    ):
+        self.log = log
+        self.on_promote = on_promote
+        self.primary = new_ws()
+        self.primary.on_close = self.on_close
+        self.standby: WS | None = None
+        if standby:
+            self.standby = new_ws()
+            self.standby.standby = True
+            self.standby.on_close = self.on_close
+        # 备用连接接替的次数
+        self.promotions = 0
+        # 接替后补同步的任务引用，防止被回收
+        self.tasks: set[asyncio.Task] = set()
+
+    async def run(self):
+        wss = [self.primary]
+        if self.standby:
+            wss.append(self.standby)
+        await asyncio.gather(*[ws.loop_conn() for ws in wss])
+
+    def find(self, conn: WebSocketClientProtocol) -> WS | None:
+        """按底层连接找到WS，连接事件里用来在这条连接上订阅"""
+        for ws in (self.primary, self.standby):
+            if ws and ws.ws is conn:
+                return ws
+        return None
+
+    def on_close(self, ws: WS):
+        if ws is not self.primary or not self.standby or not self.standby.ok():
+            return
+
+        self.primary, self.standby = self.standby, ws
+        self.primary.standby = False
+        ws.standby = True
+        self.promotions += 1
+        self.log.warning(f'私有连接断开 切换到备用连接')
+
+        if self.on_promote:
+            task = asyncio.create_task(self.on_promote())
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
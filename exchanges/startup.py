@@ -0,0 +1,127 @@
+import asyncio
+import time
+
+from exchanges.exchange import Exchange
+from tool import logger
+from config import settings
+
+QUOTE: str = settings.quote  # 计价币
+SYMBOL_RANG: list[int] = settings.symbol_rang  # 监控的交易对的范围
+SYMBOLS_BLACKLIST: list[str] = settings.symbols_blacklist  # 交易对黑名单
+
+
+def match_symbols(exchanges: list[Exchange]) -> list[str]:
+    """
+    至少两个交易所都有的交易对(两个交易所时就是都有)，过滤报价币、黑名单，再按配置的范围截取
+    按交易所顺序，同一个交易对用最先列出它的交易所的名字
+    """
+    symbols: list[str] = []
+
+    ex_len = len(exchanges)
+    if ex_len == 1:
+        for r in exchanges[0].rules:
+            if exchanges[0].listed(r):
+                symbols.append(r)
+    elif ex_len > 1:
+        for i, ex in enumerate(exchanges):
+            for r in ex.rules:
+                if not ex.listed(r):
+                    continue
+                # 前面的交易所已经列出过
+                if any(e.listed(r) for e in exchanges[:i]):
+                    continue
+                count = 1
+                for e in exchanges[i + 1:]:
+                    if e.listed(r):
+                        count += 1
+                if count >= 2:
+                    symbols.append(r)
+
+    # 过滤
+    filter_symbols = []
+    for symbol in symbols:
+        # 过滤报价币
+        if not symbol.endswith(QUOTE):
+            continue
+
+        # 过滤黑名单
+        if symbol in SYMBOLS_BLACKLIST:
+            continue
+
+        filter_symbols.append(symbol)
+    symbols = filter_symbols
+
+    # 允许自由配置
+    if len(SYMBOL_RANG) >= 2:
+        start = SYMBOL_RANG[0]
+        end = SYMBOL_RANG[1]
+        if start == 0:
+            if end != 0: return symbols[:end]
+        else:
+            if end != 0:
+                return symbols[start:end]
+            else:
+                return symbols[start:]
+
+    return symbols
+
+
+def start_feeds(
+    exchanges: list[Exchange],
+    symbols: list[str],
+) -> list[asyncio.Task]:
+    """
+    并发建立所有交易对的行情连接
+    不再逐个sleep，每个交易所的连接按自己的建连限频排队(见WS.conn_bucket)
+    交易规则已加载时跳过交易所没有的交易对
+    """
+    tasks = []
+    for symbol in symbols:
+        for ex in exchanges:
+            if ex.rules and not ex.get_rule(symbol):
+                continue
+            tasks.append(asyncio.create_task(ex.listen_public(symbol)))
+    return tasks
+
+
+class Readiness:
+    """
+    按交易对跟踪行情就绪
+    所有有这个交易对的交易所都收到过它的行情才算就绪，就绪的交易对可以马上交易
+    """
+
+    def __init__(self, exchanges: list[Exchange], symbols: list[str]):
+        self.log = logger.get_logger(self.__class__.__name__)
+        self.exchanges = exchanges
+        self.symbols = symbols
+        self.ready: set[str] = set()
+        self.done = asyncio.Event()
+        self.start = time.perf_counter()
+
+    def check(self, symbol: str) -> bool:
+        """交易对是否就绪，热路径上只有一次集合查询"""
+        if symbol in self.ready:
+            return True
+
+        for ex in self.exchanges:
+            if not ex.get_last_bbo(symbol):
+                if ex.rules and not ex.get_rule(symbol):
+                    continue
+                return False
+
+        self.ready.add(symbol)
+        if len(self.ready) == len(self.symbols):
+            cost = time.perf_counter() - self.start
+            self.log.info(f'全部 {len(self.symbols)} 个交易对行情就绪 耗时{cost:.1f}秒')
+            self.done.set()
+        return True
+
+    async def loop_report(self, interval: float = 5):
+        """启动过程中定期输出就绪进度"""
+        while not self.done.is_set():
+            try:
+                await asyncio.wait_for(self.done.wait(), interval)
+            except asyncio.TimeoutError:
+                cost = time.perf_counter() - self.start
+                self.log.info(f'行情就绪 {len(self.ready)}/{len(self.symbols)} '
+                              f'已耗时{cost:.0f}秒')
@@ -0,0 +1,123 @@
+import asyncio
+import functools
+import time
+
+from exchanges.exchange import Exchange
+from models.models import *
+from tool import logger
+from config import settings
+
+WATCHDOG: bool = settings.watchdog  # 是否检查行情中断
+WATCHDOG_FACTOR: float = settings.watchdog_factor  # 超过平均更新间隔的多少倍算中断
+WATCHDOG_MIN: float = settings.watchdog_min  # 最短中断判定时间(秒)
+WATCHDOG_COOLDOWN: float = settings.watchdog_cooldown  # 同一条行情两次重连的最短间隔(秒)
+
+# 平均更新间隔的平滑系数
+EWMA_ALPHA = 0.05
+
+
+class FeedStat:
+    """一个交易所的一个交易对的行情节奏"""
+    __slots__ = ('last', 'interval', 'stale_at', 'acted_at')
+
+    def __init__(self):
+        # 最近一次行情的时间(monotonic秒)，0为还没收到
+        self.last = 0.0
+        # 平均更新间隔(秒)
+        self.interval = 0.0
+        # 判定中断的时间，0为正常
+        self.stale_at = 0.0
+        # 最近一次重连的时间
+        self.acted_at = 0.0
+
+    def limit(self) -> float:
+        """多久没有更新算中断，按这个交易对自己的活跃程度"""
+        return max(WATCHDOG_MIN, self.interval * WATCHDOG_FACTOR)
+
+
+class FeedWatchdog:
+    """
+    行情中断检查
+    连接还在但是不推数据(订阅被悄悄丢掉、交易所卡住)时WS不会报错，这个交易对就一直不交易
+    每个(交易所, 交易对)记一个平均更新间隔，超过它的若干倍没更新、同时另一个交易所的同一交易对还在正常更新，
+    判定为这条行情中断，断开重连重新订阅；数据恢复时输出中断了多久
+    两边都没有更新是行情本身安静，不处理
+    """
+
+    def __init__(self, exchanges: list[Exchange], symbols: list[str]):
+        self.log = logger.get_logger(self.__class__.__name__)
+        self.exchanges = exchanges
+        # 交易对 -> 各交易所的行情节奏，和exchanges同序
+        self.stats: dict[str, list[FeedStat]] = {
+            symbol: [FeedStat() for _ in exchanges]
+            for symbol in symbols
+        }
+        # 中断记录: (交易所, 交易对, 中断秒数)
+        self.gaps: list[tuple[str, str, float]] = []
+
+        for i, ex in enumerate(exchanges):
+            ex.listen_bbo(functools.partial(self.on_bbo, i))
+
+    def on_bbo(self, i: int, bbo: BBO):
+        stats = self.stats.get(bbo.symbol)
+        if not stats:
+            return
+        stat = stats[i]
+        now = time.monotonic()
+
+        if stat.stale_at:
+            # 中断期间的间隔不算进平均
+            gap = now - stat.last
+            stat.stale_at = 0.0
+            ex_name = self.exchanges[i].__class__.__name__
+            self.gaps.append((ex_name, bbo.symbol, gap))
+            self.log.warning(f'{ex_name} {bbo.symbol} 行情中断{gap:.1f}秒后恢复')
+        elif stat.last:
+            interval = now - stat.last
+            if stat.interval:
+                stat.interval += EWMA_ALPHA * (interval - stat.interval)
+            else:
+                stat.interval = interval
+        stat.last = now
+
+    def check(self, now: float) -> int:
+        """检查一遍，返回这次重连的条数"""
+        count = 0
+        for symbol, stats in self.stats.items():
+            for i, stat in enumerate(stats):
+                if not stat.last or now - stat.last < stat.limit():
+                    continue
+
+                # 另一个交易所在这之后还有更新，并且自己没有中断
+                peer_active = False
+                for j, peer in enumerate(stats):
+                    if j != i and peer.last > stat.last and (
+                            now - peer.last < peer.limit()):
+                        peer_active = True
+                        break
+                if not peer_active:
+                    continue
+
+                if not stat.stale_at:
+                    stat.stale_at = now
+                if now - stat.acted_at < WATCHDOG_COOLDOWN:
+                    continue
+                stat.acted_at = now
+
+                ex = self.exchanges[i]
+                quiet = now - stat.last
+                if ex.reconnect_public(symbol):
+                    count += 1
+                    self.log.warning(
+                        f'{ex.__class__.__name__} {symbol} {quiet:.1f}秒没有行情'
+                        f'(平均间隔{stat.interval * 1000:.0f}ms) 重连')
+                else:
+                    self.log.warning(
+                        f'{ex.__class__.__name__} {symbol} {quiet:.1f}秒没有行情'
+                        f'(平均间隔{stat.interval * 1000:.0f}ms) 不在本进程 无法重连')
+        return count
+
+    async def loop_check(self, interval: float = 1):
+        while 1:
+            await asyncio.sleep(interval)
+            self.check(time.monotonic())
@@ -1,12 +1,21 @@
 import asyncio
+import itertools
 import json
+import time
 import traceback
+from urllib.parse import urlsplit
 from typing import Awaitable, Callable, List
 
 import websockets
 from websockets.client import WebSocketClientProtocol
 
+from exchanges import capture, net
+from exchanges.heartbeat import Heartbeat
 from tool import logger
+from tool.ratelimit import TokenBucket
+
+# 连接id，录制时用来区分不同连接
+conn_ids = itertools.count(1)
 
 
 class WS:
@@ -25,6 +34,9 @@ class WS:
             Awaitable[tuple[dict, str | None]],
         ] | None = None,
         send_timeout: int = 5,
+        conn_bucket: TokenBucket | None = None,
+        ping_msg: Callable[[], str] | None = None,
+        pong: str = '',
     ):
         self.uri = uri
         self.name = name
@@ -32,13 +44,40 @@ class WS:
         self.on_conn = on_conn
         self.on_msg = on_msg
         self.send_timeout = send_timeout
+        # 建连限频，同一个交易所的连接共用
+        self.conn_bucket = conn_bucket
+        # 应用层心跳: 生成ping消息，回复消息里包含pong；没有时用协议ping帧
+        self.ping_msg = ping_msg
+        self.pong = pong
 
         self.log = logger.get_logger(name)
         self.ws: WebSocketClientProtocol = None
         self.response_futures: dict[str, asyncio.Future] = {}
 
+        self.conn_id = next(conn_ids)
+        self.capture: capture.FrameCapture | None = None
+
+        # 心跳状态，由Heartbeat维护
+        self.hb_gen = 0
+        # 发出还没回复的ping的时间，0为没有在等
+        self.ping_at = 0.0
+        self.last_ping = 0.0
+        # 最近一次心跳往返时间(毫秒)
+        self.rtt = 0.0
+
+        # 备用连接: 保持连接和订阅，不处理推送(见StandbyPair)
+        self.standby = False
+        # 连接断开时的回调
+        self.on_close: Callable[['WS'], None] | None = None
+        # 断开(或者开始建连)的时间，收到第一条消息后清零
+        self.down_at = 0.0
+        # 最近一次断开到收到第一条消息的时间(毫秒)
+        self.recover_ms = 0.0
+
     async def loop_conn(self):
+        self.down_at = time.monotonic()
         while 1:
+            down_at = self.down_at
             try:
                 await self.conn()
                 self.ws = None
@@ -51,30 +90,71 @@ class WS:
             except Exception as e:
                 self.log.error(f'连接失败(未知错误) 开始重连...')
                 traceback.print_exc()
-            await asyncio.sleep(0.2)
+            # 收到过消息的连接断开马上重连，建连失败的才等一下
+            if self.down_at == down_at:
+                await asyncio.sleep(0.2)
 
     async def conn(self):
         if not self.ok():
-            self.ws = await websockets.connect(self.uri, ping_interval=None)
+            if self.conn_bucket:
+                await self.conn_bucket.acquire()
+            self.ws = await net.connect(self.uri)
             # self.log.info('连上ws')
 
-            tasks: list[asyncio.Task] = []
-            if self.on_conn:
-                tasks = await self.on_conn(self.ws, self.symbol)
+            # 录制模式
+            self.capture = capture.capture
+            if self.capture:
+                self.capture.conn(self.conn_id, self.name, self.uri, self.symbol)
+
+            heartbeat = Heartbeat.get()
+            heartbeat.add(self)
 
+            tasks: list[asyncio.Task] = []
             try:
+                if self.on_conn:
+                    tasks = await self.on_conn(self.ws, self.symbol)
+
                 while self.ok():
                     res = await self.ws.recv()
-                    if self.on_msg:
+                    if self.down_at:
+                        self.on_first_msg()
+                    if self.ping_at and self.pong and self.pong in res:
+                        self.on_pong()
+                    if self.capture:
+                        self.capture.put(self.conn_id, capture.DIR_IN, res)
+                    if self.on_msg and not self.standby:
                         data, id = await self.on_msg(self.ws, self.symbol, res)
                         if id and id in self.response_futures:
                             self.response_futures[id].set_result(data)
             except Exception:
                 raise
             finally:
+                heartbeat.remove(self)
                 for task in tasks:
                     task.cancel()
-                    
+                if not self.down_at:
+                    self.down_at = time.monotonic()
+                # 连接真的断了才通知(任务被取消时连接还在)
+                if self.on_close and not self.ok():
+                    self.on_close(self)
+
+    def on_first_msg(self):
+        """断开(或开始建连)到收到第一条消息的时间，包括dns、tcp、tls、握手和订阅/登录"""
+        self.recover_ms = (time.monotonic() - self.down_at) * 1000
+        self.down_at = 0.0
+        resumed = net.tls.save(urlsplit(self.uri).hostname, self.ws)
+        tls = ' TLS会话恢复' if resumed else ''
+        self.log.info(f'连接到首条消息 {self.recover_ms:.0f}ms{tls}')
+
+    def on_pong(self):
+        self.rtt = (time.monotonic() - self.ping_at) * 1000
+        self.ping_at = 0.0
+
+    def abort(self):
+        """直接断开底层连接(不走关闭握手)，recv马上报错，loop_conn重连"""
+        if self.ws is not None:
+            self.ws.transport.abort()
+
     async def close(self):
         await self.ws.close()
 
@@ -92,7 +172,10 @@ class WS:
             fut = loop.create_future()
             self.response_futures[id] = fut
 
-        await self.ws.send(json.dumps(data))
+        msg = json.dumps(data)
+        if self.capture:
+            self.capture.put(self.conn_id, capture.DIR_OUT, msg)
+        await self.ws.send(msg)
 
         if fut and id:
             result = await asyncio.wait_for(fut, self.send_timeout)
@@ -22,6 +22,8 @@ class ContractRule:
     trade_leverage: int = 20
     # 合约面值（一份合约==N个币）
     contract_size: float = 1
+    # 已下架（刷新规则时交易所不再列出，不再开仓，已有仓位照常平仓）
+    delisted: bool = False
 
     def __post_init__(self):
         self.price_prec = int(self.price_prec)
@@ -80,7 +82,8 @@ class Order:
     deal_amount: float = 0
     # 下单时间
     c_time: int = 0
-    
+    # 客户端订单id
+    client_id: str = ''
 
     def __post_init__(self):
         self.id = str(self.id)
@@ -105,6 +108,8 @@ class Position:
     amount: float
     # 开仓时间 没有就0 让策略自己判断
     c_time: int = 0
+    # 交易所名字
+    ex_name: str = ''
 
     def __post_init__(self):
         self.id = str(self.id)
@@ -194,6 +199,8 @@ class Signal:
     spread: float = 0
     # 每个交易所各自的配置
     exchanges: list[ExchangeSignal] = field(default_factory=list)
+    # 产生信号的策略
+    strategy: str = ''
 
 
 @dataclass
@@ -203,3 +210,5 @@ class Secret:
     api_key: str = ''
     private_key: str = ''
     public_key: str = ''
+    # 账户名，多账户时区分日志
+    name: str = ''
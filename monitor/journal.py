@@ -0,0 +1,256 @@
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from config import settings
+
+JOURNAL_DIR: str = settings.journal_dir  # 价差日志目录
+SEGMENT_RECORDS: int = settings.journal_segment_records  # 每个分段文件的记录数
+FLUSH_INTERVAL: float = settings.journal_flush_interval  # 刷盘间隔(秒)
+
+# 动作
+ACTION_OPEN = 0
+ACTION_CLOSE = 1
+
+# 固定长度记录(32字节对齐)
+RECORD = np.dtype([
+    ('t', '<i8'),  # 时间戳(毫秒)
+    ('spread', '<f8'),  # 价差
+    ('sid', '<u4'),  # 交易对id
+    ('m_delay', '<i4'),  # 主所延迟
+    ('s_delay', '<i4'),  # 副所延迟
+    ('action', 'u1'),  # 动作 0开 1平
+    ('_pad', 'u1', (3, )),
+])
+
+# 分段文件头: 记录数、首条时间、末条时间
+HEADER = np.dtype([
+    ('magic', 'S8'),
+    ('count', '<u8'),
+    ('t_first', '<i8'),
+    ('t_last', '<i8'),
+    ('_pad', 'u1', (32, )),
+])
+MAGIC = b'SPRDJ001'
+SYMBOLS_FILE = 'symbols.json'
+
+
+def segment_name(n: int) -> str:
+    return f'seg_{n:06d}.bin'
+
+
+def list_segments(path: str) -> list[str]:
+    """按顺序列出分段文件"""
+    if not os.path.isdir(path):
+        return []
+    names = [
+        n for n in os.listdir(path)
+        if n.startswith('seg_') and n.endswith('.bin')
+    ]
+    return [os.path.join(path, n) for n in sorted(names)]
+
+
+def load_symbols(path: str) -> dict[str, int]:
+    file_path = os.path.join(path, SYMBOLS_FILE)
+    if not os.path.exists(file_path):
+        return {}
+    with open(file_path, 'r') as f:
+        return json.load(f)
+
+
+class SpreadJournal:
+    """
+    价差日志(只追加)
+    定长记录写入分段的内存映射文件，写满一个分段就切到下一个，按间隔刷盘
+    """
+
+    def __init__(
+        self,
+        path: str = JOURNAL_DIR,
+        seg_records: int = SEGMENT_RECORDS,
+        flush_interval: float = FLUSH_INTERVAL,
+    ):
+        self.path = path
+        # 新分段的记录数
+        self.seg_records = seg_records
+        # 当前分段的记录数，打开已有分段时按文件大小算(可能是用别的配置写的)
+        self.capacity = seg_records
+        self.flush_interval = flush_interval
+        self.flushed_at = time.monotonic()
+        os.makedirs(path, exist_ok=True)
+
+        self.symbols: dict[str, int] = load_symbols(path)
+        self.seg_no = 0
+        self.header: np.memmap = None
+        self.records: np.memmap = None
+
+        segments = list_segments(path)
+        if segments:
+            last = os.path.basename(segments[-1])
+            self.seg_no = int(last[4:10])
+            self._open_segment(self.seg_no)
+        else:
+            self._new_segment(0)
+
+    def _open_segment(self, n: int):
+        file_path = os.path.join(self.path, segment_name(n))
+        size = os.path.getsize(file_path)
+        self.capacity = (size - HEADER.itemsize) // RECORD.itemsize
+        self.header = np.memmap(file_path, HEADER, 'r+', 0, (1, ))
+        self.records = np.memmap(
+            file_path,
+            RECORD,
+            'r+',
+            HEADER.itemsize,
+            (self.capacity, ),
+        )
+
+    def _new_segment(self, n: int):
+        file_path = os.path.join(self.path, segment_name(n))
+        size = HEADER.itemsize + RECORD.itemsize * self.seg_records
+        with open(file_path, 'wb') as f:
+            f.truncate(size)
+        self.seg_no = n
+        self._open_segment(n)
+        self.header['magic'] = MAGIC
+        self.header['count'] = 0
+
+    def symbol_id(self, symbol: str) -> int:
+        """交易对id，新交易对会写入映射文件"""
+        sid = self.symbols.get(symbol)
+        if sid is None:
+            sid = len(self.symbols)
+            self.symbols[symbol] = sid
+            file_path = os.path.join(self.path, SYMBOLS_FILE)
+            tmp_path = file_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.symbols, f)
+            os.replace(tmp_path, file_path)
+        return sid
+
+    def append(
+        self,
+        t: int,
+        symbol: str,
+        action: int,
+        spread: float,
+        m_delay: int,
+        s_delay: int,
+    ):
+        """追加一条记录"""
+        count = int(self.header['count'][0])
+        if count >= self.capacity:
+            self.flush()
+            self._new_segment(self.seg_no + 1)
+            count = 0
+
+        sid = self.symbol_id(symbol)
+        self.records[count] = (t, spread, sid, m_delay, s_delay, action, 0)
+
+        if count == 0:
+            self.header['t_first'] = t
+        self.header['t_last'] = t
+        # 最后更新计数，读端只会看到完整的记录
+        self.header['count'] = count + 1
+
+        now = time.monotonic()
+        if now - self.flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.records.flush()
+        self.header.flush()
+        self.flushed_at = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.records = None
+        self.header = None
+
+
+class JournalReader:
+    """价差日志读取，返回的列直接映射到文件，不做拷贝"""
+
+    def __init__(self, path: str = JOURNAL_DIR):
+        self.path = path
+        self.symbols = load_symbols(path)
+        self.names = {v: k for k, v in self.symbols.items()}
+
+    def segments(
+        self,
+        start: int | None = None,
+        end: int | None = None,
+    ) -> list[np.ndarray]:
+        """
+        按时间范围获取各分段的记录视图
+        记录按时间追加，用二分查找切片，结果仍然是内存映射视图
+        """
+        views = []
+        for file_path in list_segments(self.path):
+            header = np.memmap(file_path, HEADER, 'r', 0, (1, ))[0]
+            count = int(header['count'])
+            if header['magic'] != MAGIC or count == 0:
+                continue
+            if start is not None and header['t_last'] < start:
+                continue
+            if end is not None and header['t_first'] >= end:
+                continue
+
+            recs = np.memmap(file_path, RECORD, 'r', HEADER.itemsize, (count, ))
+            lo = 0 if start is None else np.searchsorted(recs['t'], start, 'left')
+            hi = count if end is None else np.searchsorted(recs['t'], end, 'left')
+            if hi > lo:
+                views.append(recs[lo:hi])
+        return views
+
+    def read(
+        self,
+        symbols: list[str] | None = None,
+        start: int | None = None,
+        end: int | None = None,
+    ) -> dict[str, np.ndarray]:
+        """
+        读取列数据 [start, end)
+        单个分段且不过滤交易对时是零拷贝视图
+        """
+        views = self.segments(start, end)
+        if not views:
+            recs = np.empty(0, RECORD)
+        elif len(views) == 1:
+            recs = views[0]
+        else:
+            recs = np.concatenate(views)
+
+        if symbols:
+            sids = [self.symbols[s] for s in symbols if s in self.symbols]
+            recs = recs[np.isin(recs['sid'], sids)]
+
+        return {
+            't': recs['t'],
+            'sid': recs['sid'],
+            'action': recs['action'],
+            'spread': recs['spread'],
+            'm_delay': recs['m_delay'],
+            's_delay': recs['s_delay'],
+        }
+
+    def read_df(
+        self,
+        symbols: list[str] | None = None,
+        start: int | None = None,
+        end: int | None = None,
+    ):
+        """读取成DataFrame，symbol列为分类类型"""
+        cols = self.read(symbols, start, end)
+        df = pd.DataFrame(cols, copy=False)
+        categories = [self.names[i] for i in range(len(self.names))]
+        df['symbol'] = pd.Categorical.from_codes(cols['sid'], categories)
+        return df
+
+
+if __name__ == '__main__':
+    reader = JournalReader()
+    print(reader.read_df())
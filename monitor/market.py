@@ -2,13 +2,16 @@ import asyncio
 import copy
 import os
 import sys
-import pandas as pd
 
 from config import settings
 from models.models import *
+from exchanges import rule_cache
 from exchanges.exchange import Exchange
+from exchanges.startup import Readiness, start_feeds
+from exchanges.feed_service import FEED_SERVICE, FeedSubscriber
 from exchanges.binance import Binance
 from exchanges.gate import Gate
+from monitor.journal import ACTION_CLOSE, ACTION_OPEN, SpreadJournal
 from tool.mathx import *
 from tool.timex import time_ms
 from tool import logger
@@ -42,6 +45,12 @@ class Market:
         self.last_close_spread = None
         self.pos: dict[str, int] = {}
 
+        # 价差日志
+        self.journal = SpreadJournal()
+
+        # 行情就绪跟踪，run里创建
+        self.readiness: Readiness | None = None
+
     def add_exchagne(self, ex: Exchange):
         ex.listen_bbo(self.on_bbo)
         self.exchanges.append(ex)
@@ -50,6 +59,9 @@ class Market:
         symbol = bbo.symbol
         now = time_ms()
 
+        if self.readiness and not self.readiness.check(symbol):
+            return
+
         m_ex = self.exchanges[0]
         s_ex = self.exchanges[1]
 
@@ -87,33 +99,29 @@ class Market:
         self.last_open_spread = open_spread
         self.last_close_spread = close_spread
 
-        data = {}
         if symbol in self.pos:
             if close_spread <= 0:
-                data['action'] = ['平']
-                data['spread'] = [close_spread]
+                action = ACTION_CLOSE
+                spread = close_spread
                 del self.pos[symbol]
             else:
                 return
         elif open_spread > SPREAD:
-            data['action'] = ['开']
-            data['spread'] = [open_spread]
+            action = ACTION_OPEN
+            spread = open_spread
             self.pos[symbol] = now
         else:
             return
 
-        data['m_delay'] = [now - m_bbo.time]
-        data['s_delay'] = [now - s_bbo.time]
-        data['t'] = [now]
-
-        df = pd.DataFrame(data)
-        file_path = f'./cache/{symbol}.csv'
-        if os.path.exists(file_path):
-            df.to_csv(file_path, mode='a', index=False, header=False)
-        else:
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            df.to_csv(file_path, index=False)
-        # self.log.info(f'记录数据: {symbol} {data['action']} {data['spread']}')
+        self.journal.append(
+            now,
+            symbol,
+            action,
+            spread,
+            now - m_bbo.time,
+            now - s_bbo.time,
+        )
+        # self.log.info(f'记录数据: {symbol} {action} {spread}')
 
     def fetch_pos(
         self,
@@ -169,9 +177,12 @@ class Market:
         return symbols
 
     async def run(self, symbols: list[str] = []):
-        # 加载交易规则
-        for ex in self.exchanges:
-            ex.rules = ex.get_rules()
+        # 加载交易规则，优先用缓存，用了缓存的马上在后台刷新
+        cached = await asyncio.gather(*[ex.load_rules() for ex in self.exchanges])
+        tasks = []
+        for ex, hit in zip(self.exchanges, cached):
+            delay = 0 if hit else rule_cache.RULES_CACHE_TTL
+            tasks.append(asyncio.create_task(ex.loop_refresh_rules(delay)))
 
         # 匹配交易对
         self.symbols = symbols if symbols else self.match_symbols()
@@ -181,12 +192,15 @@ class Market:
         self.log.info(f"找到 {len(self.symbols)} 个匹配的交易对")
 
         # 启动ws监听
-        tasks = []
         # 监听行情ws
-        for symbol in self.symbols:
-            await asyncio.sleep(0.1)
-            for ex in self.exchanges:
-                tasks.append(asyncio.create_task(ex.listen_public(symbol)))
+        self.readiness = Readiness(self.exchanges, self.symbols)
+        tasks.append(asyncio.create_task(self.readiness.loop_report()))
+        if FEED_SERVICE:
+            # 读本地行情服务，不占交易所连接
+            feed = FeedSubscriber(self.exchanges, self.symbols)
+            tasks.append(asyncio.create_task(feed.run()))
+        else:
+            tasks += start_feeds(self.exchanges, self.symbols)
         await asyncio.gather(*tasks)
 
 
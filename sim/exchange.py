@@ -0,0 +1,935 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import websockets
+
+if __name__ == "__main__":
+    sys.path.append(
+        os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from tool import logger
+from tool.timex import time_ms
+
+
+@dataclass
+class SimConfig:
+    """模拟交易所配置(时间单位毫秒)"""
+    # api响应延迟
+    latency: float = 5
+    # 延迟抖动(均匀分布 ±jitter)
+    jitter: float = 2
+    # 下单到成交推送的延迟
+    fill_latency: float = 5
+    # 成交比例 小于1时部分成交，剩余撤销
+    fill_rate: float = 1
+    # 拒单概率
+    reject_rate: float = 0
+    # 吃掉一倍盘口数量时的价格冲击
+    impact: float = 0.0005
+    # 行情推送间隔
+    tick_interval: float = 100
+    # 每个交易所的初始余额
+    balance: float = 10000
+    # gate合约面值
+    gate_contract_size: float = 1
+    # 交易对和初始价格
+    symbols: dict[str, float] = field(default_factory=lambda: {
+        'BTCUSDT': 60000,
+        'ETHUSDT': 3000,
+        'OPUSDT': 1.5,
+        'ARPAUSDT': 0.046,
+    })
+
+
+class SimBook:
+    """合成盘口，中间价随机游走"""
+
+    def __init__(self, symbol: str, price: float, amount: float):
+        self.symbol = symbol
+        self.mid = price
+        self.spread = 0.0002
+        self.amount = amount
+        self.seq = 0
+
+    def step(self):
+        self.mid *= 1 + random.gauss(0, 0.0002)
+        self.seq += 1
+
+    def bbo(self) -> tuple[float, float, float, float]:
+        """买一价 买一量 卖一价 卖一量(币数)"""
+        half = self.mid * self.spread / 2
+        bid_amount = self.amount * random.uniform(0.5, 1.5)
+        ask_amount = self.amount * random.uniform(0.5, 1.5)
+        return self.mid - half, bid_amount, self.mid + half, ask_amount
+
+    def fill_price(self, buy: bool, amount: float, impact: float) -> float:
+        """市价单成交均价，按吃掉的盘口倍数线性冲击"""
+        bid, _, ask, _ = self.bbo()
+        move = impact * amount / self.amount / 2
+        if buy:
+            return ask * (1 + move)
+        return bid * (1 - move)
+
+
+class SimAccount:
+    """模拟账户 双向持仓"""
+
+    def __init__(self, balance: float, fee_rate: float = 0.0005):
+        self.balance = balance
+        self.fee_rate = fee_rate
+        self.leverage: dict[str, int] = {}
+        # (交易对, LONG/SHORT) -> [币数, 开仓均价]
+        self.pos: dict[tuple[str, str], list[float]] = {}
+        self.next_id = 1
+
+    def order_id(self) -> int:
+        self.next_id += 1
+        return self.next_id
+
+    def available(self) -> float:
+        margin = 0
+        for (symbol, _), (amount, price) in self.pos.items():
+            margin += amount * price / self.leverage.get(symbol, 20)
+        return self.balance - margin
+
+    def fill(
+        self,
+        symbol: str,
+        ps: str,
+        is_open: bool,
+        amount: float,
+        price: float,
+    ):
+        """成交，更新仓位和余额"""
+        key = (symbol, ps)
+        pos_amount, pos_price = self.pos.get(key, [0, 0])
+        self.balance -= amount * price * self.fee_rate
+
+        if is_open:
+            total = pos_amount + amount
+            pos_price = (pos_amount * pos_price + amount * price) / total
+            self.pos[key] = [total, pos_price]
+            return
+
+        amount = min(amount, pos_amount)
+        if ps == 'LONG':
+            self.balance += (price - pos_price) * amount
+        else:
+            self.balance += (pos_price - price) * amount
+        if pos_amount - amount <= 0:
+            self.pos.pop(key, None)
+        else:
+            self.pos[key] = [pos_amount - amount, pos_price]
+
+
+class SimVenue:
+    """模拟单个交易所的协议"""
+
+    def __init__(self, sim: 'SimExchange'):
+        self.sim = sim
+        self.config = sim.config
+        self.account = SimAccount(sim.config.balance)
+        # 私有推送连接
+        self.private: set = set()
+        # 交易对 -> 订阅行情的连接
+        self.subs: dict[str, set] = {}
+
+    async def delay(self, ms: float):
+        ms += random.uniform(-self.config.jitter, self.config.jitter)
+        if ms > 0:
+            await asyncio.sleep(ms / 1000)
+
+    async def push(self, conns: set, msg: dict):
+        data = json.dumps(msg)
+        for conn in list(conns):
+            try:
+                await conn.send(data)
+            except websockets.ConnectionClosed:
+                conns.discard(conn)
+
+    def market_fill(
+        self,
+        symbol: str,
+        buy: bool,
+        amount: float,
+    ) -> tuple[float, float] | None:
+        """按合成盘口撮合市价单: 成交数量, 成交均价; 拒单返回None"""
+        if random.random() < self.config.reject_rate:
+            return None
+        book = self.sim.books[symbol]
+        deal = amount * self.config.fill_rate
+        return deal, book.fill_price(buy, deal, self.config.impact)
+
+
+class SimBinance(SimVenue):
+    """币安 U本位合约"""
+
+    listen_key = 'simlistenkey'
+
+    async def handle(self, conn, path: str):
+        if path.startswith('/ws-fapi/v1'):
+            await self.handle_api(conn)
+        elif path.endswith('@bookTicker'):
+            symbol = path.split('/')[-1].split('@')[0].upper()
+            await self.handle_public(conn, symbol)
+        elif path == f'/ws/{self.listen_key}':
+            self.private.add(conn)
+            try:
+                await conn.wait_closed()
+            finally:
+                self.private.discard(conn)
+        else:
+            await conn.close(1008, 'unknown path')
+
+    async def handle_public(self, conn, symbol: str):
+        subs = self.subs.setdefault(symbol, set())
+        subs.add(conn)
+        try:
+            await conn.wait_closed()
+        finally:
+            subs.discard(conn)
+
+    def book_ticker(self, book: SimBook) -> dict:
+        now = time_ms()
+        bid, bid_amount, ask, ask_amount = book.bbo()
+        return {
+            'e': 'bookTicker',
+            'u': book.seq,
+            's': book.symbol,
+            'b': f'{bid:.8f}',
+            'B': f'{bid_amount:.3f}',
+            'a': f'{ask:.8f}',
+            'A': f'{ask_amount:.3f}',
+            'T': now,
+            'E': now,
+        }
+
+    async def handle_api(self, conn):
+        try:
+            async for data in conn:
+                req = json.loads(data)
+                asyncio.create_task(self.api(conn, req))
+        except websockets.ConnectionClosed:
+            pass
+
+    async def api(self, conn, req: dict):
+        await self.delay(self.config.latency)
+        method = req.get('method')
+        params = req.get('params', {})
+
+        if method == 'session.logon':
+            now = time_ms()
+            res = {
+                'id': req['id'],
+                'status': 200,
+                'result': {
+                    'apiKey': params.get('apiKey'),
+                    'authorizedSince': now,
+                    'connectedSince': now,
+                    'returnRateLimits': True,
+                    'serverTime': now,
+                },
+            }
+        elif method == 'order.place':
+            res = await self.order_place(req['id'], params)
+        else:
+            res = {
+                'id': req.get('id'),
+                'status': 400,
+                'error': {'code': -1100, 'msg': f'unknown method {method}'},
+            }
+
+        try:
+            await conn.send(json.dumps(res))
+        except websockets.ConnectionClosed:
+            pass
+
+    async def order_place(self, id: str, params: dict) -> dict:
+        symbol = params['symbol']
+        if symbol not in self.sim.books:
+            return {
+                'id': id,
+                'status': 400,
+                'error': {'code': -1121, 'msg': 'Invalid symbol.'},
+            }
+
+        order_id = self.account.order_id()
+        self.sim.orders += 1
+        now = time_ms()
+        order = {
+            'orderId': order_id,
+            'clientOrderId': params.get('newClientOrderId', ''),
+            'symbol': symbol,
+            'status': 'NEW',
+            'side': params['side'],
+            'positionSide': params['positionSide'],
+            'origQty': str(params['quantity']),
+            'type': params['type'],
+            'updateTime': now,
+        }
+        asyncio.create_task(self.fill(now, order))
+        return {'id': id, 'status': 200, 'result': order}
+
+    async def fill(self, c_time: int, order: dict):
+        await self.delay(self.config.fill_latency)
+
+        symbol = order['symbol']
+        buy = order['side'] == 'BUY'
+        ps = order['positionSide']
+        is_open = buy == (ps == 'LONG')
+        amount = float(order['origQty'])
+
+        res = self.market_fill(symbol, buy, amount)
+        deal, price = res if res else (0, 0)
+        status = 'EXPIRED' if deal == 0 else 'FILLED'
+        if 0 < deal < amount:
+            status = 'EXPIRED'
+        if deal:
+            self.account.fill(symbol, ps, is_open, deal, price)
+
+        now = time_ms()
+        self.sim.fills.append(now - c_time)
+        await self.push(self.private, {
+            'e': 'ORDER_TRADE_UPDATE',
+            'E': now,
+            'T': now,
+            'o': {
+                's': symbol,
+                'i': order['orderId'],
+                'c': order['clientOrderId'],
+                'S': order['side'],
+                'ps': ps,
+                'o': 'MARKET',
+                'X': status,
+                'p': '0',
+                'q': order['origQty'],
+                'ap': str(price),
+                'z': str(deal),
+                'T': c_time,
+            },
+        })
+        if deal:
+            await self.push(self.private, self.account_update(now))
+
+    def account_update(self, now: int) -> dict:
+        positions = []
+        for (symbol, ps), (amount, price) in self.account.pos.items():
+            positions.append({
+                's': symbol,
+                'pa': str(amount if ps == 'LONG' else -amount),
+                'ep': str(price),
+                'ps': ps,
+            })
+        return {
+            'e': 'ACCOUNT_UPDATE',
+            'E': now,
+            'T': now,
+            'a': {
+                'm': 'ORDER',
+                'B': [{
+                    'a': 'USDT',
+                    'wb': str(self.account.balance),
+                    'cw': str(self.account.available()),
+                }],
+                'P': positions,
+            },
+        }
+
+    def rest(self, method: str, path: str, query: dict):
+        """rest接口: 返回(状态码, 内容)"""
+        account = self.account
+        if path == '/fapi/v1/listenKey':
+            return 200, {'listenKey': self.listen_key}
+        elif path == '/fapi/v1/leverageBracket':
+            return 200, [{
+                'symbol': s,
+                'brackets': [{'initialLeverage': 125}],
+            } for s in self.sim.books]
+        elif path == '/fapi/v1/exchangeInfo':
+            symbols = self.config.symbols.items()
+            return 200, {'symbols': [self.rule(s, p) for s, p in symbols]}
+        elif path == '/fapi/v1/openOrders':
+            return 200, []
+        elif path == '/fapi/v3/positionRisk':
+            return 200, [{
+                'symbol': s,
+                'positionSide': ps,
+                'positionAmt': str(a if ps == 'LONG' else -a),
+                'entryPrice': str(p),
+                'updateTime': time_ms(),
+            } for (s, ps), (a, p) in account.pos.items()]
+        elif path == '/fapi/v3/balance':
+            return 200, [{
+                'asset': 'USDT',
+                'balance': str(account.balance),
+                'availableBalance': str(account.available()),
+            }]
+        elif path == '/fapi/v1/leverage':
+            symbol = query.get('symbol', '')
+            account.leverage[symbol] = int(query.get('leverage', 20))
+            return 200, {
+                'symbol': symbol,
+                'leverage': account.leverage[symbol],
+                'maxNotionalValue': '1000000',
+            }
+        elif path == '/fapi/v1/symbolConfig':
+            return 200, [{
+                'symbol': s,
+                'marginType': 'CROSSED',
+                'leverage': account.leverage.get(s, 20),
+                'maxNotionalValue': '1000000',
+            } for s in self.sim.books]
+        elif path == '/fapi/v1/multiAssetsMargin':
+            return 200, {'multiAssetsMargin': True}
+        elif path == '/fapi/v1/positionSide/dual':
+            return 200, {'dualSidePosition': True}
+        elif path in ['/fapi/v1/order', '/fapi/v1/allOpenOrders']:
+            return 200, {'code': 200, 'msg': 'success'}
+        return 404, {'code': -1, 'msg': f'unknown path {path}'}
+
+    def rule(self, symbol: str, price: float) -> dict:
+        return {
+            'symbol': symbol,
+            'pricePrecision': 8,
+            'quantityPrecision': 3 if price > 100 else 0,
+            'filters': [
+                {'filterType': 'PRICE_FILTER'},
+                {
+                    'filterType': 'LOT_SIZE',
+                    'maxQty': '1000000',
+                    'minQty': '0.001' if price > 100 else '1',
+                },
+            ],
+        }
+
+
+class SimGate(SimVenue):
+    """gate U本位合约，所有频道共用一个ws地址"""
+
+    def contract(self, symbol: str) -> str:
+        return symbol.replace('USDT', '_USDT')
+
+    def symbol(self, contract: str) -> str:
+        return contract.replace('_', '')
+
+    async def handle(self, conn, path: str):
+        try:
+            async for data in conn:
+                req = json.loads(data)
+                channel = req.get('channel', '')
+                event = req.get('event', '')
+                if channel == 'futures.ping':
+                    await conn.send(json.dumps({
+                        'time': int(time.time()),
+                        'channel': 'futures.pong',
+                        'event': '',
+                        'result': None,
+                    }))
+                elif event == 'subscribe':
+                    await self.subscribe(conn, channel, req.get('payload', []))
+                elif event == 'api':
+                    asyncio.create_task(self.api(conn, channel, req))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.private.discard(conn)
+            for subs in self.subs.values():
+                subs.discard(conn)
+
+    async def subscribe(self, conn, channel: str, payload: list):
+        if channel == 'futures.book_ticker':
+            for contract in payload:
+                symbol = self.symbol(contract)
+                self.subs.setdefault(symbol, set()).add(conn)
+        elif channel in ['futures.orders', 'futures.positions', 'futures.balances']:
+            self.private.add(conn)
+
+        await conn.send(json.dumps({
+            'time': int(time.time()),
+            'channel': channel,
+            'event': 'subscribe',
+            'result': {'status': 'success'},
+        }))
+
+    def book_ticker(self, book: SimBook) -> dict:
+        now = time_ms()
+        size = self.config.gate_contract_size
+        bid, bid_amount, ask, ask_amount = book.bbo()
+        return {
+            'time': now // 1000,
+            'time_ms': now,
+            'channel': 'futures.book_ticker',
+            'event': 'update',
+            'result': {
+                't': now,
+                'u': book.seq,
+                's': self.contract(book.symbol),
+                'b': f'{bid:.8f}',
+                'B': int(bid_amount / size),
+                'a': f'{ask:.8f}',
+                'A': int(ask_amount / size),
+            },
+        }
+
+    def header(self, channel: str, status: str = '200') -> dict:
+        return {
+            'response_time': str(time_ms()),
+            'status': status,
+            'channel': channel,
+            'event': 'api',
+        }
+
+    async def api(self, conn, channel: str, req: dict):
+        payload = req.get('payload', {})
+        req_id = payload.get('req_id', '')
+
+        # 下单先回ack
+        if channel == 'futures.order_place':
+            await conn.send(json.dumps({
+                'request_id': req_id,
+                'ack': True,
+                'header': self.header(channel),
+                'data': {
+                    'result': {
+                        'req_id': req_id,
+                        'req_param': payload.get('req_param'),
+                    },
+                },
+            }))
+
+        await self.delay(self.config.latency)
+
+        if channel == 'futures.login':
+            res = {
+                'request_id': req_id,
+                'header': self.header(channel),
+                'data': {
+                    'result': {
+                        'api_key': payload.get('api_key'),
+                        'uid': '1',
+                    },
+                },
+            }
+        elif channel == 'futures.order_place':
+            res = await self.order_place(req_id, payload.get('req_param', {}))
+        else:
+            res = {
+                'request_id': req_id,
+                'header': self.header(channel, '400'),
+                'data': {
+                    'errs': {
+                        'label': 'INVALID_CHANNEL',
+                        'message': channel,
+                    },
+                },
+            }
+
+        try:
+            await conn.send(json.dumps(res))
+        except websockets.ConnectionClosed:
+            pass
+
+    async def order_place(self, req_id: str, args: dict) -> dict:
+        channel = 'futures.order_place'
+        symbol = self.symbol(args.get('contract', ''))
+        if symbol not in self.sim.books:
+            return {
+                'request_id': req_id,
+                'header': self.header(channel, '400'),
+                'data': {
+                    'errs': {
+                        'label': 'CONTRACT_NOT_FOUND',
+                        'message': symbol,
+                    },
+                },
+            }
+
+        now = time_ms()
+        order = {
+            'id': self.account.order_id(),
+            'contract': args['contract'],
+            'size': int(args['size']),
+            'left': int(args['size']),
+            'is_close': bool(args.get('reduce_only')),
+            'is_reduce_only': bool(args.get('reduce_only')),
+            'price': '0',
+            'fill_price': '0',
+            'tif': args.get('tif', 'ioc'),
+            'text': args.get('text', ''),
+            'status': 'open',
+            'finish_as': '_new',
+            'create_time': now / 1000,
+            'create_time_ms': now,
+        }
+        self.sim.orders += 1
+        asyncio.create_task(self.fill(now, order))
+        return {
+            'request_id': req_id,
+            'header': self.header(channel),
+            'data': {'result': order},
+        }
+
+    async def fill(self, c_time: int, order: dict):
+        await self.delay(self.config.fill_latency)
+
+        size = order['size']
+        symbol = self.symbol(order['contract'])
+        buy = size > 0
+        close = order['is_close']
+        # 双向持仓: 买开多/卖平多 卖开空/买平空
+        ps = 'SHORT' if buy == close else 'LONG'
+        contract_size = self.config.gate_contract_size
+        amount = abs(size) * contract_size
+
+        res = self.market_fill(symbol, buy, amount)
+        deal, price = res if res else (0, 0)
+        deal_size = int(deal / contract_size)
+        if deal_size:
+            deal = deal_size * contract_size
+            self.account.fill(symbol, ps, not close, deal, price)
+
+        now = time_ms()
+        left = abs(size) - deal_size
+        order.update({
+            'left': left if size > 0 else -left,
+            'fill_price': str(price),
+            'status': 'finished',
+            'finish_as': 'filled' if left == 0 else 'cancelled',
+            'finish_time_ms': now,
+        })
+        self.sim.fills.append(now - c_time)
+
+        await self.push(self.private, {
+            'time': now // 1000,
+            'time_ms': now,
+            'channel': 'futures.orders',
+            'event': 'update',
+            'result': [order],
+        })
+        if deal_size:
+            await self.push(self.private, {
+                'time': now // 1000,
+                'time_ms': now,
+                'channel': 'futures.positions',
+                'event': 'update',
+                'result': self.positions(),
+            })
+            await self.push(self.private, {
+                'time': now // 1000,
+                'time_ms': now,
+                'channel': 'futures.balances',
+                'event': 'update',
+                'result': [{
+                    'balance': self.account.balance,
+                    'change': 0,
+                    'currency': 'usdt',
+                    'text': '',
+                    'time': now // 1000,
+                    'time_ms': now,
+                    'type': 'fee',
+                    'user': '1',
+                }],
+            })
+
+    def positions(self) -> list[dict]:
+        size = self.config.gate_contract_size
+        res = []
+        for (symbol, ps), (amount, price) in self.account.pos.items():
+            contracts = int(round(amount / size))
+            res.append({
+                'contract': self.contract(symbol),
+                'size': contracts if ps == 'LONG' else -contracts,
+                'entry_price': str(price),
+                'mode': 'dual_long' if ps == 'LONG' else 'dual_short',
+                'leverage': '0',
+                'cross_leverage_limit': str(
+                    self.account.leverage.get(symbol, 20)),
+            })
+        return res
+
+    def rest(self, method: str, path: str, query: dict):
+        """rest接口: 返回(状态码, 内容)"""
+        account = self.account
+        if path == '/api/v4/futures/usdt/contracts':
+            symbols = self.config.symbols.items()
+            return 200, [self.rule(s, p) for s, p in symbols]
+        elif path == '/api/v4/futures/usdt/orders':
+            return 200, []
+        elif path == '/api/v4/futures/usdt/positions':
+            return 200, self.positions()
+        elif path.endswith('/leverage'):
+            symbol = self.symbol(path.split('/')[-2])
+            leverage = int(query.get('cross_leverage_limit', 20))
+            account.leverage[symbol] = leverage
+            return 200, {}
+        elif path == '/api/v4/futures/usdt/dual_mode':
+            return 200, {'in_dual_mode': True}
+        elif path == '/api/v4/futures/usdt/accounts':
+            return 200, {
+                'user': 1,
+                'in_dual_mode': True,
+                'total': str(account.balance),
+                'available': str(account.available()),
+                'currency': 'USDT',
+            }
+        elif path.startswith('/api/v4/futures/usdt/orders/'):
+            return 200, {}
+        return 404, {'label': 'NOT_FOUND', 'message': path}
+
+    def rule(self, symbol: str, price: float) -> dict:
+        return {
+            'name': self.contract(symbol),
+            'order_price_round': '0.00000001',
+            'order_size_max': 1000000,
+            'order_size_min': 1,
+            'leverage_max': '100',
+            'quanto_multiplier': str(self.config.gate_contract_size),
+        }
+
+
+class RestHandler(BaseHTTPRequestHandler):
+
+    def handle_rest(self):
+        sim: SimExchange = self.server.sim
+        url = urlsplit(self.path)
+        query = dict(parse_qsl(url.query))
+
+        jitter = sim.config.jitter
+        delay = sim.config.latency + random.uniform(-jitter, jitter)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+        if url.path.startswith('/fapi'):
+            status, body = sim.binance.rest(self.command, url.path, query)
+        elif url.path.startswith('/api/v4'):
+            status, body = sim.gate.rest(self.command, url.path, query)
+        else:
+            status, body = 404, {'msg': 'not found'}
+
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = handle_rest
+    do_POST = handle_rest
+    do_PUT = handle_rest
+    do_DELETE = handle_rest
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SimExchange:
+    """
+    本地模拟交易所
+    一个ws端口同时模拟币安(行情、私有推送、ws api)和gate(所有频道)，rest在独立线程
+    """
+
+    def __init__(self, config: SimConfig = None):
+        self.config = config or SimConfig()
+        self.log = logger.get_logger(self.__class__.__name__)
+
+        self.books: dict[str, SimBook] = {}
+        for symbol, price in self.config.symbols.items():
+            amount = max(1, 10000 / price)
+            self.books[symbol] = SimBook(symbol, price, amount)
+
+        self.binance = SimBinance(self)
+        self.gate = SimGate(self)
+
+        # 统计
+        self.orders = 0
+        self.fills: list[int] = []
+
+        self.server = None
+        self.http: ThreadingHTTPServer | None = None
+        self.tasks: list[asyncio.Task] = []
+
+    def urls(self, host: str, ws_port: int, rest_port: int) -> dict[str, str]:
+        """把交易所指向模拟交易所的配置(DYNACONF_前缀的环境变量)"""
+        ws = f'ws://{host}:{ws_port}'
+        rest = f'http://{host}:{rest_port}'
+        return {
+            'DYNACONF_BINANCE_REST': rest,
+            'DYNACONF_BINANCE_WS': ws,
+            'DYNACONF_BINANCE_WS_API': f'{ws}/ws-fapi/v1',
+            'DYNACONF_GATE_REST': rest,
+            'DYNACONF_GATE_WS': f'{ws}/v4/ws/usdt',
+        }
+
+    async def start(
+        self,
+        host: str = '127.0.0.1',
+        ws_port: int = 8765,
+        rest_port: int = 8766,
+    ):
+        self.server = await websockets.serve(
+            self.handle,
+            host,
+            ws_port,
+            ping_interval=None,
+        )
+
+        self.http = ThreadingHTTPServer((host, rest_port), RestHandler)
+        self.http.sim = self
+        threading.Thread(target=self.http.serve_forever, daemon=True).start()
+
+        self.tasks.append(asyncio.create_task(self.loop_tick()))
+        self.log.info(f'模拟交易所已启动 ws:{ws_port} rest:{rest_port}')
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.http:
+            self.http.shutdown()
+
+    async def handle(self, conn):
+        path = conn.path
+        if path.startswith('/v4/ws'):
+            await self.gate.handle(conn, path)
+        else:
+            await self.binance.handle(conn, path)
+
+    async def loop_tick(self):
+        """推送行情"""
+        while 1:
+            await asyncio.sleep(self.config.tick_interval / 1000)
+            for symbol, book in self.books.items():
+                book.step()
+                for venue in [self.binance, self.gate]:
+                    subs = venue.subs.get(symbol)
+                    if subs:
+                        await venue.push(subs, venue.book_ticker(book))
+
+    def stats(self) -> dict:
+        fills = sorted(self.fills)
+        n = len(fills)
+        return {
+            'orders': self.orders,
+            'fills': n,
+            'fill_p50': fills[n // 2] if n else 0,
+            'fill_p99': fills[int(n * 0.99)] if n else 0,
+        }
+
+
+async def bench(sim: SimExchange, count: int):
+    """用真实的Binance/Gate类对模拟交易所压测下单，统计下单到成交的延迟"""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+
+    from exchanges.binance import Binance
+    from exchanges.gate import Gate
+    from models.models import Secret
+    from models.enums import OrderStatus, OrderType, Side, TradeSide
+
+    pem = Ed25519PrivateKey.generate().private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode('ASCII')
+
+    sent: dict[str, int] = {}
+    done: dict[str, int] = {}
+
+    async def on_order(order):
+        if order.status in [OrderStatus.FILLED, OrderStatus.CANCELED]:
+            done[order.ex_name + order.id] = time.perf_counter_ns()
+
+    async def on_bbo(bbo):
+        pass
+
+    exchanges = [Binance(Secret(private_key=pem)), Gate(Secret())]
+    tasks = []
+    for ex in exchanges:
+        ex.listen_bbo(on_bbo)
+        ex.listen_order(on_order)
+        ex.rules = await ex.get_rules()
+        await ex.update_balance()
+        errs = await ex.reconcile_leverage({s: 10 for s in ex.rules})
+        assert not errs, errs
+        tasks.append(asyncio.create_task(ex.listen_private()))
+        tasks.append(asyncio.create_task(ex.listen_ws_api(5)))
+    await asyncio.sleep(3)
+
+    symbol = list(sim.config.symbols)[0]
+    for i in range(count):
+        for ex in exchanges:
+            start = time.perf_counter_ns()
+            id, err = await ex.create_order(
+                symbol,
+                Side.BUY,
+                TradeSide.OPEN,
+                OrderType.MARKET,
+                1,
+            )
+            if id:
+                sent[ex.__class__.__name__ + id] = start
+    await asyncio.sleep(1)
+
+    for task in tasks:
+        task.cancel()
+
+    latency = sorted((done[k] - v) / 1e6 for k, v in sent.items() if k in done)
+    n = len(latency)
+    print(f'下单:{len(sent)} 成交回报:{n}')
+    if n:
+        p50 = latency[n // 2]
+        p99 = latency[int(n * 0.99)]
+        print(f'下单到成交 p50:{p50:.2f}ms p99:{p99:.2f}ms')
+    print(f'模拟交易所统计: {sim.stats()}')
+
+
+async def main(args):
+    config = SimConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        fill_latency=args.fill_latency,
+        fill_rate=args.fill_rate,
+        reject_rate=args.reject_rate,
+        tick_interval=args.tick_interval,
+    )
+    sim = SimExchange(config)
+    await sim.start(args.host, args.ws_port, args.rest_port)
+    for k, v in sim.urls(args.host, args.ws_port, args.rest_port).items():
+        print(f'export {k}={v}')
+
+    if args.bench:
+        # 交易所地址在导入时读取，压测时先设置环境变量再导入
+        os.environ.update(sim.urls(args.host, args.ws_port, args.rest_port))
+        # rest是同步请求，压测客户端放到单独的线程里跑，避免阻塞模拟交易所
+        await asyncio.to_thread(asyncio.run, bench(sim, args.bench))
+        await sim.stop()
+    else:
+        await asyncio.Future()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='本地模拟交易所')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--ws-port', type=int, default=8765)
+    parser.add_argument('--rest-port', type=int, default=8766)
+    parser.add_argument('--latency', type=float, default=5)
+    parser.add_argument('--jitter', type=float, default=2)
+    parser.add_argument('--fill-latency', type=float, default=5)
+    parser.add_argument('--fill-rate', type=float, default=1)
+    parser.add_argument('--reject-rate', type=float, default=0)
+    parser.add_argument('--tick-interval', type=float, default=100)
+    parser.add_argument('--bench', type=int, default=0, help='压测下单次数')
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
@@ -0,0 +1,194 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from dataclasses import dataclass
+
+import websockets
+
+if __name__ == "__main__":
+    sys.path.append(
+        os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from tool import logger
+
+
+@dataclass
+class FeedConfig:
+    """行情压测配置"""
+    # 交易对数量
+    symbols: int = 100
+    # 每个连接每秒推送条数
+    rate: float = 10
+    # 突发倍数(1为不突发)
+    burst_x: float = 1
+    # 突发周期(秒)
+    burst_every: float = 10
+    # 每个周期内突发持续时间(秒)
+    burst_len: float = 1
+
+
+def gen_symbols(count: int) -> list[str]:
+    """合成交易对名字"""
+    return [f'S{i:04d}USDT' for i in range(count)]
+
+
+class FeedServer:
+    """
+    行情压测服务
+    同一个端口提供币安格式(/ws/{symbol}@bookTicker)和gate格式(/v4/ws/usdt订阅)的bookTicker
+    """
+
+    def __init__(self, config: FeedConfig, sent=None):
+        self.config = config
+        self.log = logger.get_logger(self.__class__.__name__)
+        self.symbols = gen_symbols(config.symbols)
+        self.prices = {s: random.uniform(0.01, 100) for s in self.symbols}
+
+        # 连接 -> (格式, 交易对)
+        self.conns: dict = {}
+        # 已发送条数(可以是跨进程的multiprocessing.Value)
+        self.sent = sent
+        self.count = 0
+
+    def rate(self, t: float) -> float:
+        """当前时刻每个连接的推送速率"""
+        c = self.config
+        if c.burst_x != 1 and t % c.burst_every < c.burst_len:
+            return c.rate * c.burst_x
+        return c.rate
+
+    async def handle(self, conn):
+        path = conn.path
+        try:
+            if path.endswith('@bookTicker'):
+                symbol = path.split('/')[-1].split('@')[0].upper()
+                self.conns[conn] = ('binance', symbol)
+                await conn.wait_closed()
+            else:
+                async for data in conn:
+                    req = json.loads(data)
+                    if req.get('channel') == 'futures.book_ticker':
+                        contract = req['payload'][0]
+                        self.conns[conn] = ('gate', contract.replace('_', ''))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.conns.pop(conn, None)
+
+    def message(self, kind: str, symbol: str, seq: int) -> str:
+        now = int(time.time() * 1000)
+        price = self.prices[symbol] * (1 + random.gauss(0, 0.0001))
+        if kind == 'binance':
+            return json.dumps({
+                'e': 'bookTicker',
+                'u': seq,
+                's': symbol,
+                'b': f'{price * 0.9999:.6f}',
+                'B': '100',
+                'a': f'{price * 1.0001:.6f}',
+                'A': '100',
+                'T': now,
+                'E': now,
+            })
+        return json.dumps({
+            'time': now // 1000,
+            'time_ms': now,
+            'channel': 'futures.book_ticker',
+            'event': 'update',
+            'result': {
+                't': now,
+                'u': seq,
+                's': symbol.replace('USDT', '_USDT'),
+                'b': f'{price * 0.9999:.6f}',
+                'B': 100,
+                'a': f'{price * 1.0001:.6f}',
+                'A': 100,
+            },
+        })
+
+    async def loop_send(self):
+        """
+        按速率给每个连接推送
+        每1毫秒累计一次额度，额度够一条就发一条，保证高速率时也准确
+        """
+        credit: dict = {}
+        start = time.perf_counter()
+        last = start
+        seq = 0
+        while 1:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            add = self.rate(now - start) * (now - last)
+            last = now
+
+            for conn, (kind, symbol) in list(self.conns.items()):
+                c = credit.get(conn, 0) + add
+                while c >= 1:
+                    c -= 1
+                    seq += 1
+                    try:
+                        await conn.send(self.message(kind, symbol, seq))
+                    except websockets.ConnectionClosed:
+                        break
+                    self.count += 1
+                credit[conn] = c
+
+            if self.sent is not None:
+                self.sent.value = self.count
+            for conn in list(credit):
+                if conn not in self.conns:
+                    del credit[conn]
+
+    async def run(self, host: str, port: int):
+        async with websockets.serve(self.handle, host, port, ping_interval=None):
+            await self.loop_send()
+
+
+def serve(config: FeedConfig, host: str, port: int, sent=None):
+    """在当前进程里运行行情压测服务(阻塞)"""
+    asyncio.run(FeedServer(config, sent).run(host, port))
+
+
+def start_process(
+    config: FeedConfig,
+    host: str,
+    port: int,
+) -> tuple[multiprocessing.Process, multiprocessing.Value]:
+    """在独立进程里启动，返回进程和已发送条数计数器"""
+    ctx = multiprocessing.get_context('spawn')
+    sent = ctx.Value('q', 0, lock=False)
+    p = ctx.Process(
+        target=serve,
+        args=(config, host, port, sent),
+        daemon=True,
+    )
+    p.start()
+    return p, sent
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='bookTicker行情压测服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8767)
+    parser.add_argument('--symbols', type=int, default=100)
+    parser.add_argument('--rate', type=float, default=10)
+    parser.add_argument('--burst-x', type=float, default=1)
+    parser.add_argument('--burst-every', type=float, default=10)
+    parser.add_argument('--burst-len', type=float, default=1)
+    args = parser.parse_args()
+
+    config = FeedConfig(
+        symbols=args.symbols,
+        rate=args.rate,
+        burst_x=args.burst_x,
+        burst_every=args.burst_every,
+        burst_len=args.burst_len,
+    )
+    print(f'export DYNACONF_BINANCE_WS=ws://{args.host}:{args.port}')
+    print(f'export DYNACONF_GATE_WS=ws://{args.host}:{args.port}/v4/ws/usdt')
+    serve(config, args.host, args.port)
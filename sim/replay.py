@@ -0,0 +1,202 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+if __name__ == "__main__":
+    sys.path.append(
+        os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from exchanges import capture, rule_cache
+from exchanges.binance import Binance
+from exchanges.exchange import Exchange
+from exchanges.gate import Gate
+from models.models import *
+from strategy.hedge import HedgeStrategy
+from strategy.strategy import Strategy
+from tool import logger, timex
+from trader import Trader
+
+
+class SimClock:
+    """模拟时钟，时间由回放的帧推进"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self) -> float:
+        return self.now
+
+
+class ReplayTrader(Trader):
+    """
+    回放用的Trader
+    不真实下单，信号直接按信号价格记成仓位，下单锁立即释放
+    """
+
+    def __init__(self, strategy: Strategy):
+        super().__init__(strategy)
+        self.signals: dict[str, dict[str, int]] = {}
+
+    async def trade(self, market_time: int, signal: Signal):
+        tside = signal.exchanges[0].tside
+        count = self.signals.setdefault(signal.symbol, {'OPEN': 0, 'CLOSE': 0})
+        count[str(tside)] += 1
+
+        for ex_signal in signal.exchanges:
+            ex = self.exchanges[ex_signal.ex_name]
+            id = signal.symbol + str(ex_signal.side)
+            if ex_signal.tside == TradeSide.OPEN:
+                ex.pos[id] = Position(
+                    symbol=signal.symbol,
+                    id=id,
+                    side=ex_signal.side,
+                    price=ex_signal.price,
+                    amount=ex_signal.amount,
+                    c_time=market_time,
+                )
+            elif id in ex.pos:
+                del ex.pos[id]
+
+    async def execute(self, now: int, signal: Signal):
+        await self.trade(now, signal)
+        self.order_lock.release(signal.symbol)
+
+
+class Replay:
+    """
+    行情回放
+    读取录制的bookTicker原始帧，经过交易所真实的pub_msg解析后驱动Trader.on_bbo
+    speed=0 全速回放，speed=1 按录制节奏，speed=N N倍速
+    """
+
+    def __init__(self, trader: Trader, path: str = capture.CAPTURE_DIR):
+        self.trader = trader
+        self.path = path
+        self.log = logger.get_logger(self.__class__.__name__)
+        self.clock = SimClock()
+
+        # 连接id -> (交易所, 交易对)
+        self.conns: dict[int, tuple[Exchange, str]] = {}
+
+    def frames(self):
+        """按录制顺序产出公共行情帧: (接收时间纳秒, 交易所, 交易对, 原始帧)"""
+        for file_path in capture.list_segments(self.path):
+            for ns, conn_id, direction, data in capture.read_frames(file_path):
+                if direction == capture.DIR_CONN:
+                    info = json.loads(data)
+                    ex_name = info['name'].split(' ')[0]
+                    ex = self.trader.exchanges.get(ex_name)
+                    if ex and info['symbol']:
+                        self.conns[conn_id] = (ex, info['symbol'])
+                    continue
+
+                if direction != capture.DIR_IN or conn_id not in self.conns:
+                    continue
+                ex, symbol = self.conns[conn_id]
+                yield ns, ex, symbol, data
+
+    async def run(self, speed: float = 0) -> dict:
+        events = 0
+        start_ns = 0
+        wall_start = time.perf_counter()
+
+        timex.set_clock(self.clock.time)
+        try:
+            for ns, ex, symbol, data in self.frames():
+                self.clock.now = ns / 1e9
+
+                # 按录制节奏回放
+                if speed > 0:
+                    if not start_ns:
+                        start_ns = ns
+                    wait = (ns - start_ns) / 1e9 / speed
+                    wait -= time.perf_counter() - wall_start
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+
+                await ex.pub_msg(None, symbol, data)
+                events += 1
+
+                # 回放不让出事件循环，每帧之后直接派发这一帧产生的信号
+                if self.trader.queue.pending:
+                    await self.trader.dispatch()
+        finally:
+            timex.set_clock()
+
+        seconds = time.perf_counter() - wall_start
+        report = {
+            'events': events,
+            'seconds': seconds,
+            'events_per_s': events / seconds if seconds else 0,
+            'signals': getattr(self.trader, 'signals', {}),
+        }
+        self.log.info(
+            f'回放完成 事件:{events} 耗时:{seconds:.3f}s 吞吐:{report["events_per_s"]:.0f}/s'
+        )
+        return report
+
+
+async def load_rules(ex: Exchange, path: str, fetch: bool) -> dict[str, ContractRule]:
+    """
+    回放用的交易规则，不联网: 录制目录里存的规则，没有就用本地交易规则缓存(不管是否过期)
+    fetch: 都没有时从交易所拉取
+    """
+    name = ex.__class__.__name__
+    rules, _ = rule_cache.load(name, path)
+    if rules:
+        return rules
+    rules, age = rule_cache.load(ex.rules_cache_name())
+    if rules:
+        ex.log.warning(f'录制目录里没有交易规则 使用本地缓存 {age:.0f}秒前')
+        return rules
+    if fetch:
+        ex.log.warning('录制目录里没有交易规则 从交易所拉取')
+        return await ex.get_rules()
+    return {}
+
+
+async def main(
+    path: str,
+    speed: float,
+    balance: float,
+    out: str,
+    fetch_rules: bool = False,
+):
+    trader = ReplayTrader(HedgeStrategy())
+    # 回放不连交易所，不需要账号
+    trader.add_exchagne(Binance(Secret()))
+    trader.add_exchagne(Gate(Secret()))
+
+    for ex in trader.exchanges.values():
+        ex.rules = await load_rules(ex, path, fetch_rules)
+        if not ex.rules:
+            ex.log.error('没有交易规则 加--fetch-rules从交易所拉取')
+            return
+        ex.account.swap_balance = balance
+        ex.account.swap_available = balance
+
+    report = await Replay(trader, path).run(speed)
+    for symbol, count in sorted(report['signals'].items()):
+        print(f'{symbol} 开:{count["OPEN"]} 平:{count["CLOSE"]}')
+
+    if out:
+        with open(out, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='录制行情回放')
+    parser.add_argument('path', nargs='?', default=capture.CAPTURE_DIR)
+    parser.add_argument('--speed', type=float, default=0, help='0为全速')
+    parser.add_argument('--balance', type=float, default=1000)
+    parser.add_argument('--out', default='', help='报告输出文件(json)')
+    parser.add_argument('--fetch-rules',
+                        action='store_true',
+                        help='录制目录和本地缓存都没有交易规则时从交易所拉取')
+    args = parser.parse_args()
+
+    asyncio.run(
+        main(args.path, args.speed, args.balance, args.out, args.fetch_rules))
@@ -0,0 +1,211 @@
+import asyncio
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Callable
+
+from models.enums import *
+from models.models import *
+from tool import logger
+from tool.timex import time_ms
+from config import settings
+
+LOCK_TIMEOUT: int = settings.order_lock_timeout  # 下单锁超时(毫秒)
+
+
+class LegStatus(Enum):
+    """单个交易所的下单状态"""
+    # 已下单，等待成交
+    PENDING = 'PENDING'
+    # 已成交，并且收到了仓位推送
+    FILLED = 'FILLED'
+    # 下单失败或者没成交就撤了
+    FAILED = 'FAILED'
+
+    def __str__(self):
+        return self.value
+
+
+@dataclass
+class Leg:
+    """对冲单的一条腿"""
+    # 交易所名字
+    ex_name: str
+    # 交易所上的交易对
+    symbol: str
+    # 订单id，下单返回前为空
+    id: str = ''
+    # 订单是否成交
+    filled: bool = False
+    # 是否收到过仓位推送
+    pos_seen: bool = False
+    # 这一单会改变的仓位方向和加锁时的仓位数量，数量变了的仓位推送才算(资金费、保证金变动也会推仓位)
+    pos_side: Side | None = None
+    pos_amount: float = 0
+    # 状态
+    status: LegStatus = LegStatus.PENDING
+
+
+@dataclass
+class Execution:
+    """一次对冲下单"""
+    # 交易对
+    symbol: str
+    # 开始时间(毫秒)
+    start: int
+    # 交易所名字 -> 腿
+    legs: dict[str, Leg] = field(default_factory=dict)
+
+    def done(self) -> bool:
+        return all(leg.status != LegStatus.PENDING for leg in self.legs.values())
+
+    def ok(self) -> bool:
+        return all(leg.status == LegStatus.FILLED for leg in self.legs.values())
+
+
+class OrderLock:
+    """
+    按交易对的下单锁
+    每条腿下单 -> 成交且收到仓位推送(或失败) -> 所有腿结束就释放，超时兜底释放
+    """
+
+    def __init__(self, timeout: int = LOCK_TIMEOUT):
+        self.log = logger.get_logger(self.__class__.__name__)
+        self.timeout = timeout
+        # 每条腿结束时(成交、失败、超时)回调，参数为交易对和腿
+        self.on_leg: Callable[[str, Leg], None] | None = None
+
+        # 交易对 -> 进行中的下单
+        self.execs: dict[str, Execution] = {}
+        # (交易所, 订单id) -> 交易对
+        self.by_order: dict[tuple[str, str], str] = {}
+        # (交易所, 交易所上的交易对) -> 交易对
+        self.by_symbol: dict[tuple[str, str], str] = {}
+        # 下单返回前就到了的订单推送，(交易所, 订单id) -> 订单
+        self.early: dict[tuple[str, str], Order] = {}
+
+    def locked(self, symbol: str) -> bool:
+        return symbol in self.execs
+
+    def acquire(
+        self,
+        symbol: str,
+        legs: dict[str, str],
+        now: int = 0,
+        bases: dict[str, tuple[Side, float]] | None = None,
+    ):
+        """
+        加锁
+        legs: 交易所名字 -> 交易所上的交易对
+        bases: 交易所名字 -> (会改变的仓位方向, 加锁时的仓位数量)，没给的腿任何仓位推送都算
+        """
+        e = Execution(symbol, now or time_ms())
+        for ex_name, ex_symbol in legs.items():
+            leg = Leg(ex_name, ex_symbol)
+            if bases and ex_name in bases:
+                leg.pos_side, leg.pos_amount = bases[ex_name]
+            e.legs[ex_name] = leg
+            self.by_symbol[(ex_name, ex_symbol)] = symbol
+        self.execs[symbol] = e
+
+    def release(self, symbol: str):
+        e = self.execs.pop(symbol, None)
+        if not e:
+            return
+        for leg in e.legs.values():
+            self.by_order.pop((leg.ex_name, leg.id), None)
+            self.by_symbol.pop((leg.ex_name, leg.symbol), None)
+            # 超时或者提前释放时，没结束的腿也要通知
+            if leg.status == LegStatus.PENDING and self.on_leg:
+                self.on_leg(symbol, leg)
+
+    def finish(self, symbol: str, leg: Leg, status: LegStatus):
+        """腿结束"""
+        if leg.status != LegStatus.PENDING:
+            return
+        leg.status = status
+        if self.on_leg:
+            self.on_leg(symbol, leg)
+
+    def placed(self, symbol: str, ex_name: str, id: str):
+        """下单返回，id为空就是下单失败"""
+        e = self.execs.get(symbol)
+        if not e:
+            return
+        leg = e.legs[ex_name]
+        if not id:
+            self.finish(symbol, leg, LegStatus.FAILED)
+        else:
+            leg.id = id
+            self.by_order[(ex_name, id)] = symbol
+            order = self.early.pop((ex_name, id), None)
+            if order:
+                self.update_leg(symbol, leg, order)
+        self.check(e)
+
+    def on_order(self, order: Order):
+        """订单推送"""
+        key = (order.ex_name, order.id)
+        symbol = self.by_order.get(key)
+        if symbol is None:
+            # 可能比下单返回先到，先存起来
+            if self.execs:
+                self.early[key] = order
+                if len(self.early) > 1000:
+                    self.early.pop(next(iter(self.early)))
+            return
+        e = self.execs[symbol]
+        self.update_leg(symbol, e.legs[order.ex_name], order)
+        self.check(e)
+
+    def on_pos(self, ex_name: str, pos: Position):
+        """仓位推送"""
+        symbol = self.by_symbol.get((ex_name, pos.symbol))
+        if symbol is None:
+            return
+        e = self.execs[symbol]
+        leg = e.legs[ex_name]
+        # 不是这一单带来的仓位变化
+        if leg.pos_side is not None and (pos.side != leg.pos_side
+                                         or pos.amount == leg.pos_amount):
+            return
+        leg.pos_seen = True
+        if leg.filled:
+            self.finish(symbol, leg, LegStatus.FILLED)
+        self.check(e)
+
+    def update_leg(self, symbol: str, leg: Leg, order: Order):
+        if order.status == OrderStatus.FILLED:
+            leg.filled = True
+        elif order.status == OrderStatus.CANCELED:
+            # 部分成交后撤单也算成交
+            if order.deal_amount > 0:
+                leg.filled = True
+            else:
+                self.finish(symbol, leg, LegStatus.FAILED)
+                return
+        if leg.filled and leg.pos_seen:
+            self.finish(symbol, leg, LegStatus.FILLED)
+
+    def check(self, e: Execution):
+        if not e.done():
+            return
+        cost = time_ms() - e.start
+        if e.ok():
+            self.log.info(f'{e.symbol} 对冲完成 耗时:{cost}ms')
+        else:
+            status = {k: str(v.status) for k, v in e.legs.items()}
+            self.log.error(f'{e.symbol} 对冲失败 {status}')
+        self.release(e.symbol)
+
+    async def loop_timeout(self, interval: float = 0.5):
+        """超时兜底，推送丢失时也能释放"""
+        while 1:
+            await asyncio.sleep(interval)
+            now = time_ms()
+            for symbol, e in list(self.execs.items()):
+                if now - e.start > self.timeout:
+                    status = {k: str(v.status) for k, v in e.legs.items()}
+                    self.log.warning(f'{symbol} 下单锁超时释放 {status}')
+                    self.release(symbol)
+            if not self.execs:
+                self.early.clear()
@@ -2,6 +2,7 @@ import asyncio
 from exchanges.binance import Binance
 from exchanges.gate import Gate
 from strategy.strategy import Strategy
+from strategy.tick import Tick
 from exchanges.exchange import Exchange
 from models.models import *
 from config import settings
@@ -19,8 +20,21 @@ MIN_NOMINAL: float = settings.min_nominal  # 开仓最小名义价值
 
 class HedgeStrategy(Strategy):
 
-    def __init__(self):
-        super().__init__()
+    def __init__(
+        self,
+        name: str = '',
+        symbols: list[str] | None = None,
+        spread: float = SPREAD,
+        pos_rate: float = POS_RATE,
+        bbo_volume_rate: float = BBO_VOLUME_RATE,
+    ):
+        super().__init__(name, symbols)
+        # 开仓价差
+        self.spread = spread
+        # 分仓占比
+        self.pos_rate = pos_rate
+        # bbo容量占比
+        self.bbo_volume_rate = bbo_volume_rate
 
     def gen_signal(
         self,
@@ -28,55 +42,66 @@ class HedgeStrategy(Strategy):
         symbol: str,
         exchanges: list[Exchange],
     ) -> Signal | None:
-        if len(exchanges) != 2:
-            self.log.error('策略只支持2个交易所')
-            return
-
-        m_ex = exchanges[0]
-        s_ex = exchanges[1]
-
-        # 获取最新的bbo
-        m_bbo = m_ex.get_last_bbo(symbol)
-        s_bbo = s_ex.get_last_bbo(symbol)
-        if not m_bbo or not s_bbo:
-            return
+        return self.on_tick(Tick(now, symbol, exchanges))
 
-        # 过滤延迟太大的行情
-        m_delay = now - m_bbo.time
-        s_delay = now - s_bbo.time
-        if MAX_DELAY < m_delay or MAX_DELAY < s_delay:
+    def on_tick(self, tick: Tick) -> Signal | None:
+        exchanges = tick.exchanges
+        if len(exchanges) < 2:
+            self.log.error('策略至少需要2个交易所')
             return
 
         # todo 追加仓位,现在是有仓位就不追加
-        # 找出仓位
-        m_pos = self.fetch_pos(symbol, m_ex.pos)
-        s_pos = self.fetch_pos(symbol, s_ex.pos)
+        # 找出有仓位的交易所，一笔对冲只在一对交易所上
+        held = tick.held(self.fetch_pos)
 
         # 判断平仓
-        if m_pos and s_pos:
+        if len(held) == 2:
+            (m, m_pos), (s, s_pos) = held
+            if not self.fresh(tick, m, s):
+                return
             return self.gen_close_pos_sign(
-                symbol,
-                m_bbo,
-                s_bbo,
-                m_ex,
-                s_ex,
+                tick.symbol,
+                tick.bbo(m),
+                tick.bbo(s),
+                exchanges[m],
+                exchanges[s],
                 m_pos,
                 s_pos,
+                tick.cache,
             )
 
-        # 判断开仓
-        elif not m_pos and not s_pos:
+        # 判断开仓 在价差最大的一对交易所上，高买价的卖、低卖价的买
+        elif not held:
+            venues = tick.best_pair()
+            if not venues:
+                return
+            m, s = venues
+            if not self.fresh(tick, m, s):
+                return
             return self.gen_open_pos_sign(
-                now,
-                symbol,
-                m_bbo,
-                s_bbo,
-                m_ex,
-                s_ex,
+                tick.now,
+                tick.symbol,
+                tick.bbo(m),
+                tick.bbo(s),
+                exchanges[m],
+                exchanges[s],
+                tick.spread(m, s),
+                tick.cache,
             )
 
         return
 
+    def fresh(self, tick: Tick, m: int, s: int) -> bool:
+        """两边都有行情，并且延迟不超过MAX_DELAY"""
+        m_bbo = tick.bbo(m)
+        s_bbo = tick.bbo(s)
+        if not m_bbo or not s_bbo:
+            return False
+
+        m_delay = tick.now - m_bbo.time
+        s_delay = tick.now - s_bbo.time
+        return MAX_DELAY >= m_delay and MAX_DELAY >= s_delay
+
     def fetch_pos(
         self,
         symbol: str,
@@ -98,8 +123,12 @@ class HedgeStrategy(Strategy):
         s: Exchange,
         m_pos: Position,
         s_pos: Position,
+        cache: dict | None = None,
     ) -> HedgeSignal | None:
-        """产生平仓信号"""
+        """
+        产生平仓信号
+        cache: 同一笔行情各策略共用的中间结果(见Tick.cache)
+        """
         m_data = None
         s_data = None
 
@@ -125,6 +154,8 @@ class HedgeStrategy(Strategy):
             # 查询规则
             m_rule = m.get_rule(symbol)
             s_rule = s.get_rule(symbol)
+            if not m_rule or not s_rule:
+                return
 
             # 计算是否值得平 开仓没赌对,平仓时再赌一次
             # 手续费
@@ -154,12 +185,24 @@ class HedgeStrategy(Strategy):
                 self.log.info(f'{symbol} 价差回归,但是盈利不足 回报率:{profit_rate}')
                 return
 
+            # 盘口币数，有订单簿时按回报率降到0.2%的价格吃多档
+            m_side = Side.BUY if m_pos.side == Side.SELL else Side.SELL
+            s_side = Side.BUY if s_pos.side == Side.SELL else Side.SELL
+            key = ('close', id(m), id(s))
+            book_coin_count = cache.get(key) if cache is not None else None
+            if book_coin_count is None:
+                book_coin_count = self.depth_coin_count(
+                    symbol,
+                    (m, m_side, m_bbo_price, m_bbo_contract_count, m_rule),
+                    (s, s_side, s_bbo_price, s_bbo_contract_count, s_rule),
+                    profit_rate - 0.002,
+                )
+                if cache is not None:
+                    cache[key] = book_coin_count
+
             # 计算应平币数
             coin_count = min(
-                m_bbo_contract_count * m_rule.contract_size *
-                BBO_VOLUME_RATE,  # 盘口币数
-                s_bbo_contract_count * s_rule.contract_size *
-                BBO_VOLUME_RATE,  # 盘口币数
+                book_coin_count * self.bbo_volume_rate,  # 盘口币数
                 m_pos.amount * m_rule.contract_size,  # 仓位币数
                 s_pos.amount * s_rule.contract_size,  # 仓位币数
             )
@@ -219,24 +262,33 @@ class HedgeStrategy(Strategy):
         s_bbo: BBO,
         m: Exchange,
         s: Exchange,
+        spreads: tuple[float, float] | None = None,
+        cache: dict | None = None,
     ) -> HedgeSignal:
-        """产生开仓信号"""
+        """
+        产生开仓信号
+        spreads: 已经算好的(主卖副买, 主买副卖)价差
+        cache: 同一笔行情各策略共用的中间结果(见Tick.cache)
+        """
         # 可用余额
         available = self.get_available(m, s)
         if available <= 0:
             return
 
         # 计算价差
-        s1 = calc_spread(m_bbo.bid, s_bbo.ask)
-        s2 = calc_spread(s_bbo.bid, m_bbo.ask)
-        if s1 > SPREAD:
+        if spreads:
+            s1, s2 = spreads
+        else:
+            s1 = calc_spread(m_bbo.bid, s_bbo.ask)
+            s2 = calc_spread(s_bbo.bid, m_bbo.ask)
+        if s1 > self.spread:
             # 主空 副多
             spread = s1
             m_data = (m_bbo.bid, m_bbo.bid_amount)
             s_data = (s_bbo.ask, s_bbo.ask_amount)
             m_side = Side.SELL
             s_side = Side.BUY
-        elif s2 > SPREAD:
+        elif s2 > self.spread:
             # 主多 副空
             spread = s2
             m_data = (m_bbo.ask, m_bbo.ask_amount)
@@ -255,17 +307,29 @@ class HedgeStrategy(Strategy):
             # 查询规则
             m_rule = m.get_rule(symbol)
             s_rule = s.get_rule(symbol)
+            # 下架的交易对不再开仓
+            if not m_rule or not s_rule or m_rule.delisted or s_rule.delisted:
+                return
 
-            # bbo最小币数库存
-            min_bbo_coin_count = min(
-                m_bbo_contract_count * m_rule.contract_size,
-                s_bbo_contract_count * s_rule.contract_size,
-            )
+            # 盘口最小币数库存，有订单簿时吃到价差降到保本为止的多档
+            # 两条腿一起往差的方向走，每条腿各让出一半的余量
+            break_even = 2 * (m.taker_fee_rate + s.taker_fee_rate)
+            key = ('open', id(m), id(s), m_side)
+            min_bbo_coin_count = cache.get(key) if cache is not None else None
+            if min_bbo_coin_count is None:
+                min_bbo_coin_count = self.depth_coin_count(
+                    symbol,
+                    (m, m_side, m_bbo_price, m_bbo_contract_count, m_rule),
+                    (s, s_side, s_bbo_price, s_bbo_contract_count, s_rule),
+                    (spread - break_even) / 2,
+                )
+                if cache is not None:
+                    cache[key] = min_bbo_coin_count
             # 可开合约价值
             order_value = available * m_rule.trade_leverage
             # 计算最低可开币数
             coin_count = min(
-                min_bbo_coin_count * BBO_VOLUME_RATE,  # 较小盘口的分仓币数
+                min_bbo_coin_count * self.bbo_volume_rate,  # 较小盘口的分仓币数
                 (order_value / m_bbo_price),  # 余额的最大可开币数
                 (order_value / s_bbo_price),  # 余额的最大可开币数
                 m_rule.max_amount * m_rule.contract_size,  # 最大下单币数
@@ -336,12 +400,40 @@ class HedgeStrategy(Strategy):
 
         return
 
+    def depth_coin_count(
+        self,
+        symbol: str,
+        m_leg: tuple[Exchange, Side, float, float, ContractRule],
+        s_leg: tuple[Exchange, Side, float, float, ContractRule],
+        slip: float,
+    ) -> float:
+        """
+        两边都能吃到的币数
+        leg: (交易所, 吃单方向, 最优价格, 最优价格的张数, 规则)
+        slip: 每条腿允许比最优价格差的比率，有订单簿的腿累计到这个价格的多档
+        没有订单簿(或者还没同步好)只用最优价格的数量
+        """
+        counts = []
+        for ex, side, price, contract_count, rule in (m_leg, s_leg):
+            depth = None
+            if slip > 0:
+                if side == Side.BUY:
+                    limit = price * (1 + slip)
+                else:
+                    limit = price * (1 - slip)
+                depth = ex.book_depth(symbol, side, limit)
+            if depth is None:
+                depth = contract_count
+            counts.append(max(depth, contract_count) * rule.contract_size)
+        return min(counts)
+
     def get_available(self, m: Exchange, s: Exchange) -> float:
         """获取可用余额"""
         # 计算主所分仓后的余额
         m_swap = m.account.swap_balance
-        m_swap_ava = m.account.swap_available
-        m_pos_rate_balance = m_swap * POS_RATE
+        # 扣掉其他交易对在途订单预占的保证金
+        m_swap_ava = m.available()
+        m_pos_rate_balance = m_swap * self.pos_rate
         m_reserve_balance = m_swap * RESERVE_MARGIN
         if m_swap_ava <= 0:
             # msg = f'主所余额不足 可用余额:{m_swap_ava} 分仓:{m_pos_rate_balance}'
@@ -354,8 +446,8 @@ class HedgeStrategy(Strategy):
 
         # 计算副所分仓后的余额
         s_swap = s.account.swap_balance
-        s_swap_ava = s.account.swap_available
-        s_pos_rate_balance = s_swap * POS_RATE
+        s_swap_ava = s.available()
+        s_pos_rate_balance = s_swap * self.pos_rate
         s_reserve_balance = s_swap * RESERVE_MARGIN
         if s_swap_ava <= 0:
             # msg = f'副所余额不足 可用余额:{s_swap_ava} 分仓:{s_pos_rate_balance}'
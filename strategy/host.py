@@ -0,0 +1,101 @@
+import asyncio
+import time
+
+from models.models import *
+from strategy.strategy import Strategy
+from strategy.tick import Tick
+from tool import logger
+from config import settings
+
+STRATEGY_STATS_INTERVAL: int = settings.strategy_stats_interval  # 策略耗时统计的输出间隔(秒)
+
+# 耗时直方图按2的幂分桶(纳秒)，最后一桶放所有更慢的
+LATENCY_BUCKETS = 40
+
+
+class LatencyStats:
+    """耗时统计，按2的幂分桶估算分位数"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.signals = 0
+        self.buckets = [0] * LATENCY_BUCKETS
+
+    def add(self, ns: int):
+        self.count += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+        self.buckets[min(ns.bit_length(), LATENCY_BUCKETS - 1)] += 1
+
+    def pct(self, p: float) -> int:
+        """分位数所在桶的上界(纳秒)，不超过最大值"""
+        target = self.count * p
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= target:
+                return min(1 << i, self.max)
+        return 0
+
+    def reset(self):
+        self.__init__()
+
+
+class StrategyHost:
+    """
+    多策略
+    同一笔行情只算一次公共数据(见Tick)，依次交给订阅了这个交易对的策略
+    每个策略单独统计耗时，定期输出
+    """
+
+    def __init__(self, strategies: list[Strategy]):
+        self.log = logger.get_logger(self.__class__.__name__)
+        self.strategies = strategies
+        self.stats = {id(st): LatencyStats() for st in strategies}
+
+    def on_tick(self, tick: Tick) -> list[Signal]:
+        signals = []
+        symbol = tick.symbol
+        for st in self.strategies:
+            if st.symbols is not None and symbol not in st.symbols:
+                continue
+            start = time.perf_counter_ns()
+            signal = st.on_tick(tick)
+            stats = self.stats[id(st)]
+            stats.add(time.perf_counter_ns() - start)
+            if signal:
+                stats.signals += 1
+                signal.strategy = st.name
+                signals.append(signal)
+        return signals
+
+    def report(self) -> dict[str, dict]:
+        report = {}
+        for st in self.strategies:
+            stats = self.stats[id(st)]
+            report[st.name] = {
+                'count': stats.count,
+                'signals': stats.signals,
+                'avg_us': stats.total / stats.count / 1000 if stats.count else 0,
+                'p50_us': stats.pct(0.5) / 1000,
+                'p99_us': stats.pct(0.99) / 1000,
+                'max_us': stats.max / 1000,
+            }
+        return report
+
+    async def loop_report(self, interval: float = STRATEGY_STATS_INTERVAL):
+        """定期输出各策略的耗时，输出后重新统计"""
+        while 1:
+            await asyncio.sleep(interval)
+            for name, r in self.report().items():
+                if not r['count']:
+                    continue
+                self.log.info(
+                    f"{name} 行情:{r['count']} 信号:{r['signals']} "
+                    f"耗时avg:{r['avg_us']:.1f}us p50:{r['p50_us']:.0f}us "
+                    f"p99:{r['p99_us']:.0f}us max:{r['max_us']:.0f}us")
+            for stats in self.stats.values():
+                stats.reset()
@@ -0,0 +1,99 @@
+import math
+
+
+class SymbolQuotes:
+    """一个交易对在各交易所的买一卖一，下标是交易所的序号"""
+    __slots__ = ('bids', 'asks', 'best_bid', 'best_ask')
+
+    def __init__(self, venues: int):
+        self.bids = [-math.inf] * venues
+        self.asks = [math.inf] * venues
+        # 最高买价、最低卖价所在的交易所，-1为还没有行情
+        self.best_bid = -1
+        self.best_ask = -1
+
+    def grow(self, venues: int):
+        while len(self.bids) < venues:
+            self.bids.append(-math.inf)
+            self.asks.append(math.inf)
+
+
+class BestQuotes:
+    """
+    按交易对跟踪N个交易所的最高买价和最低卖价
+    每条行情只和当前最优比一次: 更优就换，不是当前最优所在的交易所就不用管
+    只有当前最优所在的交易所自己变差时才重新扫一遍(交易所只有几个)
+    """
+
+    def __init__(self):
+        self.venues = 0
+        self.symbols: dict[str, SymbolQuotes] = {}
+
+    def add_venue(self) -> int:
+        """加一个交易所，返回它的序号"""
+        self.venues += 1
+        for q in self.symbols.values():
+            q.grow(self.venues)
+        return self.venues - 1
+
+    def update(self, symbol: str, venue: int, bid: float, ask: float):
+        q = self.symbols.get(symbol)
+        if not q:
+            q = self.symbols[symbol] = SymbolQuotes(self.venues)
+
+        bids = q.bids
+        old = bids[venue]
+        bids[venue] = bid
+        best = q.best_bid
+        if best == venue:
+            if bid < old:
+                q.best_bid = max(range(len(bids)), key=bids.__getitem__)
+        elif best < 0 or bid > bids[best]:
+            q.best_bid = venue
+
+        asks = q.asks
+        old = asks[venue]
+        asks[venue] = ask
+        best = q.best_ask
+        if best == venue:
+            if ask > old:
+                q.best_ask = min(range(len(asks)), key=asks.__getitem__)
+        elif best < 0 or ask < asks[best]:
+            q.best_ask = venue
+
+    def best_pair(self, symbol: str) -> tuple[int, int] | None:
+        """
+        价差最大的一对交易所
+        return: (卖出的交易所, 买入的交易所)，不到两个交易所有行情返回None
+        最高买价和最低卖价在同一个交易所时，取次优里价差大的一边
+        """
+        q = self.symbols.get(symbol)
+        if not q or q.best_bid < 0 or q.best_ask < 0:
+            return
+        hi = q.best_bid
+        lo = q.best_ask
+        if q.bids[hi] == -math.inf or q.asks[lo] == math.inf:
+            return
+        if hi != lo:
+            return hi, lo
+
+        bids = q.bids
+        asks = q.asks
+        hi2 = lo2 = -1
+        for i in range(len(bids)):
+            if i == hi:
+                continue
+            if bids[i] > -math.inf and (hi2 < 0 or bids[i] > bids[hi2]):
+                hi2 = i
+            if asks[i] < math.inf and (lo2 < 0 or asks[i] < asks[lo2]):
+                lo2 = i
+        if hi2 < 0 and lo2 < 0:
+            return
+        if lo2 < 0:
+            return hi2, lo
+        if hi2 < 0:
+            return hi, lo2
+        # 比较 卖hi买lo2 和 卖hi2买lo 的价差
+        if bids[hi] / asks[lo2] >= bids[hi2] / asks[lo]:
+            return hi, lo2
+        return hi2, lo
@@ -0,0 +1,59 @@
+import asyncio
+from typing import Awaitable, Callable
+
+from exchanges.exchange import Exchange
+from models.enums import *
+from models.models import *
+
+
+def expected_edge(signal: Signal, exchanges: dict[str, Exchange]) -> float:
+    """
+    预期收益 = (价差 - 各腿手续费率) * 可成交的名义价值
+    平仓信号释放保证金和风险，排在所有开仓前面
+    """
+    first = signal.exchanges[0]
+    if first.tside == TradeSide.CLOSE:
+        return float('inf')
+
+    fee = 0
+    for ex_signal in signal.exchanges:
+        fee += exchanges[ex_signal.ex_name].taker_fee_rate
+    rule = exchanges[first.ex_name].get_rule(signal.symbol)
+    value = first.price * first.amount * rule.contract_size
+    return (signal.spread - fee) * value
+
+
+class OpportunityQueue:
+    """
+    候选信号队列
+    同一轮事件循环里各交易对产生的信号先收集起来，这一轮结束后按预期收益从高到低派发
+    同一交易对只保留最新的信号
+    """
+
+    def __init__(self, dispatch: Callable[[], Awaitable[None]]):
+        self.dispatch = dispatch
+        # 交易对 -> (预期收益, 行情时间, 信号)
+        self.pending: dict[str, tuple[float, int, Signal]] = {}
+        self.scheduled = False
+        # 派发任务的引用，防止被回收
+        self.tasks: set[asyncio.Task] = set()
+
+    def add(self, now: int, signal: Signal, edge: float):
+        self.pending[signal.symbol] = (edge, now, signal)
+        if not self.scheduled:
+            self.scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+
+    def flush(self):
+        self.scheduled = False
+        if not self.pending:
+            return
+        task = asyncio.create_task(self.dispatch())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def drain(self) -> list[tuple[int, Signal]]:
+        """取出所有候选，按预期收益从高到低"""
+        ranked = sorted(self.pending.values(), key=lambda c: c[0], reverse=True)
+        self.pending.clear()
+        return [(now, signal) for _, now, signal in ranked]
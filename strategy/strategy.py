@@ -2,13 +2,22 @@ from abc import ABC, abstractmethod
 import copy
 from exchanges.exchange import Exchange
 from models.models import *
+from strategy.tick import Tick
 from tool import logger
 
 
 class Strategy(ABC):
 
-    def __init__(self):
-        self.log = logger.get_logger(self.__class__.__name__)
+    def __init__(self, name: str = '', symbols: list[str] | None = None):
+        # 策略名，多策略时区分日志和耗时统计
+        self.name = name or self.__class__.__name__
+        self.log = logger.get_logger(self.name)
+        # 只交易这些交易对，None为全部
+        self.symbols = set(symbols) if symbols is not None else None
+
+    def on_tick(self, tick: Tick) -> Signal | None:
+        """多策略时由StrategyHost调用，tick里的公共数据各策略共用"""
+        return self.gen_signal(tick.now, tick.symbol, tick.exchanges)
 
     @abstractmethod
     def gen_signal(
@@ -0,0 +1,88 @@
+from exchanges.exchange import Exchange
+from models.models import *
+from strategy.quotes import BestQuotes
+from tool.mathx import calc_spread
+
+# 还没算过
+UNSET = object()
+
+
+class Tick:
+    """
+    一笔行情的公共数据
+    同一笔行情的所有策略共用一份，用到时才算，算过一次后面的策略直接取
+    """
+    __slots__ = ('now', 'symbol', 'exchanges', 'quotes', 'bbos', 'pairs',
+                 'spreads', 'positions', 'cache')
+
+    def __init__(
+        self,
+        now: int,
+        symbol: str,
+        exchanges: list[Exchange],
+        quotes: BestQuotes | None = None,
+    ):
+        self.now = now
+        self.symbol = symbol
+        self.exchanges = exchanges
+        self.quotes = quotes
+        # 交易所下标 -> 归一化后的bbo
+        self.bbos: list[BBO | None | object] = [UNSET] * len(exchanges)
+        self.pairs: tuple[int, int] | None | object = UNSET
+        # (交易所下标, 交易所下标) -> (主卖副买的价差, 主买副卖的价差)
+        self.spreads: dict[tuple[int, int], tuple[float, float]] | None = None
+        self.positions: list[tuple[int, Position]] | None = None
+        # 策略自己的中间结果(比如盘口深度)，键由策略定
+        self.cache: dict = {}
+
+    def bbo(self, i: int) -> BBO | None:
+        """归一化后的bbo"""
+        bbo = self.bbos[i]
+        if bbo is UNSET:
+            bbo = self.bbos[i] = self.exchanges[i].get_last_bbo(self.symbol)
+        return bbo
+
+    def best_pair(self) -> tuple[int, int] | None:
+        """(卖出的交易所, 买入的交易所)的下标"""
+        if self.pairs is not UNSET:
+            return self.pairs
+
+        quotes = self.quotes
+        if quotes and self.symbol in quotes.symbols:
+            self.pairs = quotes.best_pair(self.symbol)
+        elif len(self.exchanges) == 2:
+            self.pairs = (0, 1)
+        else:
+            # 没有增量维护时(单独调用策略)扫一遍
+            quotes = BestQuotes()
+            for i in range(len(self.exchanges)):
+                quotes.add_venue()
+                bbo = self.bbo(i)
+                if bbo:
+                    quotes.update(self.symbol, i, bbo.bid, bbo.ask)
+            self.pairs = quotes.best_pair(self.symbol)
+        return self.pairs
+
+    def spread(self, m: int, s: int) -> tuple[float, float]:
+        """主卖副买的价差，主买副卖的价差"""
+        key = (m, s)
+        if self.spreads is None:
+            self.spreads = {}
+        if key not in self.spreads:
+            m_bbo = self.bbo(m)
+            s_bbo = self.bbo(s)
+            self.spreads[key] = (
+                calc_spread(m_bbo.bid, s_bbo.ask),
+                calc_spread(s_bbo.bid, m_bbo.ask),
+            )
+        return self.spreads[key]
+
+    def held(self, fetch) -> list[tuple[int, Position]]:
+        """有仓位的交易所，fetch: (交易对, 仓位表) -> 仓位"""
+        if self.positions is None:
+            self.positions = []
+            for i, ex in enumerate(self.exchanges):
+                pos = fetch(self.symbol, ex.pos)
+                if pos:
+                    self.positions.append((i, pos))
+        return self.positions
@@ -0,0 +1,105 @@
+import asyncio
+import inspect
+import traceback
+from dataclasses import dataclass, field
+from typing import Any, Callable, Generic, TypeVar
+
+from tool import logger
+
+T = TypeVar('T')
+
+
+@dataclass(eq=False)
+class Subscription(Generic[T]):
+    """一个订阅者"""
+    # 处理函数，同步异步都可以；批量订阅时参数是事件列表
+    handler: Callable[[Any], Any]
+    # 只收这些交易对的事件，None为全部
+    symbols: set[str] | None = None
+    # 批量间隔(毫秒)，0为逐条推送
+    batch: float = 0
+    # 处理函数是否是协程
+    is_async: bool = False
+    # 攒着还没推送的事件
+    pending: list[T] = field(default_factory=list)
+
+
+class EventBus(Generic[T]):
+    """
+    进程内事件总线
+    一份解析好的事件推给多个订阅者(策略、监控、录制、统计)，不用各自重复解析或拉取
+    订阅者可以按交易对过滤，可以按间隔批量接收
+    一个订阅者出错只记日志，不影响其他订阅者和发布方
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.log = logger.get_logger(f'EventBus {name}')
+        self.subs: list[Subscription[T]] = []
+        # 批量推送任务的引用，防止被回收
+        self.tasks: set[asyncio.Task] = set()
+
+    def subscribe(
+        self,
+        handler: Callable[[Any], Any],
+        symbols: list[str] | None = None,
+        batch: float = 0,
+    ) -> Subscription[T]:
+        sub = Subscription(
+            handler=handler,
+            symbols=set(symbols) if symbols is not None else None,
+            batch=batch,
+            is_async=inspect.iscoroutinefunction(handler),
+        )
+        self.subs.append(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription[T]):
+        if sub in self.subs:
+            self.subs.remove(sub)
+
+    async def emit(self, event: T):
+        for sub in self.subs:
+            if sub.symbols is not None and event.symbol not in sub.symbols:
+                continue
+            if sub.batch:
+                self.add(sub, event)
+                continue
+            try:
+                if sub.is_async:
+                    await sub.handler(event)
+                else:
+                    sub.handler(event)
+            except Exception:
+                self.log.error(f'订阅者处理出错 {sub.handler}')
+                traceback.print_exc()
+
+    def add(self, sub: Subscription[T], event: T):
+        """批量订阅，第一条事件到的时候开始计时，到点一起推送"""
+        if not sub.pending:
+            loop = asyncio.get_running_loop()
+            loop.call_later(sub.batch / 1000, self.flush, sub)
+        sub.pending.append(event)
+
+    def flush(self, sub: Subscription[T]):
+        events = sub.pending
+        sub.pending = []
+        if not events or sub not in self.subs:
+            return
+        if sub.is_async:
+            task = asyncio.create_task(self.deliver(sub, events))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+            return
+        try:
+            sub.handler(events)
+        except Exception:
+            self.log.error(f'订阅者处理出错 {sub.handler}')
+            traceback.print_exc()
+
+    async def deliver(self, sub: Subscription[T], events: list[T]):
+        try:
+            await sub.handler(events)
+        except Exception:
+            self.log.error(f'订阅者处理出错 {sub.handler}')
+            traceback.print_exc()
@@ -0,0 +1,136 @@
+import asyncio
+import time
+from enum import IntEnum
+
+
+class TokenBucket:
+    """令牌桶 rate:每秒补充的令牌数 capacity:桶容量(允许的突发量)"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity,
+            self.tokens + (now - self.last) * self.rate,
+        )
+        self.last = now
+
+    def try_acquire(self, cost: float = 1, floor: float = 0) -> bool:
+        """尝试取令牌，取完后剩余不能低于floor，不够就返回False"""
+        self.refill()
+        if self.tokens - cost >= floor:
+            self.tokens -= cost
+            return True
+        return False
+
+    async def acquire(self, cost: float = 1, floor: float = 0):
+        """取令牌，不够就等"""
+        while not self.try_acquire(cost, floor):
+            await asyncio.sleep((cost + floor - self.tokens) / self.rate)
+
+
+class Priority(IntEnum):
+    """请求优先级"""
+    CRITICAL = 0  # 下单撤单，可以用满额度；被限频或者额度不够时马上失败不等待(晚到的下单信号已经过时)
+    NORMAL = 1  # 普通请求，不能动用给下单预留的额度，不够就等
+    LOW = 2  # 可丢弃的请求(余额、仓位刷新)，额度不够直接放弃
+
+
+class Governor:
+    """
+    限频调度
+    每类接口一个令牌桶在本地节流，交易所返回的已用量用来校准本地令牌
+    非关键请求给下单预留额度，接近限频时丢弃低优先级请求
+    """
+
+    def __init__(
+        self,
+        limits: dict[str, tuple[float, float]],
+        reserve: float = 0.2,
+        shed_ratio: float = 0.8,
+    ):
+        # 接口类别 -> 令牌桶，limits的值为(每秒速率, 容量)
+        self.buckets = {
+            k: TokenBucket(rate, capacity)
+            for k, (rate, capacity) in limits.items()
+        }
+        # 给下单预留的桶容量比例
+        self.reserve = reserve
+        # 交易所返回的占用比例超过这个值就丢弃低优先级请求
+        self.shed_ratio = shed_ratio
+
+        # (接口类别, 窗口秒数) -> (占用比例, 过期时间)
+        self.used: dict[tuple[str, float], tuple[float, float]] = {}
+        # 被限频(429/418)后禁止请求到这个时间，接口类别 -> 时间
+        self.ban_until: dict[str, float] = {}
+        # 丢弃的请求数
+        self.shed = 0
+
+    def used_ratio(self, kind: str) -> float:
+        """交易所返回的占用比例，多个窗口取最大"""
+        now = time.monotonic()
+        ratio = 0.0
+        for (k, _), (r, expire) in self.used.items():
+            if k == kind and expire > now:
+                ratio = max(ratio, r)
+        return ratio
+
+    def update(self, kind: str, used: float, limit: float, window: float):
+        """用交易所返回的已用量校准"""
+        if kind not in self.buckets or limit <= 0:
+            return
+        ratio = used / limit
+        self.used[(kind, window)] = (ratio, time.monotonic() + window)
+
+        # 交易所的计数比本地多时，扣掉本地令牌
+        bucket = self.buckets[kind]
+        bucket.refill()
+        bucket.tokens = min(bucket.tokens, bucket.capacity * (1 - ratio))
+
+    def block(self, kind: str, seconds: float):
+        """被交易所限频后暂停这类接口的请求"""
+        until = time.monotonic() + seconds
+        self.ban_until[kind] = max(self.ban_until.get(kind, 0.0), until)
+
+    def banned(self, kind: str) -> float:
+        """这类接口还要暂停多少秒，0为没有被限频"""
+        return max(self.ban_until.get(kind, 0.0) - time.monotonic(), 0.0)
+
+    async def acquire(
+        self,
+        kind: str,
+        cost: float = 1,
+        priority: Priority = Priority.NORMAL,
+    ) -> bool:
+        """
+        按优先级取额度
+        return: 低优先级请求被丢弃、关键请求被限频或额度不够时返回False
+        """
+        bucket = self.buckets[kind]
+        floor = 0
+        if priority != Priority.CRITICAL:
+            # 单次消耗很大时预留额度要让一些，否则永远取不到
+            floor = min(bucket.capacity * self.reserve, bucket.capacity - cost)
+            floor = max(floor, 0)
+
+        if priority == Priority.CRITICAL:
+            return not self.banned(kind) and bucket.try_acquire(cost, floor)
+
+        if priority == Priority.LOW:
+            if (self.banned(kind)
+                    or self.used_ratio(kind) >= self.shed_ratio
+                    or not bucket.try_acquire(cost, floor)):
+                self.shed += 1
+                return False
+            return True
+
+        wait = self.banned(kind)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        await bucket.acquire(cost, floor)
+        return True
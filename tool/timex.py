@@ -1,12 +1,20 @@
 import time
 
+# 时钟，回放时替换成模拟时钟
+clock = time.time
+
+
+def set_clock(fn=time.time):
+    """替换时钟(秒级浮点时间戳)"""
+    global clock
+    clock = fn
+
 
 def time_s():
     """秒级时间戳"""
-    return int(time.time())
+    return int(clock())
 
 
 def time_ms():
     """毫秒级时间戳"""
-    return int(round(time.time() * 1000))
-
+    return int(round(clock() * 1000))
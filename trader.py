@@ -1,103 +1,171 @@
 import asyncio
+import functools
 import signal
 import traceback
 
+from exchanges import capture, rule_cache
+from exchanges.startup import Readiness, match_symbols, start_feeds
+from exchanges.feed_service import FEED_SERVICE, FeedSubscriber
+from exchanges.feed_shards import FEED_WORKERS, FeedShards
+from exchanges.watchdog import WATCHDOG, FeedWatchdog
 from exchanges.binance import Binance
 from exchanges.gate import Gate
 from models.models import *
+from strategy.execution import Leg, OrderLock
 from strategy.hedge import HedgeStrategy
+from strategy.host import StrategyHost
+from strategy.quotes import BestQuotes
+from strategy.scheduler import OpportunityQueue, expected_edge
 from strategy.strategy import Strategy
+from strategy.tick import Tick
 from exchanges.exchange import Exchange
+from tool import logger
 from tool.mathx import *
 from tool.timex import *
 from config import settings
 
-QUOTE: str = settings.quote  # 计价币
-SYMBOL_RANG: list[int] = settings.symbol_rang  # 监控的交易对的范围
-SYMBOLS_BLACKLIST: list[str] = settings.symbols_blacklist  # 交易对黑名单
 LEVERAGE: int = settings.leverage  # 开仓杠杆
+ACCOUNTS: list[dict] = settings.accounts  # 多账户，每项一组主副所账户
+STRATEGIES: list[dict] = settings.strategies  # 多策略，每项一组策略参数
 
 
 class Trader:
 
-    def __init__(self, strategy: Strategy):
-        self.strategy = strategy
+    def __init__(self, strategy: Strategy | list[Strategy]):
+        # 多个策略共用一份行情，第一个策略的日志用于输出账户信息
+        strategies = strategy if isinstance(strategy, list) else [strategy]
+        self.strategy = strategies[0]
+        self.host = StrategyHost(strategies)
         self.exchanges: dict[str, Exchange] = {}
-
-        self.orders: dict[str, Order] = {}
+        # 按加入顺序的交易所，下标和最优价里的交易所序号一致
+        self.exchange_list: list[Exchange] = []
 
         # 下单锁
-        self.order_lock: dict = {}
+        self.order_lock = OrderLock()
+        self.order_lock.on_leg = self.on_leg
+
+        # 候选信号按预期收益排队派发
+        self.queue = OpportunityQueue(self.dispatch)
+
+        # 行情就绪跟踪，run里创建
+        self.readiness: Readiness | None = None
+
+        # 各交易所最优价，策略按它选价差最大的一对交易所
+        self.quotes = BestQuotes()
+        self.venues: dict[str, int] = {}
 
     def add_exchagne(self, ex: Exchange):
-        ex.listen_bbo(self.on_bbo)
+        self.venues[ex.__class__.__name__] = self.quotes.add_venue()
+        ex.listen_bbo(functools.partial(self.on_bbo, ex))
         ex.listen_order(self.on_order)
+        ex.listen_pos(self.on_pos)
         self.exchanges[ex.__class__.__name__] = ex
+        self.exchange_list.append(ex)
 
-    async def on_bbo(self, bbo: BBO):
+    async def on_bbo(self, ex: Exchange, bbo: BBO):
         symbol = bbo.symbol
         now = time_ms()
 
+        # 归一化后的价格更新最优价
+        last = ex.get_last_bbo(symbol)
+        if last:
+            self.quotes.update(symbol, self.venues[ex.__class__.__name__],
+                               last.bid, last.ask)
+
         # 拦截锁
-        if symbol in self.order_lock:
+        if self.order_lock.locked(symbol):
             return
 
-        signal = self.strategy.gen_signal(
-            now,
-            symbol,
-            list(self.exchanges.values()),
-        )
-        if signal:
-            self.order_lock[symbol] = now
-            await self.trade(now, signal)
-
-            for ex in self.exchanges.values():
-                await ex.update_balance()
-                ex.pos = await ex.get_positions()
-
-            # todo 暂时用这种方式解决高频下仓位更新不及时的问题
-            await asyncio.sleep(2)
-            del self.order_lock[symbol]
-
-    async def on_order(self, order: Order):
-        return
+        # 所有交易所的行情都到了才开始交易
+        if self.readiness and not self.readiness.check(symbol):
+            return
 
-        order_key = order.ex_name + order.id
-        price = order.price
-        deal_price = order.deal_price
+        # 各策略共用这笔行情的公共数据，同一交易对只留预期收益最高的信号
+        tick = Tick(now, symbol, self.exchange_list, self.quotes)
+        best = None
+        for signal in self.host.on_tick(tick):
+            edge = expected_edge(signal, self.exchanges)
+            if not best or edge > best[0]:
+                best = (edge, signal)
+        if best:
+            self.queue.add(now, best[1], best[0])
+
+    async def dispatch(self):
+        """
+        按预期收益从高到低派发候选信号
+        保证金或者下单额度不够的放弃，下一笔行情会重新产生信号
+        """
+        spent: dict[str, int] = {}
+        runs = []
+        for now, signal in self.queue.drain():
+            if self.order_lock.locked(signal.symbol):
+                continue
+            if not self.admit(signal, spent):
+                continue
+            self.begin(now, signal)
+            runs.append(self.execute(now, signal))
+        await asyncio.gather(*runs)
+
+    def margin(self, ex: Exchange, symbol: str, ex_signal: ExchangeSignal) -> float:
+        """开仓需要的保证金"""
+        rule = ex.get_rule(symbol)
+        value = ex_signal.price * ex_signal.amount * rule.contract_size
+        return value / rule.trade_leverage
+
+    def admit(self, signal: Signal, spent: dict[str, int]) -> bool:
+        """
+        检查保证金和下单额度
+        spent: 这一轮已经派发的下单数，下单时才取令牌，这里要先算上
+        """
+        for ex_signal in signal.exchanges:
+            ex = self.exchanges[ex_signal.ex_name]
+            # 任何一边被限频都不下，否则另一边单腿成交
+            if ex.governor.banned('order'):
+                return False
+            bucket = ex.governor.buckets['order']
+            bucket.refill()
+            if bucket.tokens < spent.get(ex_signal.ex_name, 0) + 1:
+                return False
+            if ex_signal.tside == TradeSide.OPEN:
+                if self.margin(ex, signal.symbol, ex_signal) > ex.available():
+                    return False
 
-        # 市价单一般开仓价格都是0，这里用下单时记录的行情替代
-        if price == 0:
-            price = self.orders[order_key].price
+        for ex_signal in signal.exchanges:
+            spent[ex_signal.ex_name] = spent.get(ex_signal.ex_name, 0) + 1
+        return True
 
-        if order.status == OrderStatus.FILLED:
-            if price == 0 or deal_price == 0:
-                self.strategy.log.error(f"回调中的成交订单价格异常: {order}")
-                return
+    def begin(self, now: int, signal: Signal):
+        """加下单锁，开仓预占保证金，同一轮后面的信号看到的就是扣掉后的余额"""
+        symbol = signal.symbol
+        legs = {}
+        bases = {}
+        for ex_signal in signal.exchanges:
+            ex = self.exchanges[ex_signal.ex_name]
+            ex_symbol = ex.get_rule(symbol).symbol
+            legs[ex_signal.ex_name] = ex_symbol
+            # 这一单会改变的仓位: 开仓是同方向的仓位，平仓是反方向的仓位
+            pos_side = ex_signal.side
+            if ex_signal.tside == TradeSide.CLOSE:
+                pos_side = Side.SELL if pos_side == Side.BUY else Side.BUY
+            pos = ex.pos.get(ex_symbol + str(pos_side))
+            bases[ex_signal.ex_name] = (pos_side, pos.amount if pos else 0.0)
+            if ex_signal.tside == TradeSide.OPEN:
+                ex.reserve(symbol, self.margin(ex, symbol, ex_signal))
+        self.order_lock.acquire(symbol, legs, now, bases)
+
+    async def execute(self, now: int, signal: Signal):
+        """下单，下单锁由成交和仓位推送释放(见OrderLock)，账户和仓位由私有流推送更新"""
+        await self.trade(now, signal)
+
+    def on_leg(self, symbol: str, leg: Leg):
+        """一条腿结束，成交的保证金已经计入可用余额，释放预占"""
+        self.exchanges[leg.ex_name].unreserve(symbol)
+
+    async def on_pos(self, pos: Position):
+        self.order_lock.on_pos(pos.ex_name, pos)
 
-            symbol = order.symbol
-            side = order.side
-            tside = order.trade_side
-
-            # 计算滑点
-            slip = floor(deal_price - price / price, 4) * 100
-
-            msg = f'{symbol} '
-            msg += '开' if tside == TradeSide.OPEN else '平'
-            msg += '多' if side == Side.BUY else '空'
-            msg += f'仓滑点:{slip}%'
-            self.strategy.log.info(msg)
-
-        # 订单结束,清除订单记录
-        if order.status in [
-                OrderStatus.PARTIALLY_FILLED,
-                OrderStatus.FILLED,
-                OrderStatus.CANCELED,
-        ]:
-            if order_key in self.orders:
-                del self.orders[order_key]
-        elif len(self.orders) > 500:
-            self.orders = dict(list(self.orders.items())[-100:])
+    async def on_order(self, order: Order):
+        self.order_lock.on_order(order)
 
     async def trade(self, market_time: int, signal: Signal):
         symbol = signal.symbol
@@ -119,6 +187,7 @@ class Trader:
             tasks.append(f)
         for task in tasks:
             ex_name, id = await task
+            self.order_lock.placed(symbol, ex_name, id)
             if id:
                 ids[ex_name] = id
 
@@ -153,132 +222,154 @@ class Trader:
         msg += f' 价差:{floor(signal.spread * 100, 2)}% 方向:{ex_signal.side},{ex_signal.tside} 类型:{signal.type} 价格:{ex_signal.price} 数量:{ex_signal.amount}'
         ex.log.info(msg)
 
-        ex_name = ex.__class__.__name__
-
-        # order = Order(
-        #     ex_name=ex_name,
-        #     symbol=signal.symbol,
-        #     id=id,
-        #     status=OrderStatus.NEW,
-        #     side=ex_signal.side,
-        #     trade_side=ex_signal.tside,
-        #     price=ex_signal.price,
-        #     amount=ex_signal.amount,
-        #     c_time=now,
-        # )
-        # self.orders[ex_name + id] = order
-
-        return ex_name, id
+        return ex.__class__.__name__, id
 
     def match_symbols(self) -> list[str]:
-        symbols: list[str] = []
+        return match_symbols(list(self.exchanges.values()))
 
+    async def load_rules(self) -> list[asyncio.Task]:
+        """加载交易规则，优先用缓存，用了缓存的马上在后台刷新"""
         exchanges = list(self.exchanges.values())
-        master = exchanges[0]
-        slaves = exchanges[1:]
-        ex_len = len(self.exchanges)
-        if ex_len == 1:
-            for r in master.rules:
-                symbols.append(r)
-        elif ex_len > 1:
-            for r in master.rules:
-                match = False
-                for ex in slaves:
-                    if r in ex.rules or "1000" + r in ex.rules or r.replace(
-                            "1000", "") in ex.rules:
-                        match = True
-                    else:
-                        match = False
-                        break
-                if match:
-                    symbols.append(r)
-
-        # 过滤
-        filter_symbols = []
-        for symbol in symbols:
-            # 过滤报价币
-            if not symbol.endswith(QUOTE):
-                continue
+        cached = await asyncio.gather(*[ex.load_rules() for ex in exchanges])
+        tasks = []
+        for ex, hit in zip(exchanges, cached):
+            delay = 0 if hit else rule_cache.RULES_CACHE_TTL
+            tasks.append(asyncio.create_task(ex.loop_refresh_rules(delay)))
+        return tasks
 
-            # 过滤黑名单
-            if symbol in SYMBOLS_BLACKLIST:
-                continue
+    async def prepare(self) -> list[asyncio.Task]:
+        """账户相关的准备: 余额、杠杆、私有流和ws api"""
+        exchanges = list(self.exchanges.values())
 
-            filter_symbols.append(symbol)
-        symbols = filter_symbols
-
-        # 允许自由配置
-        if len(SYMBOL_RANG) >= 2:
-            start = SYMBOL_RANG[0]
-            end = SYMBOL_RANG[1]
-            if start == 0:
-                if end != 0: return symbols[:end]
-            else:
-                if end != 0:
-                    return symbols[start:end]
+        # 更新余额
+        balance_total = 0
+        msg = ''
+        for ex in exchanges:
+            await ex.update_balance()
+            ex_name = ex.__class__.__name__
+            balance = ex.account.swap_balance
+            balance_total += balance
+            msg += f' {ex_name}余额:{balance}'
+        self.strategy.log.info(f"资金总额:{balance_total} {msg}")
+
+        # 计算公共杠杆
+        leverages: dict[str, int] = {}
+        for ex in exchanges:
+            for symbol in self.symbols:
+                rule = ex.get_rule(symbol)
+                if not rule:
+                    continue
+                if symbol in leverages:
+                    l = leverages[symbol]
+                    leverages[symbol] = min(rule.max_leverage, l)
                 else:
-                    return symbols[start:]
-
-        return symbols
+                    leverages[symbol] = min(rule.max_leverage, LEVERAGE)
+
+        # 设置公共杠杆
+        targets: dict[str, dict[str, int]] = {}
+        for symbol, leverage in leverages.items():
+            for ex in exchanges:
+                rule = ex.get_rule(symbol)
+                if not rule:
+                    continue
+                rule.trade_leverage = leverage
+                ex_targets = targets.setdefault(ex.__class__.__name__, {})
+                ex_targets[rule.symbol] = leverage
+
+        # 各交易所并发调整，只改和目标不一致的
+        results = await asyncio.gather(*[
+            ex.reconcile_leverage(targets.get(ex.__class__.__name__, {}))
+            for ex in exchanges
+        ])
+        for ex, errs in zip(exchanges, results):
+            for symbol, err in errs.items():
+                ex.log.error(f'{symbol} 设置杠杆失败: {err}')
+
+        tasks = [
+            asyncio.create_task(self.order_lock.loop_timeout()),
+            asyncio.create_task(self.host.loop_report()),
+        ]
+        # 监听账号ws
+        for ex in exchanges:
+            tasks.append(asyncio.create_task(ex.listen_private()))
+            tasks.append(asyncio.create_task(ex.listen_ws_api(5)))
+        return tasks
+
+    def start_market(self) -> list[asyncio.Task]:
+        """监听行情ws，按交易对就绪后开始交易"""
+        exchanges = list(self.exchanges.values())
+        self.readiness = Readiness(exchanges, self.symbols)
+        tasks = [asyncio.create_task(self.readiness.loop_report())]
+        if FEED_SERVICE:
+            # 读本地行情服务，不占交易所连接
+            feed = FeedSubscriber(exchanges, self.symbols)
+            tasks.append(asyncio.create_task(feed.run()))
+        elif FEED_WORKERS > 0:
+            # 行情分片到多个进程，主进程只读共享内存表
+            feed = FeedShards(exchanges, self.symbols)
+            tasks.append(asyncio.create_task(feed.run()))
+        else:
+            tasks += start_feeds(exchanges, self.symbols)
+            if WATCHDOG:
+                # 连接在本进程里，行情中断时可以直接重连
+                watchdog = FeedWatchdog(exchanges, self.symbols)
+                tasks.append(asyncio.create_task(watchdog.loop_check()))
+        return tasks
 
     async def run(self, symbols: list[str] = []):
         try:
-            # 加载交易规则
-            for ex in self.exchanges.values():
-                ex.rules = await ex.get_rules()
+            tasks = await self.load_rules()
 
             # 匹配交易对
             self.symbols = symbols if symbols else self.match_symbols()
             if not self.symbols:
-                self.strategy.log.error("主副所中没有匹配的交易对")
+                self.strategy.log.error("交易所之间没有匹配的交易对")
                 return
             self.strategy.log.info(f"找到 {len(self.symbols)} 个匹配的交易对")
 
-            # 更新余额
-            balance_total = 0
-            msg = ''
-            for ex in self.exchanges.values():
-                await ex.update_balance()
-                ex_name = ex.__class__.__name__
-                balance = ex.account.swap_balance
-                balance_total += balance
-                msg += f' {ex_name}余额:{balance}'
-            self.strategy.log.info(f"资金总额:{balance_total} {msg}")
-
-            # 计算公共杠杆
-            leverages: dict[str, int] = {}
-            for ex in self.exchanges.values():
-                for symbol in self.symbols:
-                    rule = ex.get_rule(symbol)
-                    if symbol in leverages:
-                        l = leverages[symbol]
-                        leverages[symbol] = min(rule.max_leverage, l)
-                    else:
-                        leverages[symbol] = min(rule.max_leverage, LEVERAGE)
-
-            # 设置公共杠杆
-            for symbol, leverage in leverages.items():
-                for ex in self.exchanges.values():
-                    time.sleep(0.1)
-                    rule = ex.get_rule(symbol)
-                    rule.trade_leverage = leverage
-
-                    # continue # 测试时打开，提高debug速度
-                    err = await ex.set_leverage(rule.symbol, leverage)
-                    if err:
-                        ex.log.error(f'{rule.symbol} 设置杠杆失败: {err}')
-
-            # 启动ws监听
-            tasks = []
-            # 监听账号ws
-            for ex in self.exchanges.values():
-                tasks.append(asyncio.create_task(ex.listen_private()))
-                tasks.append(asyncio.create_task(ex.listen_ws_api(5)))
-            # 监听行情ws
-            for symbol in self.symbols:
-                await asyncio.sleep(0.1)
-                for ex in self.exchanges.values():
-                    tasks.append(asyncio.create_task(ex.listen_public(symbol)))
+            tasks += await self.prepare()
+            tasks += self.start_market()
+            await asyncio.gather(*tasks)
+            print('任务完成')
+        except asyncio.CancelledError:
+            print("main: 任务被取消")
+        except Exception as e:
+            print(f"main: 报错 {e}")
+            traceback.print_exc()
+
+
+class TraderGroup:
+    """
+    一个进程跑多个账户
+    每个账户一个Trader: 自己的私有流、ws api、余额、仓位、下单锁和保证金预占
+    第一个账户的交易所对象负责行情和交易规则，其他账户共用(见Exchange.share_market)
+    同一条行情推给所有账户，各自产生信号、各自下单
+    """
+
+    def __init__(self, traders: list[Trader]):
+        self.log = logger.get_logger(self.__class__.__name__)
+        self.traders = traders
+
+    async def run(self, symbols: list[str] = []):
+        try:
+            lead = self.traders[0]
+            tasks = await lead.load_rules()
+            for trader in self.traders[1:]:
+                for name, ex in trader.exchanges.items():
+                    ex.share_market(lead.exchanges[name])
+
+            symbols = symbols if symbols else lead.match_symbols()
+            if not symbols:
+                self.log.error("交易所之间没有匹配的交易对")
+                return
+            self.log.info(f"{len(self.traders)} 个账户 找到 {len(symbols)} 个匹配的交易对")
+
+            for trader in self.traders:
+                trader.symbols = symbols
+                tasks += await trader.prepare()
+            tasks += lead.start_market()
+            for trader in self.traders[1:]:
+                trader.readiness = lead.readiness
             await asyncio.gather(*tasks)
             print('任务完成')
         except asyncio.CancelledError:
@@ -309,26 +400,36 @@ async def shutdown(loop, signal=None):
 
 
 if __name__ == '__main__':
-    hedge = HedgeStrategy()
-    trader = Trader(hedge)
-
-    s1 = Secret(
-        key=settings.master.key,
-        secret=settings.master.secret,
-        api_key=settings.master.api_key,
-        private_key=settings.master.private_key,
-        public_key=settings.master.public_key,
-    )
-    trader.add_exchagne(Binance(s1))
-
-    s2 = Secret(
-        key=settings.slave.key,
-        secret=settings.slave.secret,
-        api_key=settings.slave.api_key,
-        private_key=settings.slave.private_key,
-        public_key=settings.slave.public_key,
-    )
-    trader.add_exchagne(Gate(s2))
+
+    def secret(conf, name: str = '') -> Secret:
+        return Secret(
+            key=conf.key,
+            secret=conf.secret,
+            api_key=conf.api_key,
+            private_key=conf.private_key,
+            public_key=conf.public_key,
+            name=name,
+        )
+
+    def strategies() -> list[Strategy]:
+        if not STRATEGIES:
+            return [HedgeStrategy()]
+        return [HedgeStrategy(**conf) for conf in STRATEGIES]
+
+    # 没有配置多账户时只用master和slave
+    accounts = ACCOUNTS or [{'master': settings.master, 'slave': settings.slave}]
+    traders = []
+    for i, account in enumerate(accounts):
+        name = account.get('name', str(i)) if len(accounts) > 1 else ''
+        trader = Trader(strategies())
+        trader.add_exchagne(Binance(secret(account['master'], name)))
+        trader.add_exchagne(Gate(secret(account['slave'], name)))
+        traders.append(trader)
+    main = traders[0].run([]) if len(traders) == 1 else TraderGroup(traders).run([])
+
+    # 录制ws原始帧
+    if capture.CAPTURE:
+        capture.enable_capture()
 
     loop = asyncio.new_event_loop()
     for sig in (signal.SIGINT, signal.SIGTERM):
@@ -336,7 +437,7 @@ if __name__ == '__main__':
             sig, lambda s=sig: asyncio.create_task(shutdown(loop, signal=s)))
 
     try:
-        loop.run_until_complete(trader.run([]))
+        loop.run_until_complete(main)
     except KeyboardInterrupt:
         print("\n程序被手动中断")
     except Exception as e:
@@ -348,4 +449,6 @@ if __name__ == '__main__':
             loop.run_until_complete(
                 asyncio.gather(*pending, return_exceptions=True))
         loop.close()
+        if capture.capture:
+            capture.capture.stop()
         print("事件循环已关闭")